@@ -0,0 +1,44 @@
+# Generated by Django 5.0.1 on 2026-10-17 21:25
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CreatorProfile',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('profile_image', models.ImageField(blank=True, null=True, upload_to='img/creators/')),
+                ('account_number', models.CharField(blank=True, max_length=20, null=True)),
+                ('patron_title', models.CharField(max_length=150, unique=True)),
+                ('about', models.TextField(blank=True)),
+                ('city', models.CharField(blank=True, max_length=50, null=True)),
+                ('country', models.CharField(blank=True, default='Zambia', max_length=50)),
+                ('address', models.CharField(blank=True, default='Zambia resident', max_length=300)),
+                ('creator_category', models.CharField(choices=[('artist', 'Artist'), ('musician', 'Musician'), ('videocreator', 'Video Creator'), ('podcaster', 'Podcaster'), ('other', 'Other')], default='other', max_length=50)),
+                ('facebook_url', models.URLField(blank=True, null=True)),
+                ('twitter_url', models.URLField(blank=True, null=True)),
+                ('instagram_url', models.URLField(blank=True, null=True)),
+                ('linkedin_url', models.URLField(blank=True, null=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='PatronProfile',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('profile_image', models.ImageField(blank=True, null=True, upload_to='img/creators/')),
+                ('account_number', models.CharField(blank=True, max_length=20, null=True)),
+                ('city', models.CharField(blank=True, max_length=50)),
+            ],
+        ),
+    ]
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import (LipilaDisbursement, LipilaCollection)
+from .models import (LipilaDisbursement, LipilaCollection, MomoApiUser)
 from business.models import Product, BNPL, Student
 from lipila.models import (
     ContactInfo, CustomerMessage,
@@ -49,6 +49,10 @@ class LipilaCollectionAdmin(admin.ModelAdmin):
                   'reference_id', 'payment_method', 'description']
 
 
+class MomoApiUserAdmin(admin.ModelAdmin):
+    list_display = ['product', 'target_environment', 'api_user', 'created_at']
+
+
 class ProductAdmin(admin.ModelAdmin):
     list_display = ('name', 'owner', 'price',
                     'date_created', 'description', 'quantity')
@@ -111,6 +115,7 @@ admin.site.register(ProcessedWithdrawals, ProcessedWithdrawalAdmin)
 admin.site.register(WithdrawalRequest, WithdrawalRequestAdmin)
 admin.site.register(LipilaDisbursement, DisbursementAdmin)
 admin.site.register(LipilaCollection, LipilaCollectionAdmin)
+admin.site.register(MomoApiUser, MomoApiUserAdmin)
 admin.site.register(Product, ProductAdmin)
 admin.site.register(BNPL, BNPLAdmin)
 admin.site.register(ContactInfo, ContactInfoAdmin)
@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class student_transactionsConfig(AppConfig):
     name = 'api'
+
+    def ready(self):
+        # connects the token and user cache invalidation signals
+        from api import authentication, users  # noqa: F401
@@ -0,0 +1,90 @@
+"""
+Token authentication that keeps resolved tokens in the django cache
+"""
+import hashlib
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+from rest_framework.permissions import BasePermission
+
+
+class TokenAuthCache():
+    """
+    Caches the user and token behind an api token for API_TOKEN_CACHE_TTL
+    seconds in the django cache named by API_TOKEN_CACHE, the default cache
+    when empty. Entries are dropped when the token is deleted or its user is
+    saved, e.g deactivated. Use a shared cache so every worker process sees
+    the invalidation, a process memory cache only drops its own entries and
+    the others expire after the TTL.
+    """
+
+    @staticmethod
+    def make_key(key: str) -> str:
+        """Builds the cache key of a token, hashed so it never appears in the cache"""
+        return f"api:token:{hashlib.sha256(key.encode('utf-8')).hexdigest()[:32]}"
+
+    @property
+    def cache(self):
+        return caches[getattr(settings, 'API_TOKEN_CACHE', '') or 'default']
+
+    def get(self, key: str):
+        """Returns the cached (user, token) of a token key or None"""
+        return self.cache.get(self.make_key(key))
+
+    def set(self, user, token: Token):
+        """Caches a token with its user"""
+        self.cache.set(self.make_key(token.key), (user, token),
+                       getattr(settings, 'API_TOKEN_CACHE_TTL', 300))
+
+    def delete(self, key: str):
+        self.cache.delete(self.make_key(key))
+
+
+token_auth_cache = TokenAuthCache()
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    A drop-in replacement of rest_framework TokenAuthentication that reads
+    the database only when a token is not in token_auth_cache.
+    """
+
+    def authenticate_credentials(self, key):
+        cached = token_auth_cache.get(key)
+        if cached is not None:
+            return cached
+        user, token = super().authenticate_credentials(key)
+        token_auth_cache.set(user, token)
+        return user, token
+
+
+class IsApiUser(BasePermission):
+    """
+    Lets through requests authenticated with an api key. Requests without
+    credentials are only let through when API_ALLOW_ANONYMOUS is set, their
+    payments then belong to the default api user.
+    """
+
+    def has_permission(self, request, view):
+        if request.user and request.user.is_authenticated:
+            return True
+        return getattr(settings, 'API_ALLOW_ANONYMOUS', False)
+
+
+@receiver(post_delete, sender=Token)
+def forget_deleted_token(sender, instance, **kwargs):
+    token_auth_cache.delete(instance.key)
+
+
+@receiver(post_save, sender=get_user_model())
+def forget_user_tokens(sender, instance, created, update_fields=None, **kwargs):
+    if created or update_fields == frozenset(['last_login']):
+        # logins only change last_login
+        return
+    for key in Token.objects.filter(user=instance).values_list('key', flat=True):
+        token_auth_cache.delete(key)
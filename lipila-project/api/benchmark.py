@@ -0,0 +1,168 @@
+"""
+Times the queries of the transaction tables with and without their indexes
+"""
+import random
+import statistics
+import time
+import uuid
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.db.models import F, Q, Sum
+from django.utils import timezone
+
+from accounts.models import CreatorProfile
+from api.models import LipilaCollection, LipilaDisbursement
+from patron.models import Contributions, Payments, Tier, TierSubscriptions, WithdrawalRequest
+
+MODELS = (LipilaCollection, LipilaDisbursement, Payments, Contributions, WithdrawalRequest)
+STATUSES = ('pending', 'accepted', 'success', 'failed')
+
+
+def analyze():
+    """Updates the statistics the query planner uses"""
+    if connection.vendor in ('sqlite', 'postgresql'):
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+
+def seed(rows: int, merchants: int = 20, batch_size: int = 1000) -> dict:
+    """
+    Fills the transaction tables with random rows.
+
+    Args:
+        rows(int): Rows per transaction table.
+        merchants(int): Api users and creators the rows are spread over.
+        batch_size(int): Rows per insert.
+
+    Returns:
+        dict: The users, creator profiles and subscriptions the rows belong to.
+    """
+    now = timezone.now()
+    users = User.objects.bulk_create(
+        [User(username=f'benchmark-{uuid.uuid4().hex[:12]}') for i in range(merchants)])
+    creators = CreatorProfile.objects.bulk_create(
+        [CreatorProfile(user=user, patron_title=user.username) for user in users])
+    tiers = Tier.objects.bulk_create(
+        [Tier(name='Fan', description='', price=25, creator=creator) for creator in creators])
+    subscriptions = TierSubscriptions.objects.bulk_create(
+        [TierSubscriptions(patron=random.choice(users), tier=tier) for tier in tiers])
+
+    def row(model):
+        status = random.choice(STATUSES)
+        amount = random.randint(1, 1000)
+        reference_id = str(uuid.uuid4())
+        if model is LipilaCollection or model is LipilaDisbursement:
+            account = 'payer_account_number' if model is LipilaCollection else 'payee_account_number'
+            updated_at = now - timedelta(seconds=random.randint(0, 90 * 86400))
+            return model(**{account: '0966443322'}, api_user=random.choice(users), amount=amount,
+                         payment_method='mtn', reference_id=reference_id, status=status,
+                         updated_at=updated_at,
+                         next_poll_at=updated_at + timedelta(seconds=5) if status == 'accepted' else None)
+        if model is Payments:
+            return Payments(subscription=random.choice(subscriptions), amount=amount,
+                            reference_id=reference_id, status=status)
+        if model is Contributions:
+            return Contributions(creator=random.choice(users), patron=random.choice(users),
+                                 amount=amount, reference_id=reference_id, status=status)
+        return WithdrawalRequest(creator=random.choice(creators), amount=amount,
+                                 account_number='0966443322', reference_id=reference_id,
+                                 status=status)
+
+    for model in MODELS:
+        for start in range(0, rows, batch_size):
+            model.objects.bulk_create(
+                [row(model) for i in range(start, min(start + batch_size, rows))])
+    analyze()
+    return {'users': users, 'creators': creators, 'subscriptions': subscriptions}
+
+
+def get_queries(users: list, creators: list) -> dict:
+    """
+    Returns the access paths of the transaction tables, as functions that
+    build their queryset for a random merchant.
+    """
+    def due(model):
+        return model.objects.filter(
+            Q(next_poll_at__isnull=True) | Q(next_poll_at__lte=timezone.now()),
+            status='accepted').order_by(F('next_poll_at').asc(nulls_first=True))[:100]
+
+    return {
+        'collections list': lambda: LipilaCollection.objects.filter(
+            api_user=random.choice(users)).order_by('-updated_at', '-id')[:100],
+        'disbursements list': lambda: LipilaDisbursement.objects.filter(
+            api_user=random.choice(users)).order_by('-updated_at', '-id')[:100],
+        'collections due': lambda: due(LipilaCollection),
+        'disbursements due': lambda: due(LipilaDisbursement),
+        'payments total': lambda: Payments.objects.filter(
+            subscription__tier__creator=random.choice(creators), status='success').values(
+            'status').annotate(total=Sum('amount')),
+        'contributions total': lambda: Contributions.objects.filter(
+            creator=random.choice(users), status='success').values(
+            'status').annotate(total=Sum('amount')),
+        'withdrawals total': lambda: WithdrawalRequest.objects.filter(
+            creator=random.choice(creators), status='success').values(
+            'status').annotate(total=Sum('amount')),
+        'pending withdrawals': lambda: WithdrawalRequest.objects.filter(
+            creator=random.choice(creators), status='pending'),
+    }
+
+
+def time_queries(queries: dict, repeat: int = 50) -> dict:
+    """
+    Runs every query repeat times.
+
+    Returns:
+        dict: The median and slowest run of every query in milliseconds.
+    """
+    timings = {}
+    for name, build in queries.items():
+        runs = []
+        for i in range(repeat):
+            queryset = build()
+            start = time.perf_counter()
+            list(queryset)
+            runs.append((time.perf_counter() - start) * 1000)
+        timings[name] = {'median': statistics.median(runs), 'max': max(runs)}
+    return timings
+
+
+def explain(queries: dict) -> dict:
+    """Returns the query plan of every query"""
+    return {name: build().explain() for name, build in queries.items()}
+
+
+def drop_indexes():
+    """Drops the indexes declared in Meta.indexes of the transaction models"""
+    with connection.schema_editor() as editor:
+        for model in MODELS:
+            for index in model._meta.indexes:
+                editor.remove_index(model, index)
+
+
+def create_indexes():
+    """Creates the indexes dropped by drop_indexes"""
+    with connection.schema_editor() as editor:
+        for model in MODELS:
+            for index in model._meta.indexes:
+                editor.add_index(model, index)
+
+
+def run(rows: int, merchants: int = 20, repeat: int = 50) -> dict:
+    """
+    Seeds the tables and times every query without the indexes, then with them.
+    Run it against a scratch database, see the benchmark_queries command.
+
+    Returns:
+        dict: 'before' and 'after' timings from time_queries and the plans
+        of both runs from explain.
+    """
+    seeded = seed(rows, merchants)
+    queries = get_queries(seeded['users'], seeded['creators'])
+    drop_indexes()
+    before, before_plans = time_queries(queries, repeat), explain(queries)
+    create_indexes()
+    analyze()
+    after, after_plans = time_queries(queries, repeat), explain(queries)
+    return {'before': before, 'after': after, 'before_plans': before_plans, 'after_plans': after_plans}
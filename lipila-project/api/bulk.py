@@ -0,0 +1,233 @@
+"""
+Bulk payment functions
+"""
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+import requests
+from django.conf import settings
+from django.utils import timezone
+from rest_framework.response import Response
+
+from api.models import LipilaCollection, LipilaDisbursement
+from api.momo import ratelimit
+from api.momo.breaker import GatewayUnavailable
+from api.momo.gateways import get_client, get_provider, get_quota_name
+from api.momo.pool import is_not_sent
+from api.momo.router import router
+from api.serializers import LipilaCollectionSerializer, LipilaDisbursementSerializer
+from api.transactions import schedule_first_poll
+from api.utils import generate_reference_id, is_deposit_details_valid, is_payment_details_valid
+
+# how a batch of every product is validated, saved and sent
+PRODUCTS = {
+    'collection': {
+        'model': LipilaCollection,
+        'serializer': LipilaCollectionSerializer,
+        'account': 'payer_account_number',
+        'is_valid': is_payment_details_valid,
+        'subscription_key': 'subscription_col_key',
+        'send': lambda momo, payment: momo.request_to_pay(
+            amount=str(payment.amount), payer=payment.payer_account_number,
+            reference_id=payment.reference_id),
+    },
+    'disbursement': {
+        'model': LipilaDisbursement,
+        'serializer': LipilaDisbursementSerializer,
+        'account': 'payee_account_number',
+        'is_valid': is_deposit_details_valid,
+        'subscription_key': 'subscription_dis_key',
+        'send': lambda momo, payment: momo.deposit(
+            amount=str(payment.amount), payee=payment.payee_account_number,
+            reference_id=payment.reference_id),
+    },
+}
+
+
+def run_concurrently(func, items: list, concurrency: int) -> list:
+    """
+    Calls func on every item using at most concurrency threads.
+
+    Args:
+        func(callable): Called with one item, should not raise.
+        items(list): The items to process.
+        concurrency(int): The maximum number of concurrent calls.
+
+    Returns:
+        list: The results in the order of items.
+    """
+    if not items:
+        return []
+    with ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(items)))) as executor:
+        return list(executor.map(func, items))
+
+
+def validate_payments(items: list, product: str) -> tuple:
+    """
+    Validates a batch of collections or disbursements before any of them is sent.
+
+    Args:
+        items(list): dicts with payer_account_number (collections) or
+            payee_account_number (disbursements), amount, payment_method,
+            description and an optional reference_id.
+        product(str): collection or disbursement.
+
+    Returns:
+        tuple: (valid, invalid) lists. Valid items are unsaved LipilaCollection
+        or LipilaDisbursement objects, invalid items are result dicts with the reason.
+    """
+    spec = PRODUCTS[product]
+    model, account = spec['model'], spec['account']
+    valid, invalid = [], []
+    seen = set()
+    for index, item in enumerate(items):
+        if not isinstance(item, dict):
+            invalid.append({'index': index, 'status': 'invalid', 'reason': 'Item must be an object'})
+            continue
+        reference_id = str(item.get('reference_id') or generate_reference_id())
+        serializer = spec['serializer'](data=item)
+        reason = None
+        if not serializer.is_valid():
+            reason = 'Data not valid'
+        else:
+            try:
+                spec['is_valid'](str(item['amount']), str(item[account]), reference_id)
+            except (ValueError, TypeError) as e:
+                reason = str(e)
+        if reason is None and reference_id in seen:
+            reason = 'Duplicate reference id'
+        if reason is not None:
+            invalid.append({'index': index, 'reference_id': reference_id,
+                            'status': 'invalid', 'reason': reason})
+            continue
+        seen.add(reference_id)
+        valid.append(model(reference_id=reference_id, **serializer.validated_data))
+
+    existing = set(model.objects.filter(
+        reference_id__in=seen).values_list('reference_id', flat=True))
+    if existing:
+        invalid += [{'reference_id': payment.reference_id, 'status': 'invalid',
+                     'reason': 'Duplicate reference id'}
+                    for payment in valid if payment.reference_id in existing]
+        valid = [payment for payment in valid if payment.reference_id not in existing]
+    return valid, invalid
+
+
+def bulk_send(api_user, items: list, product: str, concurrency: int = None) -> dict:
+    """
+    Validates a batch of collections or disbursements, saves them with one
+    insert and sends them concurrently, authorizing once per gateway. Items
+    that fail validation or whose account is not an active mobile money
+    account are reported and not sent. Payments the gateway may have taken,
+    e.g the call timed out or the gateway answered 5xx, are polled instead
+    of failed.
+
+    Args:
+        api_user(User): The owner of the payments.
+        items(list): See validate_payments.
+        product(str): collection or disbursement.
+        concurrency(int): Maximum concurrent gateway calls, defaults to MOMO_BULK_CONCURRENCY.
+
+    Returns:
+        dict: counts per status and the result of every item.
+    """
+    if concurrency is None:
+        concurrency = getattr(settings, 'MOMO_BULK_CONCURRENCY', 8)
+    spec = PRODUCTS[product]
+    account = spec['account']
+    valid, invalid = validate_payments(items, product)
+
+    for payment in valid:
+        payment.payment_method = router.get_providers(
+            payment.payment_method, getattr(payment, account))[0]
+
+    # one ready client per gateway, None when the gateway can not be reached
+    clients = {}
+    for provider in {get_provider(payment.payment_method) for payment in valid}:
+        momo = get_client(provider, product)
+        try:
+            clients[provider] = momo if momo.setup() else None
+        except (GatewayUnavailable, requests.RequestException, httpx.HTTPError):
+            clients[provider] = None
+
+    for provider, momo in clients.items():
+        if momo is None or not hasattr(momo, 'validate_accounts'):
+            continue
+        # accounts that are not registered are dropped before anything is saved
+        payments = [payment for payment in valid if get_provider(payment.payment_method) == provider]
+        accounts = momo.validate_accounts(
+            getattr(momo, spec['subscription_key']), product,
+            [getattr(payment, account) for payment in payments], concurrency)
+        inactive = {payment.reference_id for payment in payments
+                    if accounts.get(str(getattr(payment, account))) is False}
+        invalid += [{'reference_id': payment.reference_id, 'status': 'invalid',
+                     'reason': 'Account holder not active'}
+                    for payment in payments if payment.reference_id in inactive]
+        valid = [payment for payment in valid if payment.reference_id not in inactive]
+    results = list(invalid)
+
+    if valid:
+        now = timezone.now()
+        for payment in valid:
+            payment.api_user = api_user
+            payment.updated_at = now
+        payments = spec['model'].objects.bulk_create(valid)
+        if any(payment.pk is None for payment in payments):
+            # some databases, e.g mysql, do not return the ids of inserted rows
+            ids = dict(spec['model'].objects.filter(
+                reference_id__in=[payment.reference_id for payment in payments]
+            ).values_list('reference_id', 'pk'))
+            for payment in payments:
+                payment.pk = ids[payment.reference_id]
+
+        wait = getattr(settings, 'MOMO_BULK_RATE_LIMIT_WAIT', 60)
+
+        def send(payment):
+            provider = get_provider(payment.payment_method)
+            momo = clients[provider]
+            if momo is None:
+                return None
+            if not ratelimit.acquire(get_quota_name(provider, product), api_user.pk, timeout=wait):
+                return Response(status=429, data={'reason': 'Too many requests'})
+            try:
+                response = spec['send'](momo, payment)
+            except Exception as e:
+                if is_not_sent(e):
+                    return None
+                return Response(status=504, data={'reason': 'gateway timeout, the payment status is unknown'})
+            if response is None:
+                # the client had no answer for the gateway status code
+                return Response(status=502, data={'reason': 'unexpected gateway answer'})
+            return response
+
+        responses = run_concurrently(send, payments, concurrency)
+
+        for payment, response in zip(payments, responses):
+            status_code = getattr(response, 'status_code', 503)
+            if status_code == 202 or (status_code >= 500 and status_code != 503):
+                # the gateway may have taken the payment, the status poller finds out
+                schedule_first_poll(payment)
+            else:
+                payment.status = 'failed'
+            payment.updated_at = timezone.now()
+            results.append({'reference_id': payment.reference_id,
+                            account: getattr(payment, account),
+                            'status': payment.status, 'status_code': status_code})
+        spec['model'].objects.bulk_update(
+            payments, ['status', 'updated_at', 'poll_attempts', 'next_poll_at'])
+
+    summary = {'accepted': 0, 'failed': 0, 'invalid': 0}
+    for result in results:
+        summary[result['status']] += 1
+    summary['results'] = results
+    return summary
+
+
+def bulk_disburse(api_user, items: list, concurrency: int = None) -> dict:
+    """Sends a batch of disbursements, see bulk_send"""
+    return bulk_send(api_user, items, 'disbursement', concurrency)
+
+
+def bulk_collect(api_user, items: list, concurrency: int = None) -> dict:
+    """Sends a batch of requests to pay, see bulk_send"""
+    return bulk_send(api_user, items, 'collection', concurrency)
@@ -0,0 +1,54 @@
+"""
+Conditional GET support of the transaction endpoints
+"""
+import hashlib
+
+from django.db.models import Count, Max
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from rest_framework.response import Response
+
+
+def get_validators(request, queryset) -> tuple:
+    """
+    Computes the validators of a transaction listing with one aggregate.
+
+    The rows only change when a transaction is added, removed or updated,
+    which always moves the latest updated_at or the row count. The query
+    string is part of the etag since every page and filter is its own
+    representation.
+
+    Args:
+        request: The GET request.
+        queryset: The transactions the response is built from.
+
+    Returns:
+        tuple: The weak etag and the last modification time, None when
+        there are no rows.
+    """
+    stats = queryset.order_by().aggregate(last_modified=Max('updated_at'), count=Count('pk'))
+    last_modified = stats['last_modified']
+    version = f"{stats['count']}:{last_modified.isoformat() if last_modified else ''}:" \
+              f"{request.get_full_path()}"
+    etag = f'W/"{hashlib.sha1(version.encode()).hexdigest()[:20]}"'
+    return etag, last_modified
+
+
+def conditional(request, queryset) -> tuple:
+    """
+    Checks If-None-Match and If-Modified-Since before a response is built.
+
+    Returns:
+        tuple: A 304 Response when the client copy is current, else None,
+        and the ETag and Last-Modified headers to send with the response.
+    """
+    etag, last_modified = get_validators(request, queryset)
+    headers = {'ETag': etag}
+    timestamp = None
+    if last_modified is not None:
+        timestamp = int(last_modified.timestamp())
+        headers['Last-Modified'] = http_date(timestamp)
+    response = get_conditional_response(request, etag=etag, last_modified=timestamp)
+    if response is not None:
+        return Response(status=response.status_code, headers=headers), headers
+    return None, headers
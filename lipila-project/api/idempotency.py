@@ -0,0 +1,118 @@
+"""
+Idempotency-Key handling of the payment endpoints
+"""
+import functools
+import hashlib
+import json
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework.response import Response
+
+from api.models import IdempotencyKey
+
+# Responses of requests that did not reach the gateway, retrying them is
+# allowed so they are not stored. Other 5xx answers, e.g 502, may follow a
+# payment the gateway took and are replayed like any other answer.
+RETRYABLE_STATUSES = (429, 503)
+
+
+def get_fingerprint(request) -> str:
+    """Returns a hash of the query parameters and body of a request"""
+    data = request.data.dict() if hasattr(request.data, 'dict') else request.data
+    payload = json.dumps([sorted(request.query_params.items()), data], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def claim(scope: str, key: str, fingerprint: str):
+    """
+    Claims an idempotency key for a request.
+
+    Args:
+        scope(str): The endpoint and api user the key belongs to.
+        key(str): The Idempotency-Key header.
+        fingerprint(str): See get_fingerprint.
+
+    Returns:
+        tuple: The IdempotencyKey row and None when the request should run,
+        or None and the response to return.
+    """
+    now = timezone.now()
+    try:
+        with transaction.atomic():
+            return IdempotencyKey.objects.create(
+                scope=scope, key=key, fingerprint=fingerprint, created_at=now), None
+    except IntegrityError:
+        pass
+
+    record = IdempotencyKey.objects.filter(scope=scope, key=key).first()
+    if record is None:
+        # the key was released meanwhile
+        return claim(scope, key, fingerprint)
+    expired = record.created_at <= now - timedelta(seconds=getattr(settings, 'IDEMPOTENCY_KEY_TTL', 86400))
+    stale = record.status_code is None and record.created_at <= now - timedelta(
+        seconds=getattr(settings, 'IDEMPOTENCY_LOCK_TIMEOUT', 60))
+    if expired or stale:
+        # the request that held the key crashed or the key may be reused,
+        # only one of the concurrent retries takes it over
+        taken = IdempotencyKey.objects.filter(pk=record.pk, created_at=record.created_at).update(
+            fingerprint=fingerprint, status_code=None, response=None, created_at=now)
+        if taken:
+            record.refresh_from_db()
+            return record, None
+        return None, Response({'message': 'A request with this Idempotency-Key is in progress'},
+                              status=409, headers={'Retry-After': '1'})
+    if record.fingerprint != fingerprint:
+        return None, Response({'message': 'Idempotency-Key was used with a different request'}, status=422)
+    if record.status_code is None:
+        return None, Response({'message': 'A request with this Idempotency-Key is in progress'},
+                              status=409, headers={'Retry-After': '1'})
+    return None, Response(record.response, status=record.status_code,
+                          headers={'Idempotent-Replayed': 'true'})
+
+
+def idempotent(name: str):
+    """
+    Makes a view method honour the Idempotency-Key header.
+
+    The first request with a key runs and its response is stored. Retries
+    with the same key and body get the stored response without running the
+    view again, retries made while it is still running get a 409 and a key
+    reused with another body gets a 422. Requests without the header are
+    not changed.
+
+    Args:
+        name(str): The name of the endpoint, keys are unique per endpoint and api user.
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, request, *args, **kwargs):
+            key = request.headers.get('Idempotency-Key')
+            if not key:
+                return method(self, request, *args, **kwargs)
+            if len(key) > 255:
+                return Response({'message': 'Idempotency-Key is too long'}, status=400)
+            api_user = request.user.pk if request.user.is_authenticated else ''
+            record, response = claim(f'{name}:{api_user}', key, get_fingerprint(request))
+            if response is not None:
+                return response
+            try:
+                response = method(self, request, *args, **kwargs)
+            except Exception:
+                record.delete()
+                raise
+            if not isinstance(response, Response):
+                # nothing to replay, a retry runs the view again
+                record.delete()
+                return response
+            if response.status_code in RETRYABLE_STATUSES:
+                record.delete()
+            else:
+                record.status_code = response.status_code
+                record.response = response.data
+                record.save(update_fields=['status_code', 'response'])
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,204 @@
+"""
+Database backed queue of payments sent to the gateway by worker processes
+"""
+import os
+import socket
+import time
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+from rest_framework.response import Response
+
+from api.bulk import run_concurrently
+from api.models import LipilaCollection, LipilaDisbursement, PaymentJob
+from api.momo.breaker import deadline
+from api.momo.pool import is_not_sent
+from api.momo.router import router
+from api.transactions import get_poll_delay, schedule_first_poll
+
+MODELS = {'collection': LipilaCollection, 'disbursement': LipilaDisbursement}
+
+
+def submit(payment, product: str) -> PaymentJob:
+    """
+    Saves a pending collection or disbursement and queues it for the workers.
+
+    Args:
+        payment: An unsaved LipilaCollection or LipilaDisbursement with its reference_id.
+        product(str): collection or disbursement.
+
+    Returns:
+        PaymentJob
+    """
+    with transaction.atomic():
+        payment.status = 'pending'
+        payment.save()
+        return PaymentJob.objects.create(
+            product=product, reference_id=payment.reference_id, run_at=timezone.now())
+
+
+class JobWorker():
+    """
+    Sends queued payments to the gateway.
+
+    Jobs are claimed with SELECT ... FOR UPDATE SKIP LOCKED where the
+    database supports it so concurrent workers never wait on each other.
+    On other databases, e.g sqlite, a job is claimed by a conditional update
+    that only one worker can win. Jobs that can not reach a gateway are
+    retried with backoff up to MOMO_JOB_MAX_ATTEMPTS times.
+    """
+
+    def __init__(self, batch_size: int = None, concurrency: int = None):
+        self.concurrency = concurrency or getattr(settings, 'MOMO_JOB_CONCURRENCY', 8)
+        self.batch_size = batch_size or self.concurrency
+        self.max_attempts = getattr(settings, 'MOMO_JOB_MAX_ATTEMPTS', 5)
+        self.name = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+
+    def claim(self) -> list:
+        """
+        Claims due jobs for this worker.
+
+        Returns:
+            list: The claimed PaymentJob objects.
+        """
+        now = timezone.now()
+        due = PaymentJob.objects.filter(status='queued', run_at__lte=now).order_by('run_at')
+        with transaction.atomic():
+            if connection.features.has_select_for_update_skip_locked:
+                ids = list(due.select_for_update(skip_locked=True).values_list(
+                    'pk', flat=True)[:self.batch_size])
+            else:
+                ids = list(due.values_list('pk', flat=True)[:self.batch_size])
+            claimed = [pk for pk in ids if PaymentJob.objects.filter(pk=pk, status='queued').update(
+                status='running', locked_by=self.name, locked_at=now)]
+        return list(PaymentJob.objects.filter(pk__in=claimed))
+
+    def release_stale(self) -> int:
+        """
+        Settles jobs whose worker stopped while sending them.
+
+        The payment may have reached the gateway, so it is not sent again:
+        the transaction is marked accepted and the status poller finds out
+        whether it was made.
+
+        Returns:
+            int: The number of jobs released.
+        """
+        stale = timezone.now() - timedelta(seconds=getattr(settings, 'MOMO_JOB_LOCK_TIMEOUT', 300))
+        released = 0
+        for job in PaymentJob.objects.filter(status='running', locked_at__lte=stale):
+            if not PaymentJob.objects.filter(pk=job.pk, status='running', locked_at=job.locked_at).update(
+                    status='done', last_error='worker stopped'):
+                continue
+            payment = MODELS[job.product].objects.filter(
+                reference_id=job.reference_id, status='pending').first()
+            if payment is not None:
+                schedule_first_poll(payment)
+                payment.save(update_fields=['status', 'poll_attempts', 'next_poll_at'])
+            released += 1
+        return released
+
+    def send(self, job: PaymentJob, payment) -> tuple:
+        """
+        Sends the payment of a job through the router. An error raised before
+        the payment reached a gateway leaves it to a retry, after any other
+        error the payment may have been taken and is polled instead.
+
+        Returns:
+            tuple: The gateway that took the payment or None, its response
+            and a description of the outcome.
+        """
+        if job.product == 'collection':
+            msisdn = payment.payer_account_number
+            call = lambda gateway: gateway.request_to_pay(
+                amount=str(payment.amount), payer=msisdn, reference_id=payment.reference_id)
+        else:
+            msisdn = payment.payee_account_number
+            call = lambda gateway: gateway.deposit(
+                amount=str(payment.amount), payee=msisdn, reference_id=payment.reference_id)
+        try:
+            with deadline(getattr(settings, 'MOMO_REQUEST_DEADLINE', 20)):
+                provider, response = router.send(
+                    payment.payment_method, msisdn, job.product, call, payment.api_user_id)
+        except Exception as e:
+            if is_not_sent(e):
+                return None, None, str(e)
+            # like a stale job, the status poller finds out whether it was paid
+            return payment.payment_method, Response(
+                status=504, data={'reason': 'the payment status is unknown'}), str(e)
+        return provider, response, f'status {response.status_code}'
+
+    def finish(self, job: PaymentJob, payment, provider: str, response, error: str) -> str:
+        """
+        Saves the outcome of a job.
+
+        Returns:
+            str: 'accepted', 'failed' or 'retry'.
+        """
+        job.attempts += 1
+        if provider is None and job.attempts < self.max_attempts:
+            # no gateway took the payment, try again later
+            job.status = 'queued'
+            job.run_at = timezone.now() + timedelta(seconds=get_poll_delay(job.attempts))
+            job.last_error = error[:255]
+            job.save(update_fields=['status', 'attempts', 'run_at', 'last_error'])
+            return 'retry'
+
+        payment.updated_at = timezone.now()
+        if provider is not None and (response.status_code == 202 or response.status_code >= 500):
+            # on a gateway error the payment may have been taken, the status poller finds out
+            payment.payment_method = provider
+            schedule_first_poll(payment)
+            outcome = 'accepted'
+        else:
+            payment.status = 'failed'
+            outcome = 'failed'
+        payment.save()
+        job.status, job.last_error = 'done', '' if outcome == 'accepted' else error[:255]
+        job.save(update_fields=['status', 'attempts', 'last_error'])
+        return outcome
+
+    def work_once(self) -> dict:
+        """
+        Runs one batch of due jobs. Only the gateway calls run concurrently,
+        the database is read and written by the calling thread.
+
+        Returns:
+            dict: The number of jobs run, accepted, failed and retried.
+        """
+        counts = {'run': 0, 'accepted': 0, 'failed': 0, 'retry': 0}
+        self.release_stale()
+        jobs = self.claim()
+        counts['run'] = len(jobs)
+        runnable = []
+        for job in jobs:
+            payment = MODELS[job.product].objects.filter(reference_id=job.reference_id).first()
+            if payment is None or payment.status != 'pending':
+                job.status, job.last_error = 'done', 'transaction is not pending'
+                job.save(update_fields=['status', 'last_error'])
+                counts['failed'] += 1
+            else:
+                runnable.append((job, payment))
+
+        results = run_concurrently(lambda item: self.send(*item), runnable, self.concurrency)
+        for (job, payment), result in zip(runnable, results):
+            counts[self.finish(job, payment, *result)] += 1
+        return counts
+
+    def run(self, interval: float = 1, iterations: int = None):
+        """
+        Runs jobs until stopped, sleeping interval seconds when none was due.
+
+        Args:
+            interval(float): Seconds to sleep between idle batches.
+            iterations(int): Stop after this many batches, runs forever when None.
+        """
+        count = 0
+        while iterations is None or count < iterations:
+            counts = self.work_once()
+            count += 1
+            if not counts['run']:
+                time.sleep(interval)
@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand
+from django.db import connection
+from api import benchmark
+
+
+class Command(BaseCommand):
+    help = 'Times the transaction table queries on a seeded scratch database, without and with indexes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=100000,
+                            help='Rows seeded per transaction table')
+        parser.add_argument('--merchants', type=int, default=20,
+                            help='Api users and creators the rows are spread over')
+        parser.add_argument('--repeat', type=int, default=50,
+                            help='Runs of every query')
+        parser.add_argument('--plans', action='store_true',
+                            help='Print the query plans')
+
+    def handle(self, *args, **options):
+        # the rows go to a throwaway copy of the database, like the test runner's
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            results = benchmark.run(options['rows'], options['merchants'], options['repeat'])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        self.stdout.write(f"{options['rows']} rows per table, median (max) of {options['repeat']} runs in ms")
+        self.stdout.write(f"{'query':<24}{'without indexes':>20}{'with indexes':>20}")
+        for name, before in results['before'].items():
+            after = results['after'][name]
+            self.stdout.write(
+                f"{name:<24}{before['median']:>11.2f} ({before['max']:>6.2f})"
+                f"{after['median']:>11.2f} ({after['max']:>6.2f})")
+        if options['plans']:
+            for name in results['before']:
+                self.stdout.write(f'\n{name}\nwithout indexes:\n{results["before_plans"][name]}')
+                self.stdout.write(f'with indexes:\n{results["after_plans"][name]}')
@@ -0,0 +1,23 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.authtoken.models import Token
+
+
+class Command(BaseCommand):
+    help = "Prints a merchant's API key, creating it when the merchant has none"
+
+    def add_arguments(self, parser):
+        parser.add_argument('username', help='The merchant the key is for')
+        parser.add_argument('--rotate', action='store_true',
+                            help='Replace the current key, requests with it are refused at once')
+
+    def handle(self, *args, **options):
+        try:
+            user = get_user_model().objects.get(username=options['username'])
+        except get_user_model().DoesNotExist:
+            raise CommandError(f"User {options['username']} does not exist")
+        if options['rotate']:
+            # deleting the token also drops it from the token cache
+            Token.objects.filter(user=user).delete()
+        token, created = Token.objects.get_or_create(user=user)
+        self.stdout.write(token.key)
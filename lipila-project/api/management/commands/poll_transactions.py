@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+from api.poller import StatusPoller
+
+
+class Command(BaseCommand):
+    help = 'Polls the payment gateway for the status of accepted transactions'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true',
+                            help='Poll a single batch and exit')
+        parser.add_argument('--interval', type=float, default=2,
+                            help='Seconds to sleep when no transaction is due')
+        parser.add_argument('--batch-size', type=int,
+                            help='Transactions polled per batch (MOMO_POLL_BATCH_SIZE)')
+        parser.add_argument('--concurrency', type=int,
+                            help='Concurrent gateway calls (MOMO_POLL_CONCURRENCY)')
+
+    def handle(self, *args, **options):
+        poller = StatusPoller(options['batch_size'], options['concurrency'])
+        if options['once']:
+            result = poller.poll_once()
+            for name, counts in result.items():
+                self.stdout.write(
+                    f"{name}: polled {counts['polled']}, success {counts['success']}, failed {counts['failed']}")
+            return
+        self.stdout.write('Polling accepted transactions, press CTRL-C to stop')
+        try:
+            poller.run(options['interval'])
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand, CommandError
+from api.models import MomoApiUser
+from api.momo.mtn import Collections, Disbursement, forget_credentials
+
+
+class Command(BaseCommand):
+    help = 'Provisions and stores the mtn momo api users used by the api'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--product', choices=['collection', 'disbursement', 'all'], default='all',
+            help='The api product to provision an api user for')
+        parser.add_argument(
+            '--force', action='store_true',
+            help='Replace api users that are already registered')
+
+    def handle(self, *args, **options):
+        products = ['collection', 'disbursement'] if options['product'] == 'all' else [options['product']]
+        for product in products:
+            momo = Collections() if product == 'collection' else Disbursement()
+            subscription_key = momo.subscription_col_key if product == 'collection' else momo.subscription_dis_key
+            registered = MomoApiUser.objects.filter(
+                product=product, target_environment=momo.x_target_environment)
+
+            if registered.exists() and not options['force']:
+                self.stdout.write(f'{product} api user already registered: {registered.first().api_user}')
+                continue
+            registered.delete()
+            api_user = momo.register_api_user(subscription_key, product)
+            if api_user is None:
+                raise CommandError(f'Failed to provision the {product} api user')
+            self.stdout.write(self.style.SUCCESS(f'Provisioned {product} api user {api_user.api_user}'))
+        forget_credentials()
@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand, CommandError
+from api.reconcile import Reconciler, parse_cursor
+
+
+class Command(BaseCommand):
+    help = 'Settles transactions that are not final after a number of minutes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than', type=float,
+                            help='Minutes a transaction may stay non final (MOMO_RECONCILE_AFTER)')
+        parser.add_argument('--chunk-size', type=int,
+                            help='Rows checked and saved per chunk (MOMO_RECONCILE_CHUNK_SIZE)')
+        parser.add_argument('--concurrency', type=int,
+                            help='Concurrent gateway calls (MOMO_POLL_CONCURRENCY)')
+        parser.add_argument('--cursor',
+                            help='Resume after the cursor printed by an interrupted run')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Report what would change without saving')
+
+    def handle(self, *args, **options):
+        if options['cursor']:
+            try:
+                parse_cursor(options['cursor'])
+            except ValueError as e:
+                raise CommandError(e)
+        reconciler = Reconciler(options['older_than'], options['chunk_size'],
+                                options['concurrency'], options['dry_run'])
+        try:
+            for name, counts in reconciler.run(options['cursor']):
+                self.stdout.write(
+                    f"{name}: scanned {counts['scanned']}, success {counts['success']}, "
+                    f"failed {counts['failed']}, pending {counts['pending']}, "
+                    f"mismatches {counts['mismatches']}, missing {counts['missing']} "
+                    f"in {counts['seconds']}s")
+        except KeyboardInterrupt:
+            if reconciler.cursor:
+                self.stdout.write(f'Interrupted, resume with --cursor {reconciler.cursor}')
+            return
+        if reconciler.cursor:
+            self.stdout.write(f'cursor: {reconciler.cursor}')
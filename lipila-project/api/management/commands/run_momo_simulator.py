@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand
+from api.momo.simulator import GatewaySimulator
+
+
+class Command(BaseCommand):
+    help = 'Runs a local MTN and Airtel gateway simulator for tests and load tests'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8090)
+        parser.add_argument('--latency', type=float, default=0,
+                            help='Seconds added to every response')
+        parser.add_argument('--jitter', type=float, default=0,
+                            help='Up to this many random seconds added to the latency')
+        parser.add_argument('--error-rate', type=float, default=0,
+                            help='Fraction of requests answered with a 500')
+        parser.add_argument('--failure-rate', type=float, default=0,
+                            help='Fraction of transactions that end FAILED')
+        parser.add_argument('--completion-delay', type=float, default=2,
+                            help='Seconds before a transaction completes and its callback is sent')
+        parser.add_argument('--inactive', nargs='*', default=[],
+                            help='Numbers reported as inactive account holders')
+        parser.add_argument('--seed', type=int, help='Seed for repeatable runs')
+
+    def handle(self, *args, **options):
+        simulator = GatewaySimulator(
+            host=options['host'], port=options['port'], latency=options['latency'],
+            jitter=options['jitter'], error_rate=options['error_rate'],
+            failure_rate=options['failure_rate'], completion_delay=options['completion_delay'],
+            inactive_numbers=options['inactive'], seed=options['seed'])
+        url = f"http://{options['host']}:{options['port']}"
+        self.stdout.write(f'Gateway simulator listening on {url}')
+        self.stdout.write(f'Set MTN_BASE_URL={url} and AIRTEL_BASE_URL={url}, press CTRL-C to stop')
+        try:
+            simulator.serve_forever()
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+from api.jobs import JobWorker
+
+
+class Command(BaseCommand):
+    help = 'Sends the queued payments to the payment gateway'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true',
+                            help='Run a single batch and exit')
+        parser.add_argument('--interval', type=float, default=1,
+                            help='Seconds to sleep when no job is due')
+        parser.add_argument('--batch-size', type=int,
+                            help='Jobs claimed per batch, defaults to the concurrency')
+        parser.add_argument('--concurrency', type=int,
+                            help='Concurrent gateway calls (MOMO_JOB_CONCURRENCY)')
+
+    def handle(self, *args, **options):
+        worker = JobWorker(options['batch_size'], options['concurrency'])
+        if options['once']:
+            counts = worker.work_once()
+            self.stdout.write(
+                f"run {counts['run']}, accepted {counts['accepted']}, "
+                f"failed {counts['failed']}, retry {counts['retry']}")
+            return
+        self.stdout.write(f'Worker {worker.name} running, press CTRL-C to stop')
+        try:
+            worker.run(options['interval'])
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,107 @@
+# Generated by Django 5.0.1 on 2026-10-17 21:25
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IdempotencyKey',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('scope', models.CharField(max_length=120)),
+                ('key', models.CharField(max_length=255)),
+                ('fingerprint', models.CharField(max_length=64)),
+                ('status_code', models.PositiveSmallIntegerField(blank=True, null=True)),
+                ('response', models.JSONField(blank=True, null=True)),
+                ('created_at', models.DateTimeField()),
+            ],
+            options={
+                'unique_together': {('scope', 'key')},
+            },
+        ),
+        migrations.CreateModel(
+            name='MomoApiUser',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('product', models.CharField(choices=[('collection', 'collection'), ('disbursement', 'disbursement')], max_length=30)),
+                ('target_environment', models.CharField(max_length=30)),
+                ('api_user', models.CharField(max_length=120, unique=True)),
+                ('api_key', models.CharField(max_length=120)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'unique_together': {('product', 'target_environment')},
+            },
+        ),
+        migrations.CreateModel(
+            name='PaymentJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('product', models.CharField(choices=[('collection', 'collection'), ('disbursement', 'disbursement')], max_length=30)),
+                ('reference_id', models.CharField(max_length=120, unique=True)),
+                ('status', models.CharField(choices=[('queued', 'queued'), ('running', 'running'), ('done', 'done')], default='queued', max_length=20)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('run_at', models.DateTimeField()),
+                ('locked_by', models.CharField(blank=True, default='', max_length=120)),
+                ('locked_at', models.DateTimeField(blank=True, null=True)),
+                ('last_error', models.CharField(blank=True, default='', max_length=255)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'run_at'], name='api_payment_status_d78103_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='LipilaCollection',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('payer_account_number', models.CharField(max_length=30)),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('payment_method', models.CharField(max_length=55)),
+                ('reference_id', models.CharField(max_length=120, unique=True)),
+                ('processed_date', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('description', models.TextField(blank=True, null=True)),
+                ('status', models.CharField(choices=[('pending', 'pending'), ('accepted', 'accepted'), ('success', 'success'), ('failed', 'failed')], default='pending', max_length=20)),
+                ('poll_attempts', models.PositiveIntegerField(default=0)),
+                ('next_poll_at', models.DateTimeField(blank=True, null=True)),
+                ('api_user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='payments_received', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-updated_at', '-id'],
+                'indexes': [models.Index(fields=['api_user', '-updated_at', '-id'], name='api_lipilac_api_use_2a5e3e_idx'), models.Index(fields=['status', 'next_poll_at'], name='api_lipilac_status_4ff2e3_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='LipilaDisbursement',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('payee_account_number', models.CharField(max_length=30)),
+                ('amount', models.FloatField()),
+                ('payment_method', models.CharField(max_length=55)),
+                ('reference_id', models.CharField(max_length=120, unique=True)),
+                ('processed_date', models.DateField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('description', models.TextField(blank=True, null=True)),
+                ('status', models.CharField(choices=[('pending', 'pending'), ('accepted', 'accepted'), ('success', 'success'), ('failed', 'failed')], default='pending', max_length=20)),
+                ('poll_attempts', models.PositiveIntegerField(default=0)),
+                ('next_poll_at', models.DateTimeField(blank=True, null=True)),
+                ('api_user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='disbursements', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-updated_at', '-id'],
+                'indexes': [models.Index(fields=['api_user', '-updated_at', '-id'], name='api_lipilad_api_use_84c37b_idx'), models.Index(fields=['status', 'next_poll_at'], name='api_lipilad_status_ea842b_idx')],
+            },
+        ),
+    ]
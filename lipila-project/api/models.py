@@ -1,4 +1,5 @@
 from django.db import models
+from django.utils import timezone
 from django.contrib.auth.models import User
 
 
@@ -10,6 +11,17 @@ STATUS_CHOICES = (
     ('failed', 'failed'),
 )
 
+PRODUCT_CHOICES = (
+    ('collection', 'collection'),
+    ('disbursement', 'disbursement'),
+)
+
+JOB_STATUS_CHOICES = (
+    ('queued', 'queued'),
+    ('running', 'running'),
+    ('done', 'done'),
+)
+
 
 class LipilaDisbursement(models.Model):
     """Stores disbursement data"""
@@ -22,13 +34,22 @@ class LipilaDisbursement(models.Model):
     payment_method = models.CharField(max_length=55)
     reference_id = models.CharField(max_length=120, unique=True, blank=False, null=False)
     processed_date = models.DateField(auto_now_add=True)
-    updated_at = models.DateField(null=True, blank=True)
+    updated_at = models.DateTimeField(default=timezone.now)
     description = models.TextField(blank=True, null=True)
     status = models.CharField(
         max_length=20, choices=STATUS_CHOICES, default='pending')
+    # status polling state of accepted transactions
+    poll_attempts = models.PositiveIntegerField(default=0)
+    next_poll_at = models.DateTimeField(null=True, blank=True)
     
     class Meta:
-        ordering = ['-updated_at']
+        ordering = ['-updated_at', '-id']
+        indexes = [
+            # keyset pagination of the list endpoints
+            models.Index(fields=['api_user', '-updated_at', '-id']),
+            # transactions the status poller is due to check
+            models.Index(fields=['status', 'next_poll_at']),
+        ]
 
     def get_reference_id(self):
         return self.reference_id
@@ -49,17 +70,84 @@ class LipilaCollection(models.Model):
     payment_method = models.CharField(max_length=55)
     reference_id = models.CharField(max_length=120, unique=True, blank=False, null=False)
     processed_date = models.DateTimeField(auto_now_add=True)
-    updated_at = models.DateField(null=True, blank=True)
+    updated_at = models.DateTimeField(default=timezone.now)
     description = models.TextField(blank=True, null=True)
     status = models.CharField(
         max_length=20, choices=STATUS_CHOICES, default='pending')
+    # status polling state of accepted transactions
+    poll_attempts = models.PositiveIntegerField(default=0)
+    next_poll_at = models.DateTimeField(null=True, blank=True)
 
     def __str__(self):
         return f"Payer {self.payer_account_number} Amount - {self.amount} Status {self.status}"
     
     class Meta:
-        ordering = ['-updated_at']
+        ordering = ['-updated_at', '-id']
+        indexes = [
+            # keyset pagination of the list endpoints
+            models.Index(fields=['api_user', '-updated_at', '-id']),
+            # transactions the status poller is due to check
+            models.Index(fields=['status', 'next_poll_at']),
+        ]
 
     def get_reference_id(self):
         return self.reference_id
 
+
+class MomoApiUser(models.Model):
+    """
+    Stores an api user and api key provisioned with the mtn momo api.
+    One api user is kept per product and target environment.
+    """
+    product = models.CharField(max_length=30, choices=PRODUCT_CHOICES)
+    target_environment = models.CharField(max_length=30)
+    api_user = models.CharField(max_length=120, unique=True)
+    api_key = models.CharField(max_length=120)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ('product', 'target_environment')
+
+    def __str__(self):
+        return f"{self.product} - {self.target_environment} - {self.api_user}"
+
+
+class IdempotencyKey(models.Model):
+    """
+    Stores the response of a payment request sent with an Idempotency-Key
+    header so that retries of the request get the same response.
+    A row without a status code is a request still in progress.
+    """
+    scope = models.CharField(max_length=120)
+    key = models.CharField(max_length=255)
+    fingerprint = models.CharField(max_length=64)
+    status_code = models.PositiveSmallIntegerField(null=True, blank=True)
+    response = models.JSONField(null=True, blank=True)
+    created_at = models.DateTimeField()
+
+    class Meta:
+        unique_together = ('scope', 'key')
+
+    def __str__(self):
+        return f"{self.scope} - {self.key} - {self.status_code}"
+
+
+class PaymentJob(models.Model):
+    """
+    A payment waiting to be sent to the gateway by a run_workers process.
+    """
+    product = models.CharField(max_length=30, choices=PRODUCT_CHOICES)
+    reference_id = models.CharField(max_length=120, unique=True)
+    status = models.CharField(max_length=20, choices=JOB_STATUS_CHOICES, default='queued')
+    attempts = models.PositiveIntegerField(default=0)
+    run_at = models.DateTimeField()
+    locked_by = models.CharField(max_length=120, blank=True, default='')
+    locked_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.CharField(max_length=255, blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['status', 'run_at'])]
+
+    def __str__(self):
+        return f"{self.product} - {self.reference_id} - {self.status}"
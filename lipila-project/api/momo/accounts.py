@@ -0,0 +1,108 @@
+"""Defines a process wide store for momo account holder validation results"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+
+
+class AccountCache():
+    """
+    Caches whether a mobile money account is active so that a number is
+    validated with the gateway once per TTL instead of before every payment.
+
+    Active and inactive results are kept for MOMO_ACCOUNT_TTL and
+    MOMO_ACCOUNT_NEGATIVE_TTL seconds, the negative TTL is shorter so a number
+    that registers for mobile money can pay soon after. Results are kept in
+    process memory, bounded to MOMO_ACCOUNT_CACHE_SIZE entries, and shared
+    through the django cache named by MOMO_ACCOUNT_CACHE when it is set.
+    """
+
+    def __init__(self):
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(endpoint: str, id_type: str, account_id: str, environment: str = '') -> str:
+        """
+        Builds the cache key of an account.
+
+        Args:
+            endpoint(str): The api product either collection or disbursement.
+            id_type(str): The type of account, msisdn or email.
+            account_id(str): The mobile number or email address.
+            environment(str): The gateway target environment.
+
+        Returns:
+            str: The cache key.
+        """
+        return f"momo:account:{environment}:{endpoint}:{id_type.lower()}:{account_id}"
+
+    @property
+    def shared_cache(self):
+        alias = getattr(settings, 'MOMO_ACCOUNT_CACHE', '')
+        return caches[alias] if alias else None
+
+    def get(self, key: str):
+        """
+        Gets a cached validation result.
+
+        Args:
+            key(str): The cache key, see make_key.
+
+        Returns:
+            bool: True if the account is active, False if it is not and None
+            when the account is not cached.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+        if entry is None and self.shared_cache is not None:
+            entry = self.shared_cache.get(key)
+            if entry is not None:
+                self._store(key, entry)
+        if entry is None or entry[1] <= time.time():
+            return None
+        return entry[0]
+
+    def _store(self, key: str, entry: tuple):
+        max_size = getattr(settings, 'MOMO_ACCOUNT_CACHE_SIZE', 10000)
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > max_size:
+                self._entries.popitem(last=False)
+
+    def set(self, key: str, active: bool):
+        """
+        Stores a validation result with the TTL for its outcome.
+
+        Args:
+            key(str): The cache key, see make_key.
+            active(bool): Whether the account is active.
+        """
+        if active:
+            ttl = getattr(settings, 'MOMO_ACCOUNT_TTL', 3600)
+        else:
+            ttl = getattr(settings, 'MOMO_ACCOUNT_NEGATIVE_TTL', 300)
+        entry = (bool(active), time.time() + ttl)
+        self._store(key, entry)
+        if self.shared_cache is not None:
+            self.shared_cache.set(key, entry, timeout=ttl)
+
+    def invalidate(self, key: str):
+        """Drops a cached result"""
+        with self._lock:
+            self._entries.pop(key, None)
+        if self.shared_cache is not None:
+            self.shared_cache.delete(key)
+
+    def clear(self):
+        """Drops every result held in process memory"""
+        with self._lock:
+            self._entries.clear()
+
+
+account_cache = AccountCache()
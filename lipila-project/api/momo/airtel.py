@@ -1,10 +1,75 @@
-"""Defines classes and methods that interact witht he airtel momo api"""
-import requests
+"""Defines classes and methods that interact with the airtel money api"""
 import json
 
+import environ
+import requests
+from django.conf import settings
+from rest_framework.response import Response
+
+from api.momo.breaker import GatewayUnavailable
+from api.momo.pool import is_not_sent, send
+from api.momo.singleflight import coalesced
+from api.momo.tokens import token_cache
+from api.utils import is_payment_details_valid, is_deposit_details_valid
+
+env = environ.Env()
+
+environ.Env.read_env()
+
+# Maps the airtel transaction status to the status names of the mtn api,
+# so transactions of both gateways are read the same way.
+TRANSACTION_STATUSES = {
+    'TS': 'SUCCESSFUL',
+    'TF': 'FAILED',
+    'TE': 'FAILED',
+    'TIP': 'PENDING',
+    'TA': 'PENDING',
+}
+
+
 class AirtelMomo():
+    """
+    Client of the airtel money collection and disbursement apis.
+
+    It answers like the mtn Collections and Disbursement clients so that the
+    views, bulk payouts and the status poller can use either gateway. The
+    OAuth token is cached until it expires and calls use the pooled sessions.
+    """
 
-    def authorization(self, client_id: str, client_secret: str) -> json:
+    provider = 'airtel'
+
+    def __init__(self):
+        self.base_url = getattr(settings, 'AIRTEL_BASE_URL', 'https://openapiuat.airtel.africa').rstrip('/')
+        self.client_id = env('AIRTEL_CLIENT_ID', default='')
+        self.client_secret = env('AIRTEL_CLIENT_SECRET', default='')
+        # the disbursement pin encrypted with the airtel public key
+        self.pin = env('AIRTEL_DISBURSEMENT_PIN', default='')
+        self.country = getattr(settings, 'AIRTEL_COUNTRY', 'ZM')
+        self.currency = getattr(settings, 'AIRTEL_CURRENCY', 'ZMW')
+        self.api_token = 'Bearer '
+
+    @property
+    def token_key(self) -> str:
+        return token_cache.make_key('airtel', f'{self.client_id}:{self.base_url}')
+
+    def get_headers(self) -> dict:
+        return {
+            'Accept': '*/*',
+            'Content-Type': 'application/json',
+            'X-Country': self.country,
+            'X-Currency': self.currency,
+            'Authorization': self.api_token,
+        }
+
+    @staticmethod
+    def get_msisdn(number: str) -> str:
+        """Airtel expects numbers without the leading 0 or country code, e.g 977123456"""
+        number = str(number)
+        if number.startswith('260'):
+            number = number[3:]
+        return number.lstrip('0')
+
+    def authorization(self, client_id: str, client_secret: str) -> Response:
         """
         This function is used to get OAUTH2 access_token from the api
         that will be used as bearer token for the API that we will be going calling.
@@ -13,170 +78,224 @@ class AirtelMomo():
             client_id(str): string formated uuid4 number unique for all clients.
             client_secret(str): str formatted uuid4 found in airtels dashboard.
 
-        Returns: Json object with  {access_token: "", expires_in:"", "token_type":"bearer"}
+        Returns:
+            HTTP Response with {access_token: "", expires_in:"", "token_type":"bearer"}
         """
+        body = json.dumps({
+            "client_id": client_id,
+            "client_secret": client_secret,
+            "grant_type": "client_credentials"
+        })
         headers = {
             'Content-Type': 'application/json',
             'Accept': '*/*',
         }
+        response = send('POST', f'{self.base_url}/auth/oauth2/token', data=body, headers=headers)
+        if response.status_code == 200:
+            self.api_token = 'Bearer ' + response.json()['access_token']
+            return response
+        return Response(status=response.status_code)
 
-        body = {
-            "client_id": client_id,
-            "client_secret": client_secret,
-            "grant_type": "client_credentials"
-        }
-        # Production -- https://openapi.airtel.africa/
-        r = requests.post('https://openapiuat.airtel.africa/auth/oauth2/token', data=body, params={
-        }, headers=headers)
+    def authorize(self) -> str:
+        """
+        Sets the access token used by the other end-points, reusing a cached
+        token until it expires.
 
-        return r.json()
+        Returns:
+            str: The Authorization header value or None if no token could be created.
+        """
+        def fetch():
+            response = self.authorization(self.client_id, self.client_secret)
+            if response.status_code != 200:
+                return None
+            token = response.json()
+            return token['access_token'], token.get('expires_in', 3600)
 
+        token = token_cache.get_or_fetch(self.token_key, fetch)
+        if token is None:
+            return None
+        self.api_token = 'Bearer ' + token
+        return self.api_token
 
-    def disburse(self, pin: str, reference: str, payee={}, transaction={}) -> json:
+    def setup(self) -> bool:
         """
-        This function is ude to send money to a user.
+        Loads the access token.
 
-        Args:
-            pin(str): Encrypted four digit numeric pin to be send in 
-                    a transaction request to complete the payment
-            reference(str): Reference for service / goods purchased.
-            payee['wallet'](str): Type of wallet where the payee wants the money to be credited.
-            payee['msisdn'](str): the mobile number of the payee to pay to.
-            transaction[id](str): unique random transaction id
-            transaction[amount](int): the amount to collect from a consumer.
-            transaction[country](str): the country of the consumer(optional)
-            transaction[currency](str): the currency of the consumer(optional).
+        Returns:
+            bool: True if the client is ready to make calls.
+        """
+        if not self.client_id:
+            return False
+        return self.authorize() is not None
 
-        Returns: json object.
+    def send_authorized(self, method: str, url: str, **kwargs):
         """
+        Sends a request with the access token. When airtel rejects the token
+        with a 401 the cached token is dropped and the request is sent once
+        more with a new one.
 
-        headers = {
-            'Content-Type': 'application/json',
-            'Accept': '*/*',
-            'X-Country': 'ZM',
-            'X-Currency': 'ZMW',
-            'Authorization': 'Bearer UCcp1oe*******xCzki2w',
-            'x-signature': 'MGsp*********Ag==',
-            'x-key': 'DVZC*******************NM='
-        }
+        Returns:
+            The gateway response.
+        """
+        response = send(method, url, headers=self.get_headers(), **kwargs)
+        if response.status_code == 401:
+            token_cache.invalidate(self.token_key)
+            if self.authorize() is not None:
+                response = send(method, url, headers=self.get_headers(), **kwargs)
+        return response
+
+    def _send_transaction(self, url: str, body: dict) -> Response:
+        """
+        Sends a payment or disbursement and maps the answer like the mtn
+        clients: 503 when it was not sent, 500 when airtel may have taken it
+        and its status must be polled.
+        """
+        try:
+            response = self.send_authorized('POST', url, data=json.dumps(body))
+        except (GatewayUnavailable, requests.RequestException) as e:
+            if is_not_sent(e):
+                return Response(status=503, data={'reason': 'gateway unavailable'})
+            return Response(status=500, data={'reason': 'airtel server error'})
+        if response.status_code == 401:
+            # the credentials were rejected, the payment was not made
+            return Response(status=503, data={'reason': 'gateway unavailable'})
+        if response.status_code >= 500:
+            return Response(status=500, data={'reason': 'airtel server error'})
+        try:
+            success = response.json()['status']['success']
+        except (ValueError, KeyError, TypeError):
+            success = False
+        if response.status_code == 200 and success:
+            return Response(status=202, data={'message': 'pending'})
+        return Response(status=400, data={'reason': 'Bad Request'})
+
+    def request_to_pay(self, amount: str, payer: str, reference_id: str) -> Response:
+        """
+        Requests a payment from an airtel money subscriber.
+
+        Args:
+            amount(str): The amount to collect from the payer.
+            payer(str): The airtel money registered mobile number.
+            reference_id(str): Unique str formated uuid number that identifies the
+                        transaction.
+
+        Returns:
+            A HTTP Response, 202 when the payer was asked to approve the payment.
+        """
+        try:
+            is_payment_details_valid(amount, payer, reference_id)
+        except (ValueError, TypeError):
+            return Response(status=400, data={'reason': 'Bad Request'})
         body = {
-            "payee": {
-                "msisdn": "75****26",
-                "wallet_type": "SALARY or NORMAL"
+            "reference": "Lipila gateway",
+            "subscriber": {
+                "country": self.country,
+                "currency": self.currency,
+                "msisdn": self.get_msisdn(payer)
             },
-            "reference": "AB***141",
-            "pin": "KYJ************Rsa44",
             "transaction": {
-                "amount": 1000,
-                "id": "AB***141",
-                "type": "B2C or B2B"
+                "amount": amount,
+                "country": self.country,
+                "currency": self.currency,
+                "id": reference_id
             }
         }
-        r = requests.post(
-            'https://openapiuat.airtel.africa/standard/v3/disbursements',  params={}, headers=headers)
-
-        return r.json()
+        return self._send_transaction(f'{self.base_url}/merchant/v1/payments/', body)
 
-
-    def request_payment(self, reference: str, subscriber={}, transaction={}) -> json:
+    def deposit(self, amount: str, payee: str, reference_id: str) -> Response:
         """
-        This function is used to request a payment from a consumer.
+        Sends money to an airtel money subscriber.
 
         Args:
-            reference(str): Reference for service / goods purchased.
-            subscriber['country'](str): the country of the subscriber.
-            subscriber['currency'](str): the currency of the subscriber(optional).
-            subscriber['msisdn'](str): the mobile number of the subscriber to collect from.
-            transaction[id](str): unique random transaction id
-            transaction[amount](int): the amount to collect from a consumer.
-            transaction[country](str): the country of the consumer(optional)
-            transaction[currency](str): the currency of the consumer(optional).
+            amount(str): The amount to send to the payee.
+            payee(str): The airtel money registered mobile number.
+            reference_id(str): Unique str formated uuid number that identifies the
+                        transaction.
 
-        Returns: json object.
+        Returns:
+            A HTTP Response, 202 when the disbursement was accepted.
         """
-
-        headers = {
-            'Accept': '*/* ',
-            'Content-Type': 'application/json',
-            'X-Country': 'UG',
-            'X-Currency': 'UGX',
-            'Authorization': 'Bearer UC*******2w',
-            ' x-signature': 'MGsp*****************Ag==',
-            ' x-key': 'DVZC*******************NM='
-        }
-
+        try:
+            is_deposit_details_valid(amount, payee, reference_id)
+        except (ValueError, TypeError):
+            return Response(status=400, data={'reason': 'Bad Request'})
         body = {
-            "reference": reference,
-            "subscriber": {
-                "country": subscriber['country'],
-                "currency": subscriber['currencu'],
-                "msisdn": subscriber['msisdn']
+            "payee": {
+                "msisdn": self.get_msisdn(payee),
+                "wallet_type": "NORMAL"
             },
+            "reference": "Lipila gateway",
+            "pin": self.pin,
             "transaction": {
-                "amount": transaction['amount'],
-                "country": transaction['country'],
-                "currency": transaction['currency'],
-                "id": id
+                "amount": amount,
+                "id": reference_id,
+                "type": "B2C"
             }
         }
-        # Production -- https://openapi.airtel.africa/
-        r = requests.post(
-            'https://openapiuat.airtel.africa/merchant/v2/payments/', data=body, params={}, headers=headers)
-
-        return r.json()
+        return self._send_transaction(f'{self.base_url}/standard/v1/disbursements/', body)
 
+    def _get_status(self, url: str) -> Response:
+        """Queries a transaction and answers with the mtn status format"""
+        try:
+            response = self.send_authorized('GET', url)
+        except GatewayUnavailable:
+            return Response(status=503, data={'reason': 'gateway unavailable'})
+        except requests.RequestException:
+            return Response(status=500, data={'reason': 'airtel server error'})
+        if response.status_code == 404:
+            return Response(status=404, data={'reason': 'Not Found'})
+        if response.status_code != 200:
+            return Response(status=response.status_code)
+        try:
+            transaction = response.json()['data']['transaction']
+        except (ValueError, KeyError, TypeError):
+            return Response(status=400, data={'reason': 'Bad Request'})
+        return Response(status=200, data={
+            'financialTransactionId': transaction.get('airtel_money_id'),
+            'externalId': transaction.get('id'),
+            'status': TRANSACTION_STATUSES.get(transaction.get('status'), 'PENDING'),
+        })
 
-    def get_transaction_status(self, id: str, transType:str, version:int) -> json:
+    @coalesced('collection')
+    def get_payment_status(self, reference_id: str) -> Response:
         """
-        This function is used to enqire for the transaction status
-        matching id.
+        Queries the status of a payment.
 
         Args:
-            id(str): The transaction id of a completed transaction.
-            transType(str): the type of transaction. options are (payments or disbursements)
-            version(int): the version of the api (payments=v1 disbursements=v3)
+            reference_id(str): The id that was used to request the payment.
 
-        Returns: str
+        Returns:
+            A HTTP response, its data has the status SUCCESSFUL, FAILED or PENDING.
         """
-        import requests
+        return self._get_status(f'{self.base_url}/standard/v1/payments/{reference_id}')
 
-        headers = {
-            'Accept': '*/* ',
-            'X-Country': 'UG',
-            'X-Currency': 'UGX',
-            'Authorization': 'Bearer UC*******2w'
-        }
-        r = requests.get(
-            'https://openapiuat.airtel.africa/standard/v{version}/{transType}/{id}', headers=headers)
-
-        return r.json()
-
-
-    def call_back(self, call_back_path):
+    @coalesced('disbursement')
+    def get_transaction_status(self, transaction: str, referenceid: str) -> Response:
         """
-        This functions checks the status of the transaction.
+        Queries the status of a disbursement.
+
         Args:
-            call_back_path(str): Should be set in airtel dashboard application settings.
+            transaction(str): The type of transaction, only deposit is supported.
+            referenceid(str): The id that was used to make the deposit.
 
-        Returns: json object
+        Returns:
+            A HTTP response, see get_payment_status.
         """
-        headers = {
-            'Content-Type': 'application/json'
-        }
-        r = requests.post(
-            f'https://openapiuat.airtel.africa/{call_back_path}',  params={}, headers=headers)
-
-        return r.json()
+        return self._get_status(f'{self.base_url}/standard/v1/disbursements/{referenceid}')
 
+    def get_account_balance(self) -> Response:
+        """
+        Queries the airtel money account balance.
 
-    def get_balance(self,):
-        headers = {
-            'Accept': '*/*',
-            'X-Country': 'UG',
-            'X-Currency': 'UGX',
-            'Authorization': 'Bearer UC*****2w'
-        }
-        r = requests.get(
-            'https://openapiuat.airtel.africa/standard/v1/users/balance', headers=headers)
-        
-        return r.json()
+        Returns:
+            HTTP Response.
+        """
+        try:
+            response = self.send_authorized('GET', f'{self.base_url}/standard/v1/users/balance')
+        except GatewayUnavailable:
+            return Response(status=503, data={'reason': 'gateway unavailable'})
+        except requests.RequestException:
+            return Response(status=500, data={'reason': 'airtel server error'})
+        if response.status_code != 200:
+            return Response(status=response.status_code)
+        return response
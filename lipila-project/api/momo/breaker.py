@@ -0,0 +1,171 @@
+"""Defines the circuit breakers and request deadlines applied to gateway calls"""
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+from django.conf import settings
+
+# absolute time.monotonic() by which the current request must be done
+_deadline = contextvars.ContextVar('momo_deadline', default=None)
+_breakers = {}
+_lock = threading.Lock()
+
+
+class GatewayUnavailable(Exception):
+    """Raised instead of calling a gateway that cannot answer in time"""
+
+
+class CircuitOpenError(GatewayUnavailable):
+    """Raised when the circuit of a gateway endpoint family is open"""
+
+
+class DeadlineExceeded(GatewayUnavailable):
+    """Raised when the request deadline passed before a gateway call"""
+
+
+class CircuitBreaker():
+    """
+    Counts consecutive failures of one gateway endpoint family.
+
+    The circuit opens after MOMO_BREAKER_FAILURES failures and calls fail
+    fast for MOMO_BREAKER_RESET seconds. A single probe call is then let
+    through (half-open), its success closes the circuit and its failure
+    opens it again.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, name: str, failure_threshold: int = None, reset_timeout: float = None):
+        self.name = name
+        self.failure_threshold = failure_threshold or getattr(settings, 'MOMO_BREAKER_FAILURES', 5)
+        self.reset_timeout = reset_timeout or getattr(settings, 'MOMO_BREAKER_RESET', 30)
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """
+        Checks if a call may be made and claims the probe of a half-open circuit.
+
+        Returns:
+            bool: False while the circuit is open or a probe is in flight.
+        """
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+                return True
+            return False
+
+    def record_success(self):
+        """Closes the circuit"""
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def record_failure(self):
+        """Counts a failure and opens the circuit at the threshold or after a failed probe"""
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+    def reset(self):
+        """Closes the circuit and forgets the failures"""
+        self.record_success()
+
+
+def get_endpoint_family(method: str, url: str) -> str:
+    """
+    Groups a gateway url into the endpoint family that shares a breaker.
+
+    Args:
+        method(str): The HTTP method.
+        url(str): The requested url.
+
+    Returns:
+        str: e.g 'sandbox.momodeveloper.mtn.com:deposit'. The families are
+        token, balance, status, requesttopay, deposit and apiuser.
+    """
+    parts = urlsplit(url)
+    path = parts.path.lower()
+    if 'token' in path:
+        family = 'token'
+    elif 'balance' in path:
+        family = 'balance'
+    elif method.upper() == 'GET':
+        family = 'status'
+    elif 'requesttopay' in path or 'payments' in path:
+        family = 'requesttopay'
+    elif 'deposit' in path or 'disbursements' in path:
+        family = 'deposit'
+    else:
+        family = 'apiuser'
+    return f'{parts.netloc}:{family}'
+
+
+def get_breaker(method: str, url: str) -> CircuitBreaker:
+    """
+    Gets the process wide breaker of the endpoint family of url.
+
+    Returns:
+        CircuitBreaker
+    """
+    name = get_endpoint_family(method, url)
+    breaker = _breakers.get(name)
+    if breaker is None:
+        with _lock:
+            breaker = _breakers.setdefault(name, CircuitBreaker(name))
+    return breaker
+
+
+def reset_breakers():
+    """Drops every breaker, e.g after settings changed"""
+    with _lock:
+        _breakers.clear()
+
+
+@contextmanager
+def deadline(seconds: float):
+    """
+    Limits the total time of the gateway calls made inside the block.
+    Every call gets at most the remaining time as its timeout and calls made
+    after the deadline raise DeadlineExceeded. Nested deadlines never extend
+    the outer one.
+
+    Args:
+        seconds(float): The time budget of the block.
+    """
+    expires_at = time.monotonic() + seconds
+    current = _deadline.get()
+    if current is not None:
+        expires_at = min(expires_at, current)
+    token = _deadline.set(expires_at)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def get_remaining() -> float:
+    """
+    Returns:
+        float: The seconds left before the current deadline or None without one.
+
+    Raises:
+        DeadlineExceeded: When the deadline already passed.
+    """
+    expires_at = _deadline.get()
+    if expires_at is None:
+        return None
+    remaining = expires_at - time.monotonic()
+    if remaining <= 0:
+        raise DeadlineExceeded('Gateway request deadline exceeded')
+    return remaining
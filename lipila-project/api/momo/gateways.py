@@ -0,0 +1,38 @@
+"""Defines how a payment method is mapped to its gateway client"""
+from api.momo.airtel import AirtelMomo
+from api.momo.mtn import Collections, Disbursement
+
+GATEWAYS = {
+    'mtn': {'collection': Collections, 'disbursement': Disbursement},
+    'airtel': {'collection': AirtelMomo, 'disbursement': AirtelMomo},
+}
+DEFAULT_GATEWAY = 'mtn'
+
+
+def get_provider(payment_method: str) -> str:
+    """Returns the gateway of a payment method, mtn when it is unknown"""
+    provider = str(payment_method or '').strip().lower()
+    return provider if provider in GATEWAYS else DEFAULT_GATEWAY
+
+
+def get_client(payment_method: str, product: str):
+    """
+    Creates the gateway client for a payment.
+
+    Args:
+        payment_method(str): The payment_method of the transaction, mtn or airtel.
+        product(str): collection or disbursement.
+
+    Returns:
+        A client with setup, request_to_pay or deposit and the status methods.
+    """
+    return GATEWAYS[get_provider(payment_method)][product]()
+
+
+def get_quota_name(payment_method: str, product: str) -> str:
+    """
+    Returns the rate limit name of a product, e.g disbursement for mtn and
+    airtel_disbursement for airtel.
+    """
+    provider = get_provider(payment_method)
+    return product if provider == DEFAULT_GATEWAY else f'{provider}_{product}'
@@ -0,0 +1,297 @@
+"""Defines the latency histograms and counters of gateway calls"""
+import atexit
+import contextlib
+import json
+import os
+import threading
+import time
+
+from django.conf import settings
+
+try:
+    import fcntl
+except ImportError:
+    # not posix, the files are folded without a lock
+    fcntl = None
+
+from api.momo.breaker import get_endpoint_family
+
+# Upper bounds in seconds of the latency histogram buckets.
+BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+# Flush intervals after which the file of a process that is gone is retired.
+STALE_FLUSHES = 3
+# Holds the totals of the processes that are gone so counters never go down.
+RETIRED_FILE = 'gateway-retired.json'
+LOCK_FILE = 'gateway.lock'
+
+
+def is_running(pid: int) -> bool:
+    """Returns False when no process of this host has the pid"""
+    if os.name != 'posix':
+        # os.kill would end the process
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        # it runs as another user
+        return True
+    return True
+
+
+class GatewayMetrics():
+    """
+    Counts gateway calls by host, endpoint family and status code and keeps
+    a latency histogram per endpoint family.
+
+    Every process aggregates its own calls in memory. When MOMO_METRICS_DIR
+    is set each process also writes its totals to its own file there, at
+    most every MOMO_METRICS_FLUSH seconds, and collect adds up the files of
+    all processes, so the metrics endpoint reports the calls of every worker.
+    A process folds its totals into RETIRED_FILE when it exits and collect
+    does the same for processes that were killed, so the reported counters
+    never go down, which prometheus would read as a reset.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flushed_at = 0
+        self._registered = False
+        self._removed = False
+        self.reset()
+
+    def reset(self):
+        """Drops every measurement of this process"""
+        with self._lock:
+            # {(host, endpoint): [count per bucket..., count, sum]}
+            self._latency = {}
+            # {(host, endpoint, status): count}
+            self._requests = {}
+            # {(host, endpoint, error): count}
+            self._errors = {}
+
+    @staticmethod
+    def get_labels(method: str, url: str) -> tuple:
+        """Returns the (host, endpoint) labels of a call"""
+        host, _, endpoint = get_endpoint_family(method, url).rpartition(':')
+        return host, endpoint
+
+    def observe(self, method: str, url: str, seconds: float, status_code: int = None,
+                error: str = None):
+        """
+        Records a gateway call.
+
+        Args:
+            method(str): The HTTP method.
+            url(str): The requested url.
+            seconds(float): How long the call took.
+            status_code(int): The status code of the response, None when no
+                response was received.
+            error(str): The name of the error raised by the call.
+        """
+        host, endpoint = self.get_labels(method, url)
+        with self._lock:
+            histogram = self._latency.setdefault((host, endpoint), [0] * (len(BUCKETS) + 2))
+            for i, bound in enumerate(BUCKETS):
+                if seconds <= bound:
+                    histogram[i] += 1
+            histogram[-2] += 1
+            histogram[-1] += seconds
+            status = str(status_code) if status_code is not None else 'none'
+            key = (host, endpoint, status)
+            self._requests[key] = self._requests.get(key, 0) + 1
+            if error is not None:
+                key = (host, endpoint, error)
+                self._errors[key] = self._errors.get(key, 0) + 1
+        self.flush()
+
+    def count_error(self, method: str, url: str, error: str):
+        """Records a call that was refused before it was sent, e.g by an open circuit"""
+        host, endpoint = self.get_labels(method, url)
+        with self._lock:
+            key = (host, endpoint, error)
+            self._errors[key] = self._errors.get(key, 0) + 1
+        self.flush()
+
+    def snapshot(self) -> dict:
+        """Returns the measurements of this process in a json friendly form"""
+        with self._lock:
+            return self.get_rows({'latency': self._latency, 'requests': self._requests,
+                                  'errors': self._errors})
+
+    @staticmethod
+    def get_rows(totals: dict) -> dict:
+        """Turns measurements keyed by their labels into json friendly rows"""
+        return {
+            'latency': [list(key) + values for key, values in totals['latency'].items()],
+            'requests': [list(key) + [count] for key, count in totals['requests'].items()],
+            'errors': [list(key) + [count] for key, count in totals['errors'].items()],
+        }
+
+    def get_path(self) -> str:
+        directory = getattr(settings, 'MOMO_METRICS_DIR', '')
+        return os.path.join(directory, f'gateway-{os.getpid()}.json') if directory else None
+
+    def flush(self, force: bool = False):
+        """Writes the measurements of this process to MOMO_METRICS_DIR"""
+        path = self.get_path()
+        interval = getattr(settings, 'MOMO_METRICS_FLUSH', 5)
+        if path is None or self._removed or (not force and time.monotonic() - self._flushed_at < interval):
+            return
+        self._flushed_at = time.monotonic()
+        # replaced in one step so readers never see a partial file
+        tmp_path = f'{path}.{threading.get_ident()}.tmp'
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(self.snapshot(), f)
+            os.replace(tmp_path, path)
+        except OSError:
+            # metrics never fail a payment
+            return
+        if not self._registered:
+            self._registered = True
+            atexit.register(self.remove)
+
+    def remove(self):
+        """Moves the totals of this process to the retired file when it exits"""
+        path = self.get_path()
+        if path is None:
+            return
+        self.flush(force=True)
+        self._removed = True
+        try:
+            with self.locked(os.path.dirname(path)):
+                self.retire(path)
+        except (OSError, ValueError):
+            pass
+
+    @staticmethod
+    @contextlib.contextmanager
+    def locked(directory: str):
+        """Keeps other processes from folding or reading the files meanwhile"""
+        if fcntl is None:
+            yield
+            return
+        with open(os.path.join(directory, LOCK_FILE), 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            yield
+
+    def retire(self, path: str):
+        """
+        Adds the totals of a process file to the retired file and removes it.
+        Call it holding the lock, a file another process retired is skipped.
+        """
+        try:
+            with open(path) as f:
+                snapshots = [json.load(f)]
+        except FileNotFoundError:
+            return
+        retired_path = os.path.join(os.path.dirname(path), RETIRED_FILE)
+        try:
+            with open(retired_path) as f:
+                snapshots.append(json.load(f))
+        except FileNotFoundError:
+            pass
+        tmp_path = f'{retired_path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.get_rows(self.add_up(snapshots)), f)
+        os.replace(tmp_path, retired_path)
+        os.remove(path)
+
+    @staticmethod
+    def get_files(directory: str) -> list:
+        """Lists the metrics files of MOMO_METRICS_DIR, the retired file included"""
+        return [name for name in os.listdir(directory)
+                if name.startswith('gateway-') and name.endswith('.json')]
+
+    @staticmethod
+    def is_stale(path: str, name: str) -> bool:
+        """Returns True if a file was written by a process that is gone"""
+        try:
+            pid = int(name[len('gateway-'):-len('.json')])
+            age = time.time() - os.path.getmtime(path)
+        except (ValueError, OSError):
+            return False
+        interval = getattr(settings, 'MOMO_METRICS_FLUSH', 5)
+        # an idle process does not rewrite its file, only old files of dead processes go
+        return age > STALE_FLUSHES * interval and not is_running(pid)
+
+    def collect(self) -> dict:
+        """
+        Adds up the measurements of every process.
+
+        Returns:
+            dict: latency, requests and errors keyed by their labels.
+        """
+        snapshots = [self.snapshot()]
+        path = self.get_path()
+        if path is not None:
+            self.flush(force=True)
+            directory = os.path.dirname(path)
+            snapshots = []
+            if os.path.isdir(directory):
+                # a file is never read while it is moved to the retired file
+                with self.locked(directory):
+                    for name in self.get_files(directory):
+                        file_path = os.path.join(directory, name)
+                        try:
+                            if self.is_stale(file_path, name):
+                                self.retire(file_path)
+                        except (OSError, ValueError):
+                            continue
+                    for name in self.get_files(directory):
+                        try:
+                            with open(os.path.join(directory, name)) as f:
+                                snapshots.append(json.load(f))
+                        except (OSError, ValueError):
+                            continue
+        return self.add_up(snapshots)
+
+    @staticmethod
+    def add_up(snapshots: list) -> dict:
+        """Adds up snapshots into totals keyed by their labels"""
+        totals = {'latency': {}, 'requests': {}, 'errors': {}}
+        for snapshot in snapshots:
+            for row in snapshot['latency']:
+                key, values = tuple(row[:2]), row[2:]
+                current = totals['latency'].setdefault(key, [0] * len(values))
+                totals['latency'][key] = [a + b for a, b in zip(current, values)]
+            for name in ('requests', 'errors'):
+                for row in snapshot[name]:
+                    key = tuple(row[:3])
+                    totals[name][key] = totals[name].get(key, 0) + row[3]
+        return totals
+
+    def render(self) -> str:
+        """Returns the metrics of every process in the prometheus text format"""
+        totals = self.collect()
+        lines = [
+            '# HELP lipila_gateway_request_duration_seconds Latency of gateway calls.',
+            '# TYPE lipila_gateway_request_duration_seconds histogram',
+        ]
+        for (host, endpoint), values in sorted(totals['latency'].items()):
+            labels = f'host="{host}",endpoint="{endpoint}"'
+            for bound, count in zip(BUCKETS, values):
+                lines.append(f'lipila_gateway_request_duration_seconds_bucket{{{labels},le="{bound}"}} {count}')
+            lines.append(f'lipila_gateway_request_duration_seconds_bucket{{{labels},le="+Inf"}} {values[-2]}')
+            lines.append(f'lipila_gateway_request_duration_seconds_count{{{labels}}} {values[-2]}')
+            lines.append(f'lipila_gateway_request_duration_seconds_sum{{{labels}}} {values[-1]}')
+        lines += [
+            '# HELP lipila_gateway_requests_total Gateway calls by response status code.',
+            '# TYPE lipila_gateway_requests_total counter',
+        ]
+        for (host, endpoint, status), count in sorted(totals['requests'].items()):
+            lines.append(
+                f'lipila_gateway_requests_total{{host="{host}",endpoint="{endpoint}",status="{status}"}} {count}')
+        lines += [
+            '# HELP lipila_gateway_errors_total Gateway calls that raised or were refused.',
+            '# TYPE lipila_gateway_errors_total counter',
+        ]
+        for (host, endpoint, error), count in sorted(totals['errors'].items()):
+            lines.append(
+                f'lipila_gateway_errors_total{{host="{host}",endpoint="{endpoint}",error="{error}"}} {count}')
+        return '\n'.join(lines) + '\n'
+
+
+gateway_metrics = GatewayMetrics()
@@ -1,11 +1,22 @@
 """Defines classes and methods that interact with the MTN momo api"""
 import requests
 import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
+from django.conf import settings
+from django.db import IntegrityError
 from rest_framework.response import Response
+from api.models import MomoApiUser
 from api.utils import (
     generate_reference_id, basic_auth, 
     is_payment_details_valid, is_deposit_details_valid
     )
+from api.momo.accounts import account_cache
+from api.momo.tokens import token_cache
+from api.momo.breaker import GatewayUnavailable
+from api.momo.pool import send
+from api.momo.singleflight import coalesced
 
 import environ
 
@@ -13,15 +24,50 @@ env = environ.Env()
 
 environ.Env.read_env()
 
+# api users loaded from the MomoApiUser registry, keyed by (product, environment)
+_credentials = {}
+_credentials_lock = threading.Lock()
+
+
+def forget_credentials():
+    """ Drops the api users loaded by this process"""
+    with _credentials_lock:
+        _credentials.clear()
+
 
 class MTNBase():
     """Base class for the mtn api"""
 
+    provider = 'mtn'
+
     def __init__(self):
         self.x_target_environment = env("TARGET_ENV")
+        self.base_url = getattr(settings, 'MTN_BASE_URL', 'https://sandbox.momodeveloper.mtn.com').rstrip('/')
         self.content_type = 'application/json'
+        self.api_user = ''
         self.api_key = ''
         self.api_token = 'Bearer '
+        self.token_args = None
+
+    def get_callback_url(self, product: str, reference_id: str) -> str:
+        """
+        Gets the url the gateway notifies when a transaction completes.
+
+        Args:
+            product(str): collection or disbursement.
+            reference_id(str): The uuid that identifies the transaction.
+
+        Returns:
+            str: The callback url or None when MOMO_CALLBACK_URL is not set.
+        """
+        base = getattr(settings, 'MOMO_CALLBACK_URL', '')
+        if not base:
+            return None
+        url = f"{base.rstrip('/')}/callbacks/mtn/{product}/{reference_id}/"
+        token = getattr(settings, 'MOMO_CALLBACK_TOKEN', '')
+        if token:
+            url += '?' + urlencode({'token': token})
+        return url
 
     def create_api_user(self, subscription_key: str, reference_id) -> Response:
         """
@@ -34,7 +80,7 @@ class MTNBase():
         Returns:
             HTTP Response
         """
-        url = "https://sandbox.momodeveloper.mtn.com/v1_0/apiuser"
+        url = f"{self.base_url}/v1_0/apiuser"
 
         payload = json.dumps({
             "providerCallbackHost": "{}".format(env("PROVIDER_CALLBACK_HOST"))
@@ -45,7 +91,7 @@ class MTNBase():
             'Content-Type': self.content_type
         }
         try:
-            response = requests.request(
+            response = send(
                 'POST', url, headers=headers, data=payload)
             if response.status_code == 201:
                 return response
@@ -69,17 +115,17 @@ class MTNBase():
         Returns:
             HTTP Response
         """
-        url = f"https://sandbox.momodeveloper.mtn.com/v1_0/apiuser/{reference_id}/apikey"
+        url = f"{self.base_url}/v1_0/apiuser/{reference_id}/apikey"
 
         payload = {}
         headers = {
             'Ocp-Apim-Subscription-Key': subscription_key,
         }
         try:
-            response = requests.post(url, headers=headers, data=payload)
+            response = send('POST', url, headers=headers, data=payload)
             if response.status_code == 201:
                 key = response.json()
-                self.api_key = self.api_key + key['apiKey']
+                self.api_key = key['apiKey']
                 return response
             elif response.status_code == 400:
                 raise ValueError("Bad request")
@@ -93,16 +139,70 @@ class MTNBase():
     def provision_sandbox(self, subscription_key: str, reference_id:str):
         """ creates the api user and api token
         """
+        api_user = self.create_api_user(subscription_key, reference_id)
+        if api_user is None or api_user.status_code != 201:
+            return Response(status=getattr(api_user, 'status_code', 500))
+        api_key = self.create_api_key(subscription_key, reference_id)
+        if api_key is None or api_key.status_code != 201:
+            return Response(status=getattr(api_key, 'status_code', 500))
+        return api_user
+
+    def register_api_user(self, subscription_key: str, product: str):
+        """
+        Provisions a new api user and key and stores them in the registry.
+
+        Args:
+            subscription_key(str): MTN developer provided key
+            which provides access to the (collections or disbursement) api.
+            product(str): The api product either collection or disbursement
+
+        Returns:
+            A MomoApiUser object or None if provisioning failed.
+        """
+        reference_id = generate_reference_id()
         try:
-            api_user = self.create_api_user(subscription_key, reference_id)
-            api_key = self.create_api_key(subscription_key, reference_id)
+            response = self.provision_sandbox(subscription_key, reference_id)
+        except requests.RequestException:
+            return None
+        if response.status_code != 201:
+            return None
+        try:
+            return MomoApiUser.objects.create(
+                product=product, target_environment=self.x_target_environment,
+                api_user=reference_id, api_key=self.api_key)
+        except IntegrityError:
+            # another process registered an api user first
+            return MomoApiUser.objects.filter(
+                product=product, target_environment=self.x_target_environment).first()
+
+    def load_credentials(self, subscription_key: str, product: str) -> bool:
+        """
+        Loads the api user and key for a product from the MomoApiUser registry.
+        An api user is provisioned on first use when none is registered, so
+        payments no longer create a new api user each.
 
-            if api_user.status_code == 201 and api_key.status_code == 201:
-                return api_user
-            else:
-                raise ValueError("Failed")
-        except ValueError:
-            return Response(status=api_user.status_code)
+        Args:
+            subscription_key(str): MTN developer provided key
+            which provides access to the (collections or disbursement) api.
+            product(str): The api product either collection or disbursement
+
+        Returns:
+            bool: True if the credentials were loaded.
+        """
+        key = (product, self.x_target_environment)
+        with _credentials_lock:
+            credentials = _credentials.get(key)
+            if credentials is None:
+                credentials = MomoApiUser.objects.filter(
+                    product=product, target_environment=self.x_target_environment).first()
+                if credentials is None:
+                    credentials = self.register_api_user(subscription_key, product)
+                if credentials is None:
+                    return False
+                _credentials[key] = credentials
+        self.api_user = credentials.api_user
+        self.api_key = credentials.api_key
+        return True
 
     def create_api_token(self, subscription_key: str, endpoint: str, reference_id)->Response:
         """
@@ -117,7 +217,7 @@ class MTNBase():
         Returns:
             HTTP Response
         """
-        url = f"https://sandbox.momodeveloper.mtn.com/{endpoint}/token/"
+        url = f"{self.base_url}/{endpoint}/token/"
 
         payload = {}
         headers = {
@@ -125,10 +225,10 @@ class MTNBase():
             'Authorization': basic_auth(reference_id, self.api_key)
         }
         try:
-            response = requests.post(url, headers=headers, data=payload)
+            response = send('POST', url, headers=headers, data=payload)
             if response.status_code == 200:
                 token = response.json()
-                self.api_token = self.api_token + token['access_token']
+                self.api_token = 'Bearer ' + token['access_token']
                 return response
             elif response.status_code == 401:
                 raise ValueError("Unauthorized")
@@ -137,6 +237,54 @@ class MTNBase():
         except ValueError:
             return Response(status=response.status_code)
 
+    def authorize(self, subscription_key: str, endpoint: str, reference_id) -> str:
+        """
+        Sets the access token used by the other end-points, reusing a cached
+        token for the product and only calling create_api_token when there
+        is no token or the cached one is about to expire.
+
+        Args:
+            subscription_key(str): MTN developer provided key
+            which provides access to the (collections or disbursement) api.
+            endpoint(str): The api product either collection or disbursement
+            reference_id(str): The api user to mint a new token with.
+
+        Returns:
+            str: The Authorization header value or None if no token could be created.
+        """
+        def fetch():
+            response = self.create_api_token(subscription_key, endpoint, reference_id)
+            if response is None or response.status_code != 200:
+                return None
+            token = response.json()
+            return token['access_token'], token.get('expires_in', 3600)
+
+        key = token_cache.make_key(endpoint, subscription_key, reference_id)
+        token = token_cache.get_or_fetch(key, fetch)
+        if token is None:
+            return None
+        self.api_token = 'Bearer ' + token
+        self.token_args = (subscription_key, endpoint, reference_id)
+        return self.api_token
+
+    def send_authorized(self, method: str, url: str, headers: dict, **kwargs):
+        """
+        Sends a request with the access token. When the gateway rejects the
+        token with a 401, e.g it was revoked before its expiry, the cached
+        token is dropped and the request is sent once more with a new one.
+
+        Returns:
+            The gateway response.
+        """
+        response = send(method, url, headers=headers, **kwargs)
+        if response.status_code == 401 and self.token_args is not None:
+            subscription_key, endpoint, reference_id = self.token_args
+            token_cache.invalidate(token_cache.make_key(endpoint, subscription_key, reference_id))
+            if self.authorize(*self.token_args) is not None:
+                headers = dict(headers, Authorization=self.api_token)
+                response = send(method, url, headers=headers, **kwargs)
+        return response
+
     def validate_account_holder(
             self, subscription_key: str,
             accountHolderIdType: str,
@@ -155,14 +303,14 @@ class MTNBase():
         Returns:
             HTTP Reponse.
         """
-        url = f"https://sandbox.momodeveloper.mtn.com/{endpoint}/v1_0/accountholder/{accountHolderIdType}/{accountHolderId}/active"
+        url = f"{self.base_url}/{endpoint}/v1_0/accountholder/{accountHolderIdType}/{accountHolderId}/active"
         headers = {
             'X-Target-Environment': self.x_target_environment,
             'Authorization': self.api_token,
             'Ocp-Apim-Subscription-Key': subscription_key,
         }
         try:
-            response = requests.get(url, headers=headers)
+            response = self.send_authorized('GET', url, headers)
             if response.status_code != 200:
                 raise ValueError("Bad request")
             else:
@@ -170,6 +318,88 @@ class MTNBase():
         except Exception as e:
             return Response(status=response.status_code)
 
+    @staticmethod
+    def read_account_status(response):
+        """
+        Reads the result of validate_account_holder.
+
+        Returns:
+            bool: True if the account is active, False if the gateway says it
+            is not and None when the gateway could not tell.
+        """
+        if response is None:
+            return None
+        if response.status_code == 404:
+            return False
+        if response.status_code != 200:
+            return None
+        try:
+            return bool(response.json().get('result', True))
+        except (ValueError, AttributeError):
+            return None
+
+    def get_account_cache_key(self, endpoint: str, account_id: str, id_type: str) -> str:
+        """Returns the account_cache key of an account in this environment"""
+        return account_cache.make_key(endpoint, id_type, account_id, self.x_target_environment)
+
+    def is_account_active(self, subscription_key: str, endpoint: str,
+                          account_id: str, id_type: str = 'msisdn'):
+        """
+        Checks if an account can take part in a payment, using the cached
+        result of validate_account_holder when there is one.
+
+        Args:
+            subscription_key(str): MTN developer provided key
+                which provides access to the (collections or disbursement) api.
+            endpoint(str): The api endpoint either collection or disbursement
+            account_id(str): The mobile number or email address to validate.
+            id_type(str): The type of account, can be msisdn or email
+
+        Returns:
+            bool: True or False, None when the gateway could not tell or
+            MOMO_VALIDATE_ACCOUNTS is off. Payments should only be refused on False.
+        """
+        if not getattr(settings, 'MOMO_VALIDATE_ACCOUNTS', True):
+            return None
+        key = self.get_account_cache_key(endpoint, account_id, id_type)
+        active = account_cache.get(key)
+        if active is not None:
+            return active
+        try:
+            response = self.validate_account_holder(subscription_key, id_type, account_id, endpoint)
+        except Exception:
+            return None
+        active = self.read_account_status(response)
+        if active is not None:
+            account_cache.set(key, active)
+        return active
+
+    def validate_accounts(self, subscription_key: str, endpoint: str,
+                          account_ids: list, concurrency: int = None) -> dict:
+        """
+        Validates many msisdn accounts, e.g the payees of a payout batch.
+        Every number is checked once and uncached numbers are checked concurrently.
+
+        Args:
+            subscription_key(str): See is_account_active.
+            endpoint(str): The api endpoint either collection or disbursement
+            account_ids(list): The mobile numbers to validate.
+            concurrency(int): Maximum concurrent checks, defaults to MOMO_BULK_CONCURRENCY.
+
+        Returns:
+            dict: {account_id: True, False or None}
+        """
+        accounts = list(dict.fromkeys(str(account_id) for account_id in account_ids))
+        if not accounts:
+            return {}
+        if concurrency is None:
+            concurrency = getattr(settings, 'MOMO_BULK_CONCURRENCY', 8)
+        with ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(accounts)))) as executor:
+            results = executor.map(
+                lambda account_id: self.is_account_active(subscription_key, endpoint, account_id),
+                accounts)
+            return dict(zip(accounts, results))
+
 
 class Collections(MTNBase):
     """
@@ -180,6 +410,17 @@ class Collections(MTNBase):
         super().__init__()
         self.subscription_col_key = env("MTN_MOMO_COLLECTIONS_KEY")
 
+    def setup(self) -> bool:
+        """
+        Loads the collection api user and access token.
+
+        Returns:
+            bool: True if the client is ready to make calls.
+        """
+        if not self.load_credentials(self.subscription_col_key, 'collection'):
+            return False
+        return self.authorize(self.subscription_col_key, 'collection', self.api_user) is not None
+
     def request_to_pay(self, amount: str, payer: str, reference_id: str) -> Response:
         """
         This method queries the MTN momo request to pay endpoint.
@@ -194,11 +435,13 @@ class Collections(MTNBase):
             A HTTP Response.
         """
         is_valid = is_payment_details_valid(amount, payer, reference_id)
-        
+        if is_valid and self.is_account_active(self.subscription_col_key, 'collection', payer) is False:
+            return Response(status=400, data={'reason': 'Account holder not active'})
+
         if is_valid:
             """ Query the Collections API"""
             try:
-                url = "https://sandbox.momodeveloper.mtn.com/collection/v1_0/requesttopay"
+                url = f"{self.base_url}/collection/v1_0/requesttopay"
                 payload = json.dumps({
                     "amount": amount,
                     "currency": 'EUR',
@@ -217,7 +460,10 @@ class Collections(MTNBase):
                     'Authorization': self.api_token,
                     'Content-Type': self.content_type
                 }
-                response = requests.post(url, headers=headers, data=payload)
+                callback_url = self.get_callback_url('collection', reference_id)
+                if callback_url:
+                    headers['X-Callback-Url'] = callback_url
+                response = self.send_authorized('POST', url, headers, data=payload)
                 if response.status_code == 202:
                     return Response(status=202, data={'message': 'pending'})
                 elif response.status_code == 400:
@@ -226,9 +472,12 @@ class Collections(MTNBase):
                     return Response(status=409, data={'reason': 'Conflict user exists'})
                 elif response.status_code == 500:
                     return Response(status=500, data={'reason': 'mtn server error'})
+            except GatewayUnavailable:
+                return Response(status=503, data={'reason': 'gateway unavailable'})
             except Exception as e:
                 return Response(status=500, data={'reason': 'mtn server error'})
 
+    @coalesced('collection')
     def get_payment_status(self, reference_id) -> Response:
         """
          Queries the mtn api to get the transaction status.
@@ -240,14 +489,14 @@ class Collections(MTNBase):
             A HTTP response.
         """
 
-        url = f"https://sandbox.momodeveloper.mtn.com/collection/v2_0/payment/{reference_id}"
+        url = f"{self.base_url}/collection/v2_0/payment/{reference_id}"
         headers = {
             'X-Target-Environment': self.x_target_environment,
             'Ocp-Apim-Subscription-Key': self.subscription_col_key,
             'Authorization': self.api_token
         }
         try:
-            response = requests.get(url, headers=headers, data={})
+            response = self.send_authorized('GET', url, headers, data={})
             if response.status_code == 200:
                 return response
             elif response.status_code == 400:
@@ -269,6 +518,17 @@ class Disbursement(MTNBase):
         super().__init__()
         self.subscription_dis_key = env("MTN_MOMO_DISBURSEMENT_KEY")
 
+    def setup(self) -> bool:
+        """
+        Loads the disbursement api user and access token.
+
+        Returns:
+            bool: True if the client is ready to make calls.
+        """
+        if not self.load_credentials(self.subscription_dis_key, 'disbursement'):
+            return False
+        return self.authorize(self.subscription_dis_key, 'disbursement', self.api_user) is not None
+
     def deposit(self, amount: str, payee: str, reference_id: str) -> Response:
         """
         This method queries the MTN momo deposit endpoint.
@@ -286,11 +546,13 @@ class Disbursement(MTNBase):
             is_valid = is_deposit_details_valid(amount, payee, reference_id)
         except (ValueError, TypeError):
             return Response(status=400, data={'reason': 'Bad Request'})
-        
+        if is_valid and self.is_account_active(self.subscription_dis_key, 'disbursement', payee) is False:
+            return Response(status=400, data={'reason': 'Account holder not active'})
+
         if is_valid:
             """ deposit funds to multiple users"""
             try:
-                url = "https://sandbox.momodeveloper.mtn.com/disbursement/v1_0/deposit"
+                url = f"{self.base_url}/disbursement/v1_0/deposit"
                 payload = json.dumps({
                     "amount": amount,
                     "currency": 'EUR',
@@ -309,7 +571,10 @@ class Disbursement(MTNBase):
                     'Authorization': self.api_token,
                     'Content-Type': self.content_type
                 }
-                response = requests.post(url, headers=headers, data=payload)
+                callback_url = self.get_callback_url('disbursement', reference_id)
+                if callback_url:
+                    headers['X-Callback-Url'] = callback_url
+                response = self.send_authorized('POST', url, headers, data=payload)
                 if response.status_code == 202:
                     return response
                 elif response.status_code == 400:
@@ -318,9 +583,12 @@ class Disbursement(MTNBase):
                     return Response(status=409, data={'reason': 'Conflict user exists'})
                 elif response.status_code == 500:
                     return Response(status=500, data={'reason': 'mtn server error'})
+            except GatewayUnavailable:
+                return Response(status=503, data={'reason': 'gateway unavailable'})
             except Exception as e:
                 return Response(status=500, data={'reason': 'mtn server error'})
 
+    @coalesced('disbursement')
     def get_transaction_status(self, transaction: str, referenceid: str) -> Response:
         """
         Queries the mtn api to get the transaction status.
@@ -332,14 +600,14 @@ class Disbursement(MTNBase):
         Returns:
             A HTTP response.
         """
-        url = f"https://sandbox.momodeveloper.mtn.com/disbursement/v1_0/{transaction}/{referenceid}"
+        url = f"{self.base_url}/disbursement/v1_0/{transaction}/{referenceid}"
         headers = {
             'X-Target-Environment': self.x_target_environment,
             'Ocp-Apim-Subscription-Key': self.subscription_dis_key,
             'Authorization': self.api_token
         }
         try:
-            response = requests.get(url, headers=headers, data={})
+            response = self.send_authorized('GET', url, headers, data={})
             if response.status_code == 200:
                 return response
             elif response.status_code == 400:
@@ -357,14 +625,14 @@ class Disbursement(MTNBase):
         Returns:
             HTTP Response.
         """
-        url = f"https://sandbox.momodeveloper.mtn.com/disbursement/v1_0/account/balance"
+        url = f"{self.base_url}/disbursement/v1_0/account/balance"
         headers = {
             'X-Target-Environment': self.x_target_environment,
             'Ocp-Apim-Subscription-Key': self.subscription_dis_key,
             'Authorization': self.api_token
         }
         try:
-            response = requests.get(url, headers=headers, data={})
+            response = self.send_authorized('GET', url, headers, data={})
             if response.status_code == 200:
                 """ 
                     {
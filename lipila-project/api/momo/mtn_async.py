@@ -0,0 +1,356 @@
+"""Defines asyncio versions of the classes that interact with the MTN momo api"""
+import asyncio
+import json
+
+import httpx
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from rest_framework.response import Response
+
+from api.momo.mtn import Collections, Disbursement, MTNBase
+from api.momo.breaker import GatewayUnavailable
+from api.momo.accounts import account_cache
+from api.momo.pool import asend
+from api.momo.tokens import token_cache
+from api.utils import basic_auth, is_payment_details_valid, is_deposit_details_valid
+
+
+class AsyncMTNBase(MTNBase):
+    """
+    Base class for the async mtn api clients.
+
+    Gateway calls are coroutines sent through the pooled async client, so one
+    worker can run many of them concurrently. Responses are the same as the
+    sync clients, either the gateway response or a rest_framework Response.
+    """
+
+    async def aload_credentials(self, subscription_key: str, product: str) -> bool:
+        """
+        Async version of load_credentials, the registry is read in a thread.
+        """
+        return await sync_to_async(self.load_credentials)(subscription_key, product)
+
+    async def create_api_token(self, subscription_key: str, endpoint: str, reference_id) -> Response:
+        """
+        Creates an access token to the mtn api.
+
+        Args:
+            subscription_key(str): MTN developer provided key
+            which provides access to the (collections or disbursement) api.
+            endpoint(str): The api product either collection or disbursement
+            reference_id(str): The api user to mint the token with.
+
+        Returns:
+            HTTP Response
+        """
+        url = f"{self.base_url}/{endpoint}/token/"
+        headers = {
+            'Ocp-Apim-Subscription-Key': subscription_key,
+            'Authorization': basic_auth(reference_id, self.api_key)
+        }
+        response = await asend('POST', url, headers=headers)
+        if response.status_code == 200:
+            self.api_token = 'Bearer ' + response.json()['access_token']
+            return response
+        return Response(status=response.status_code)
+
+    async def authorize(self, subscription_key: str, endpoint: str, reference_id) -> str:
+        """
+        Sets the access token used by the other end-points, see MTNBase.authorize.
+
+        Returns:
+            str: The Authorization header value or None if no token could be created.
+        """
+        async def fetch():
+            response = await self.create_api_token(subscription_key, endpoint, reference_id)
+            if response.status_code != 200:
+                return None
+            token = response.json()
+            return token['access_token'], token.get('expires_in', 3600)
+
+        key = token_cache.make_key(endpoint, subscription_key, reference_id)
+        token = await token_cache.aget_or_fetch(key, fetch)
+        if token is None:
+            return None
+        self.api_token = 'Bearer ' + token
+        self.token_args = (subscription_key, endpoint, reference_id)
+        return self.api_token
+
+    async def send_authorized(self, method: str, url: str, headers: dict, **kwargs):
+        """
+        Async version of MTNBase.send_authorized.
+        """
+        response = await asend(method, url, headers=headers, **kwargs)
+        if response.status_code == 401 and self.token_args is not None:
+            subscription_key, endpoint, reference_id = self.token_args
+            token_cache.invalidate(token_cache.make_key(endpoint, subscription_key, reference_id))
+            if await self.authorize(*self.token_args) is not None:
+                headers = dict(headers, Authorization=self.api_token)
+                response = await asend(method, url, headers=headers, **kwargs)
+        return response
+
+    async def validate_account_holder(
+            self, subscription_key: str,
+            accountHolderIdType: str,
+            accountHolderId: str,
+            endpoint: str
+    ):
+        """
+        Checks if a user account is registered with mtn momo.
+
+        Args:
+            subscription_key(str): MTN developer provided key
+                which provides access to the (collections or disbursement) api.
+            accountHolderIdType(str): The type of account, can be msisdn or email
+            accountHolderId(str): The mobile number or email address to validate.
+            endpoint(str): The api endpoint either collection or disbursement
+
+        Returns:
+            HTTP Reponse.
+        """
+        url = f"{self.base_url}/{endpoint}/v1_0/accountholder/{accountHolderIdType}/{accountHolderId}/active"
+        headers = {
+            'X-Target-Environment': self.x_target_environment,
+            'Authorization': self.api_token,
+            'Ocp-Apim-Subscription-Key': subscription_key,
+        }
+        response = await self.send_authorized('GET', url, headers)
+        if response.status_code != 200:
+            return Response(status=response.status_code)
+        return response
+
+    async def is_account_active(self, subscription_key: str, endpoint: str,
+                                account_id: str, id_type: str = 'msisdn'):
+        """
+        Async version of MTNBase.is_account_active.
+        """
+        if not getattr(settings, 'MOMO_VALIDATE_ACCOUNTS', True):
+            return None
+        key = self.get_account_cache_key(endpoint, account_id, id_type)
+        active = account_cache.get(key)
+        if active is not None:
+            return active
+        try:
+            response = await self.validate_account_holder(subscription_key, id_type, account_id, endpoint)
+        except Exception:
+            return None
+        active = self.read_account_status(response)
+        if active is not None:
+            account_cache.set(key, active)
+        return active
+
+    async def validate_accounts(self, subscription_key: str, endpoint: str,
+                                account_ids: list, concurrency: int = None) -> dict:
+        """
+        Async version of MTNBase.validate_accounts.
+        """
+        accounts = list(dict.fromkeys(str(account_id) for account_id in account_ids))
+        if concurrency is None:
+            concurrency = getattr(settings, 'MOMO_BULK_CONCURRENCY', 8)
+        semaphore = asyncio.Semaphore(max(1, concurrency))
+
+        async def validate(account_id):
+            async with semaphore:
+                return await self.is_account_active(subscription_key, endpoint, account_id)
+
+        results = await asyncio.gather(*(validate(account_id) for account_id in accounts))
+        return dict(zip(accounts, results))
+
+    async def _get_status(self, url: str, subscription_key: str) -> Response:
+        """Queries a transaction status or balance end-point"""
+        headers = {
+            'X-Target-Environment': self.x_target_environment,
+            'Ocp-Apim-Subscription-Key': subscription_key,
+            'Authorization': self.api_token
+        }
+        response = await self.send_authorized('GET', url, headers)
+        if response.status_code == 200:
+            return response
+        elif response.status_code == 400:
+            return Response(status=400, data={'reason': 'Bad Request'})
+        elif response.status_code == 404:
+            return Response(status=404, data={'reason': 'Not Found'})
+        return Response(status=response.status_code)
+
+
+class AsyncCollections(AsyncMTNBase, Collections):
+    """
+    Async version of Collections.
+    """
+
+    async def setup(self) -> bool:
+        """
+        Loads the collection api user and access token.
+
+        Returns:
+            bool: True if the client is ready to make calls.
+        """
+        if not await self.aload_credentials(self.subscription_col_key, 'collection'):
+            return False
+        return await self.authorize(self.subscription_col_key, 'collection', self.api_user) is not None
+
+    async def request_to_pay(self, amount: str, payer: str, reference_id: str) -> Response:
+        """
+        This method queries the MTN momo request to pay endpoint.
+
+        Args:
+            amount(str): The amount to collect from the payer.
+            payer(str): The mtn momo registered mobile number.
+            reference_id(str): Unique str formated uuid number that identifies the
+                        transaction.
+
+        Returns:
+            A HTTP Response.
+        """
+        is_payment_details_valid(amount, payer, reference_id)
+        if await self.is_account_active(self.subscription_col_key, 'collection', payer) is False:
+            return Response(status=400, data={'reason': 'Account holder not active'})
+        url = f"{self.base_url}/collection/v1_0/requesttopay"
+        payload = json.dumps({
+            "amount": amount,
+            "currency": 'EUR',
+            "externalId": 'lipilaPatron',
+            "payer": {
+                "partyIdType": "MSISDN",
+                "partyId": payer
+            },
+            "payerMessage": f"send money to {payer}",
+            "payeeNote": "Lipila gateway"
+        })
+        headers = {
+            'X-Reference-Id': reference_id,
+            'Ocp-Apim-Subscription-Key': self.subscription_col_key,
+            'X-Target-Environment': self.x_target_environment,
+            'Authorization': self.api_token,
+            'Content-Type': self.content_type
+        }
+        callback_url = self.get_callback_url('collection', reference_id)
+        if callback_url:
+            headers['X-Callback-Url'] = callback_url
+        try:
+            response = await self.send_authorized('POST', url, headers, content=payload)
+        except GatewayUnavailable:
+            return Response(status=503, data={'reason': 'gateway unavailable'})
+        except httpx.HTTPError:
+            return Response(status=500, data={'reason': 'mtn server error'})
+        if response.status_code == 202:
+            return Response(status=202, data={'message': 'pending'})
+        elif response.status_code == 400:
+            return Response(status=400, data={'reason': 'Bad Request'})
+        elif response.status_code == 409:
+            return Response(status=409, data={'reason': 'Conflict user exists'})
+        elif response.status_code == 500:
+            return Response(status=500, data={'reason': 'mtn server error'})
+        return Response(status=response.status_code)
+
+    async def get_payment_status(self, reference_id) -> Response:
+        """
+        Queries the mtn api to get the transaction status.
+
+        Args:
+            reference_id(str): The id that was used to make the payment.
+
+        Returns:
+            A HTTP response.
+        """
+        url = f"{self.base_url}/collection/v2_0/payment/{reference_id}"
+        return await self._get_status(url, self.subscription_col_key)
+
+
+class AsyncDisbursement(AsyncMTNBase, Disbursement):
+    """
+    Async version of Disbursement.
+    """
+
+    async def setup(self) -> bool:
+        """
+        Loads the disbursement api user and access token.
+
+        Returns:
+            bool: True if the client is ready to make calls.
+        """
+        if not await self.aload_credentials(self.subscription_dis_key, 'disbursement'):
+            return False
+        return await self.authorize(self.subscription_dis_key, 'disbursement', self.api_user) is not None
+
+    async def deposit(self, amount: str, payee: str, reference_id: str) -> Response:
+        """
+        This method queries the MTN momo deposit endpoint.
+
+        Args:
+            amount(str): The amount to send to the payee.
+            payee(str): The mtn momo registered mobile number.
+            reference_id(str): Unique str formated uuid number that identifies the
+                        transaction.
+
+        Returns:
+            A HTTP Response.
+        """
+        try:
+            is_deposit_details_valid(amount, payee, reference_id)
+        except (ValueError, TypeError):
+            return Response(status=400, data={'reason': 'Bad Request'})
+        if await self.is_account_active(self.subscription_dis_key, 'disbursement', payee) is False:
+            return Response(status=400, data={'reason': 'Account holder not active'})
+
+        url = f"{self.base_url}/disbursement/v1_0/deposit"
+        payload = json.dumps({
+            "amount": amount,
+            "currency": 'EUR',
+            "externalId": reference_id,
+            "payee": {
+                "partyIdType": "MSISDN",
+                "partyId": payee
+            },
+            "payerMessage": f"send money to {payee}",
+            "payeeNote": "Lipila gateway"
+        })
+        headers = {
+            'X-Reference-Id': reference_id,
+            'Ocp-Apim-Subscription-Key': self.subscription_dis_key,
+            'X-Target-Environment': self.x_target_environment,
+            'Authorization': self.api_token,
+            'Content-Type': self.content_type
+        }
+        callback_url = self.get_callback_url('disbursement', reference_id)
+        if callback_url:
+            headers['X-Callback-Url'] = callback_url
+        try:
+            response = await self.send_authorized('POST', url, headers, content=payload)
+        except GatewayUnavailable:
+            return Response(status=503, data={'reason': 'gateway unavailable'})
+        except httpx.HTTPError:
+            return Response(status=500, data={'reason': 'mtn server error'})
+        if response.status_code == 202:
+            return response
+        elif response.status_code == 400:
+            return Response(status=400, data={'reason': 'Bad Request'})
+        elif response.status_code == 409:
+            return Response(status=409, data={'reason': 'Conflict user exists'})
+        elif response.status_code == 500:
+            return Response(status=500, data={'reason': 'mtn server error'})
+        return Response(status=response.status_code)
+
+    async def get_transaction_status(self, transaction: str, referenceid: str) -> Response:
+        """
+        Queries the mtn api to get the transaction status.
+
+        Args:
+            transaction(str): The type of transactions (deposit, transfer, refund)
+            referenceid(str): The id that was used to make the deposit.
+
+        Returns:
+            A HTTP response.
+        """
+        url = f"{self.base_url}/disbursement/v1_0/{transaction}/{referenceid}"
+        return await self._get_status(url, self.subscription_dis_key)
+
+    async def get_account_balance(self) -> Response:
+        """
+        Queries the mtn api for account balance.
+
+        Returns:
+            HTTP Response.
+        """
+        url = f"{self.base_url}/disbursement/v1_0/account/balance"
+        return await self._get_status(url, self.subscription_dis_key)
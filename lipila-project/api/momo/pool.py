@@ -0,0 +1,216 @@
+"""Defines the pooled keep-alive http sessions shared by the momo api clients"""
+import asyncio
+import threading
+import time
+import weakref
+from urllib.parse import urlsplit
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+from urllib3.util.retry import Retry
+from django.conf import settings
+
+from api.momo.breaker import CircuitOpenError, GatewayUnavailable, get_breaker, get_remaining
+from api.momo.metrics import gateway_metrics
+
+_sessions = {}
+_lock = threading.Lock()
+# httpx clients are bound to the event loop they were created on
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def get_timeout() -> tuple:
+    """
+    Returns the (connect, read) timeout in seconds applied to gateway calls.
+    """
+    return (
+        getattr(settings, 'MOMO_CONNECT_TIMEOUT', 5),
+        getattr(settings, 'MOMO_READ_TIMEOUT', 30),
+    )
+
+
+def build_session() -> requests.Session:
+    """
+    Creates a session whose connection pool is sized by MOMO_POOL_SIZE.
+
+    Failed connections are retried for every method since the request never
+    reached the gateway. Read errors and 502/503/504 responses are only
+    retried for idempotent methods so a payment is never submitted twice.
+    """
+    retries = getattr(settings, 'MOMO_MAX_RETRIES', 2)
+    pool_size = getattr(settings, 'MOMO_POOL_SIZE', 10)
+    retry = Retry(
+        total=retries, connect=retries, read=retries, status=retries,
+        backoff_factor=0.2, status_forcelist=(502, 503, 504),
+        allowed_methods=Retry.DEFAULT_ALLOWED_METHODS, raise_on_status=False)
+    adapter = HTTPAdapter(
+        pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def get_session(url: str) -> requests.Session:
+    """
+    Gets the session for the host of url, creating it on first use.
+    Sessions live for the lifetime of the process.
+
+    Args:
+        url(str): The url that will be requested.
+
+    Returns:
+        requests.Session
+    """
+    host = urlsplit(url).netloc
+    session = _sessions.get(host)
+    if session is None:
+        with _lock:
+            session = _sessions.get(host)
+            if session is None:
+                session = build_session()
+                _sessions[host] = session
+    return session
+
+
+def close_sessions():
+    """Closes every pooled session, e.g after settings changed"""
+    with _lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
+
+
+def is_failure(response) -> bool:
+    """Returns True if a gateway response counts against its circuit breaker"""
+    return response.status_code >= 500
+
+
+def is_not_sent(error: Exception) -> bool:
+    """
+    Returns True if a failed gateway call never reached the gateway, e.g the
+    circuit was open or the connection was refused. Any other error, e.g a
+    read timeout, may come after the gateway took the payment.
+    """
+    if isinstance(error, (GatewayUnavailable, requests.ConnectTimeout, httpx.ConnectError, httpx.ConnectTimeout)):
+        return True
+    # refused connections and failed dns lookups, not connections dropped mid request
+    reason = getattr(error.args[0], 'reason', None) if error.args else None
+    return isinstance(error, requests.ConnectionError) and isinstance(reason, NewConnectionError)
+
+
+def send(method: str, url: str, **kwargs) -> requests.Response:
+    """
+    Sends a request through the pooled session for the url's host.
+    The default timeout is applied unless one is passed, and it is cut to
+    the time left before the current deadline.
+
+    Args:
+        method(str): The HTTP method.
+        url(str): The url to request.
+        **kwargs: Passed on to requests.Session.request
+
+    Returns:
+        requests.Response
+
+    Raises:
+        CircuitOpenError: When the endpoint family is failing.
+        DeadlineExceeded: When the request deadline passed.
+    """
+    timeout = kwargs.pop('timeout', None) or get_timeout()
+    remaining = get_remaining()
+    if remaining is not None:
+        if isinstance(timeout, tuple):
+            timeout = tuple(min(part, remaining) for part in timeout)
+        else:
+            timeout = min(timeout, remaining)
+    breaker = get_breaker(method, url)
+    if not breaker.allow():
+        gateway_metrics.count_error(method, url, 'circuit_open')
+        raise CircuitOpenError(f'{breaker.name} is unavailable')
+    start = time.monotonic()
+    try:
+        response = get_session(url).request(method, url, timeout=timeout, **kwargs)
+    except requests.RequestException as e:
+        gateway_metrics.observe(method, url, time.monotonic() - start, error=type(e).__name__)
+        breaker.record_failure()
+        raise
+    gateway_metrics.observe(method, url, time.monotonic() - start, response.status_code)
+    if is_failure(response):
+        breaker.record_failure()
+    else:
+        breaker.record_success()
+    return response
+
+
+def get_async_client() -> httpx.AsyncClient:
+    """
+    Gets the async client of the running event loop, creating it on first use.
+    One client pools the connections to every gateway host and keeps up to
+    MOMO_POOL_SIZE of them alive.
+
+    Returns:
+        httpx.AsyncClient
+    """
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None or client.is_closed:
+        pool_size = getattr(settings, 'MOMO_POOL_SIZE', 10)
+        connect, read = get_timeout()
+        client = httpx.AsyncClient(
+            limits=httpx.Limits(max_keepalive_connections=pool_size),
+            timeout=httpx.Timeout(read, connect=connect),
+            transport=httpx.AsyncHTTPTransport(
+                retries=getattr(settings, 'MOMO_MAX_RETRIES', 2)))
+        _async_clients[loop] = client
+    return client
+
+
+async def close_async_client():
+    """Closes the async client of the running event loop"""
+    client = _async_clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
+
+
+async def asend(method: str, url: str, **kwargs) -> httpx.Response:
+    """
+    Sends a request through the pooled async client.
+    The default timeout of the client is used unless one is passed, and it
+    is cut to the time left before the current deadline.
+
+    Args:
+        method(str): The HTTP method.
+        url(str): The url to request.
+        **kwargs: Passed on to httpx.AsyncClient.request
+
+    Returns:
+        httpx.Response
+
+    Raises:
+        CircuitOpenError: When the endpoint family is failing.
+        DeadlineExceeded: When the request deadline passed.
+    """
+    remaining = get_remaining()
+    if remaining is not None and 'timeout' not in kwargs:
+        connect, read = get_timeout()
+        kwargs['timeout'] = httpx.Timeout(min(read, remaining), connect=min(connect, remaining))
+    breaker = get_breaker(method, url)
+    if not breaker.allow():
+        gateway_metrics.count_error(method, url, 'circuit_open')
+        raise CircuitOpenError(f'{breaker.name} is unavailable')
+    start = time.monotonic()
+    try:
+        response = await get_async_client().request(method, url, **kwargs)
+    except httpx.HTTPError as e:
+        gateway_metrics.observe(method, url, time.monotonic() - start, error=type(e).__name__)
+        breaker.record_failure()
+        raise
+    gateway_metrics.observe(method, url, time.monotonic() - start, response.status_code)
+    if is_failure(response):
+        breaker.record_failure()
+    else:
+        breaker.record_success()
+    return response
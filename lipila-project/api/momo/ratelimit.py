@@ -0,0 +1,165 @@
+"""Defines the token bucket rate limits applied before gateway payment calls"""
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+
+
+class TokenBucket():
+    """
+    A token bucket kept in a django cache so that every worker process
+    draws from the same bucket.
+
+    The bucket holds up to capacity tokens and refills at rate tokens per
+    second. Updates are serialized with a short lock taken with cache.add,
+    which is atomic on every cache backend.
+    """
+
+    def __init__(self, name: str, rate: float, capacity: float = None, cache_alias: str = None):
+        self.name = name
+        self.rate = float(rate)
+        self.capacity = float(capacity or max(1, rate))
+        if cache_alias is None:
+            cache_alias = getattr(settings, 'MOMO_RATE_LIMIT_CACHE', '') or 'default'
+        self.cache = caches[cache_alias]
+        self.key = f'momo:bucket:{name}'
+        self.lock_key = f'momo:bucket:{name}:lock'
+
+    def _lock(self) -> str:
+        """
+        Takes the bucket lock and returns its owner id. The lock expires after
+        a second, so a holder that crashed only blocks the bucket that long.
+        """
+        owner = uuid.uuid4().hex
+        while not self.cache.add(self.lock_key, owner, timeout=1):
+            time.sleep(0.001)
+        return owner
+
+    def _unlock(self, owner: str):
+        if self.cache.get(self.lock_key) == owner:
+            self.cache.delete(self.lock_key)
+
+    def _get_level(self, now: float) -> float:
+        """Returns the tokens in the bucket at now, the lock must be held"""
+        level, updated_at = self.cache.get(self.key) or (self.capacity, now)
+        return min(self.capacity, level + max(0, now - updated_at) * self.rate)
+
+    def _set_level(self, level: float, now: float):
+        # an idle bucket is full again after capacity / rate seconds
+        self.cache.set(self.key, (level, now), timeout=int(self.capacity / self.rate) + 60)
+
+    def take(self, tokens: float = 1) -> float:
+        """
+        Takes tokens from the bucket if it holds enough.
+
+        Returns:
+            float: 0 if the tokens were taken, otherwise the seconds until
+            the bucket will hold enough.
+        """
+        owner = self._lock()
+        try:
+            now = time.time()
+            level = self._get_level(now)
+            wait = 0
+            if level >= tokens:
+                level -= tokens
+            else:
+                wait = (tokens - level) / self.rate
+            self._set_level(level, now)
+            return wait
+        finally:
+            self._unlock(owner)
+
+    def refund(self, tokens: float = 1):
+        """Puts back tokens that were taken for a call that was not made"""
+        owner = self._lock()
+        try:
+            now = time.time()
+            self._set_level(min(self.capacity, self._get_level(now) + tokens), now)
+        finally:
+            self._unlock(owner)
+
+    def acquire(self, tokens: float = 1, timeout: float = 0) -> bool:
+        """
+        Takes tokens, waiting up to timeout seconds for the bucket to refill.
+
+        Returns:
+            bool: True if the tokens were taken.
+        """
+        give_up = time.monotonic() + timeout
+        while True:
+            wait = self.take(tokens)
+            if wait == 0:
+                return True
+            if time.monotonic() + wait > give_up:
+                return False
+            time.sleep(wait)
+
+    def reset(self):
+        """Fills the bucket"""
+        self.cache.delete(self.key)
+
+
+def get_buckets(product: str, api_user=None) -> list:
+    """
+    Gets the buckets a payment of product made for api_user draws from.
+
+    MOMO_RATE_LIMITS maps a product to its (rate per second, burst) for all
+    api users together, MOMO_USER_RATE_LIMITS to the limit of each api user.
+    A rate of 0 turns a limit off.
+
+    Args:
+        product(str): The api product, e.g collection or disbursement.
+        api_user: The id of the merchant making the payment or None.
+
+    Returns:
+        list: TokenBucket objects, per api user first.
+    """
+    buckets = []
+    user_limit = getattr(settings, 'MOMO_USER_RATE_LIMITS', {}).get(product)
+    if user_limit and user_limit[0] > 0 and api_user is not None:
+        buckets.append(TokenBucket(f'{product}:user:{api_user}', *user_limit))
+    limit = getattr(settings, 'MOMO_RATE_LIMITS', {}).get(product)
+    if limit and limit[0] > 0:
+        buckets.append(TokenBucket(product, *limit))
+    return buckets
+
+
+def acquire(product: str, api_user=None, timeout: float = None) -> bool:
+    """
+    Waits for room under the gateway quota before a payment call.
+
+    Args:
+        product(str): The api product, e.g collection or disbursement.
+        api_user: The id of the merchant making the payment or None.
+        timeout(float): Seconds a request may queue, defaults to MOMO_RATE_LIMIT_WAIT.
+
+    Returns:
+        bool: False if the request should be shed, no bucket is drawn from then.
+    """
+    if timeout is None:
+        timeout = getattr(settings, 'MOMO_RATE_LIMIT_WAIT', 2)
+    give_up = time.monotonic() + timeout
+    taken = []
+    for bucket in get_buckets(product, api_user):
+        if not bucket.acquire(timeout=max(0, give_up - time.monotonic())):
+            # a shed call must not use up the quota of the other buckets
+            for taken_bucket in taken:
+                taken_bucket.refund()
+            return False
+        taken.append(bucket)
+    return True
+
+
+def refund(product: str, api_user=None):
+    """
+    Gives back the quota taken by acquire for a payment that was not sent,
+    e.g the gateway could not be reached.
+
+    Args:
+        product(str): The api product, e.g collection or disbursement.
+        api_user: The id of the merchant making the payment or None.
+    """
+    for bucket in get_buckets(product, api_user):
+        bucket.refund()
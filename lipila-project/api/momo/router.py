@@ -0,0 +1,186 @@
+"""Defines the router that picks the gateway of a payment and fails over between gateways"""
+import threading
+import time
+from collections import deque
+
+import httpx
+import requests
+from django.conf import settings
+from rest_framework.response import Response
+
+from api.momo import ratelimit
+from api.momo.breaker import GatewayUnavailable
+from api.momo.gateways import DEFAULT_GATEWAY, GATEWAYS, get_client, get_quota_name
+from api.momo.pool import is_not_sent
+
+
+class ProviderHealth():
+    """
+    The latency and outcome of the last calls made to a gateway.
+
+    Only the last MOMO_ROUTER_WINDOW calls are kept so a gateway that
+    recovers is preferred again soon after.
+    """
+
+    def __init__(self, window: int = None):
+        if window is None:
+            window = getattr(settings, 'MOMO_ROUTER_WINDOW', 50)
+        self._calls = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, latency: float, ok: bool):
+        """
+        Stores the outcome of a call.
+
+        Args:
+            latency(float): Seconds the call took.
+            ok(bool): False if the gateway failed or could not be reached.
+        """
+        with self._lock:
+            self._calls.append((latency, bool(ok)))
+
+    @property
+    def latency(self) -> float:
+        """The mean latency of the kept calls in seconds"""
+        with self._lock:
+            calls = list(self._calls)
+        return sum(latency for latency, ok in calls) / len(calls) if calls else 0
+
+    @property
+    def error_rate(self) -> float:
+        """The share of the kept calls that failed"""
+        with self._lock:
+            calls = list(self._calls)
+        return sum(1 for latency, ok in calls if not ok) / len(calls) if calls else 0
+
+    def is_healthy(self) -> bool:
+        return self.error_rate <= getattr(settings, 'MOMO_ROUTER_MAX_ERROR_RATE', 0.5)
+
+
+class PaymentRouter():
+    """
+    Maps a payment to the gateways that can serve it and sends it to the
+    first one that takes it, recording the health of every gateway.
+
+    A payment_method naming a gateway, e.g mtn or airtel, always uses that
+    gateway. Any other payment_method is routed by the network prefix of
+    the mobile number using MOMO_NETWORK_PREFIXES, and to DEFAULT_GATEWAY
+    when the prefix is unknown. A number belongs to one network, so it is
+    never failed over to the gateway of another.
+    """
+
+    def __init__(self):
+        self._health = {}
+        self._lock = threading.Lock()
+
+    def get_health(self, provider: str) -> ProviderHealth:
+        with self._lock:
+            if provider not in self._health:
+                self._health[provider] = ProviderHealth()
+            return self._health[provider]
+
+    def reset(self):
+        """Forgets the recorded calls of every gateway"""
+        with self._lock:
+            self._health.clear()
+
+    @staticmethod
+    def get_network(msisdn: str) -> str:
+        """
+        Finds the gateway of a mobile number from its prefix.
+
+        Args:
+            msisdn(str): The mobile number, with or without the country code.
+
+        Returns:
+            str: The gateway name or None when the prefix is unknown.
+        """
+        number = str(msisdn or '').lstrip('+')
+        country_code = getattr(settings, 'MOMO_COUNTRY_CODE', '260')
+        if country_code and number.startswith(country_code):
+            number = '0' + number[len(country_code):]
+        for provider, prefixes in getattr(settings, 'MOMO_NETWORK_PREFIXES', {}).items():
+            if provider in GATEWAYS and number.startswith(tuple(prefixes)):
+                return provider
+        return None
+
+    def get_providers(self, payment_method: str, msisdn: str) -> list:
+        """
+        Lists the gateways a payment may be sent to, the preferred first.
+
+        Args:
+            payment_method(str): The payment_method of the transaction.
+            msisdn(str): The mobile number of the payer or payee.
+
+        Returns:
+            list: Gateway names, the preferred first.
+        """
+        provider = str(payment_method or '').strip().lower()
+        if provider in GATEWAYS:
+            return [provider]
+        network = self.get_network(msisdn)
+        return [network if network is not None else DEFAULT_GATEWAY]
+
+    def send(self, payment_method: str, msisdn: str, product: str, call, api_user=None) -> tuple:
+        """
+        Sends a payment to the first gateway that accepts it.
+
+        A gateway is skipped when it is over its rate limit, can not be set
+        up, or the payment could not be sent to it: the client answers 503
+        or the call failed before reaching the gateway. The quota taken for a
+        skipped gateway is given back. When it is not known
+        whether the gateway took the payment, e.g the call timed out, the
+        gateway is returned with a 504 response so the payment is polled
+        instead of being sent twice.
+
+        Args:
+            payment_method(str): The payment_method of the transaction.
+            msisdn(str): The mobile number of the payer or payee.
+            product(str): collection or disbursement.
+            call(callable): Makes the payment with a ready client and returns its response.
+            api_user: The id the rate limits are counted against or None.
+
+        Returns:
+            tuple: The gateway name and its response, or None and a 429 or
+            503 response when the payment was not sent to any gateway.
+        """
+        response = Response(status=503, data={'reason': 'gateway unavailable'})
+        limited = False
+        for provider in self.get_providers(payment_method, msisdn):
+            quota = get_quota_name(provider, product)
+            if not ratelimit.acquire(quota, api_user):
+                limited = True
+                continue
+            health = self.get_health(provider)
+            client = get_client(provider, product)
+            start = time.monotonic()
+            try:
+                ready = client.setup()
+            except (GatewayUnavailable, requests.RequestException, httpx.HTTPError):
+                ready = False
+            if not ready:
+                health.record(time.monotonic() - start, False)
+                ratelimit.refund(quota, api_user)
+                continue
+            try:
+                response = call(client)
+            except (GatewayUnavailable, requests.RequestException, httpx.HTTPError) as e:
+                health.record(time.monotonic() - start, False)
+                if is_not_sent(e):
+                    ratelimit.refund(quota, api_user)
+                    response = Response(status=503, data={'reason': 'gateway unavailable'})
+                    continue
+                return provider, Response(status=504, data={'reason': 'gateway timeout, the payment status is unknown'})
+            if response is None:
+                # the client had no answer for the gateway status code
+                response = Response(status=502, data={'reason': 'unexpected gateway answer'})
+            health.record(time.monotonic() - start, response.status_code < 500)
+            if response.status_code != 503:
+                return provider, response
+            ratelimit.refund(quota, api_user)
+        if limited and response.status_code == 503:
+            response = Response(status=429, data={'reason': 'Too many requests'})
+        return None, response
+
+
+router = PaymentRouter()
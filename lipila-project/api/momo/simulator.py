@@ -0,0 +1,345 @@
+"""
+Defines a local MTN and Airtel gateway simulator for tests and load tests.
+
+Point MTN_BASE_URL and AIRTEL_BASE_URL at a running simulator, e.g
+    python manage.py run_momo_simulator --port 8090 --latency 0.05
+"""
+import base64
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.request import Request, urlopen
+
+MTN_STATUSES = {'success': 'SUCCESSFUL', 'failed': 'FAILED', 'pending': 'PENDING'}
+AIRTEL_STATUSES = {'success': 'TS', 'failed': 'TF', 'pending': 'TIP'}
+UUID = re.compile(r'^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$', re.I)
+
+
+class GatewaySimulator():
+    """
+    Simulates the MTN momo api (apiuser, apikey, token, requesttopay,
+    deposit, status, account holder and balance end-points) and the Airtel
+    money api (token, payments, disbursements, status and balance).
+
+    Transactions are accepted straight away and complete completion_delay
+    seconds later, failing with probability failure_rate. A callback is sent
+    to the X-Callback-Url of a transaction when it completes. Every request
+    is delayed by latency plus up to jitter seconds and answered with a 500
+    with probability error_rate.
+    """
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, latency: float = 0,
+                 jitter: float = 0, error_rate: float = 0, failure_rate: float = 0,
+                 completion_delay: float = 0, inactive_numbers=(), seed: int = None):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.failure_rate = failure_rate
+        self.completion_delay = completion_delay
+        self.inactive_numbers = set(inactive_numbers)
+        self.random = random.Random(seed)
+        self.api_users = {}
+        self.tokens = set()
+        self.transactions = {}
+        self.requests = 0
+        self.lock = threading.Lock()
+        self.server = None
+        self.thread = None
+
+    @property
+    def url(self) -> str:
+        """The base url of the running simulator"""
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self):
+        """Serves in a background thread, see stop"""
+        self.server = ThreadingHTTPServer((self.host, self.port), self.get_handler())
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(
+            target=self.server.serve_forever, kwargs={'poll_interval': 0.1}, daemon=True)
+        self.thread.start()
+        return self
+
+    def serve_forever(self):
+        """Serves in the calling thread until interrupted"""
+        self.server = ThreadingHTTPServer((self.host, self.port), self.get_handler())
+        self.server.daemon_threads = True
+        try:
+            self.server.serve_forever()
+        finally:
+            self.server.server_close()
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def get_handler(self):
+        simulator = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                pass
+
+            def handle_any(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                body = self.rfile.read(length) if length else b''
+                status, data = simulator.handle(self.command, self.path, self.headers, body)
+                payload = json.dumps(data).encode() if data is not None else b''
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            do_GET = do_POST = do_PUT = handle_any
+
+        return Handler
+
+    def handle(self, method: str, path: str, headers, body: bytes) -> tuple:
+        """
+        Answers one request.
+
+        Returns:
+            tuple: (status code, json data or None)
+        """
+        with self.lock:
+            self.requests += 1
+            delay = self.latency + self.random.uniform(0, self.jitter)
+            error = self.random.random() < self.error_rate
+        if delay:
+            time.sleep(delay)
+        if error:
+            return 500, {'code': 'INTERNAL_PROCESSING_ERROR', 'message': 'simulated error'}
+        try:
+            data = json.loads(body) if body else {}
+        except ValueError:
+            data = None
+        path = path.split('?')[0]
+
+        for pattern, route in self.routes:
+            match = re.match(pattern, path)
+            if match and route[0] == method:
+                return route[1](self, headers, data, *match.groups())
+        return 404, {'code': 'RESOURCE_NOT_FOUND', 'message': 'Requested resource was not found.'}
+
+    # MTN
+    def create_api_user(self, headers, data):
+        reference_id = headers.get('X-Reference-Id', '')
+        if not UUID.match(reference_id) or not isinstance(data, dict):
+            return 400, {'code': 'INVALID_REFERENCE_ID'}
+        with self.lock:
+            if reference_id in self.api_users:
+                return 409, {'code': 'RESOURCE_ALREADY_EXIST'}
+            self.api_users[reference_id] = None
+        return 201, None
+
+    def create_api_key(self, headers, data, reference_id):
+        with self.lock:
+            if reference_id not in self.api_users:
+                return 404, {'code': 'RESOURCE_NOT_FOUND'}
+            key = uuid.uuid4().hex
+            self.api_users[reference_id] = key
+        return 201, {'apiKey': key}
+
+    def get_api_user(self, headers, data, reference_id):
+        if reference_id not in self.api_users:
+            return 404, {'code': 'RESOURCE_NOT_FOUND'}
+        return 200, {'providerCallbackHost': 'localhost', 'targetEnvironment': 'sandbox'}
+
+    def create_token(self, headers, data, product):
+        try:
+            user, key = base64.b64decode(
+                headers.get('Authorization', '').split(' ')[-1]).decode().split(':', 1)
+        except (ValueError, UnicodeDecodeError):
+            return 401, {'error': 'login_failed'}
+        if not key or self.api_users.get(user) != key:
+            return 401, {'error': 'login_failed'}
+        return 200, self.new_token()
+
+    def new_token(self) -> dict:
+        token = uuid.uuid4().hex
+        with self.lock:
+            self.tokens.add(token)
+        return {'access_token': token, 'token_type': 'access_token', 'expires_in': 3600}
+
+    def is_authorized(self, headers) -> bool:
+        return headers.get('Authorization', '').replace('Bearer ', '', 1) in self.tokens
+
+    def create_transaction(self, headers, data, product, party_key):
+        if not self.is_authorized(headers):
+            return 401, {'code': 'UNAUTHORIZED'}
+        reference_id = headers.get('X-Reference-Id', '')
+        try:
+            party = data[party_key]['partyId']
+            float(data['amount'])
+        except (KeyError, TypeError, ValueError):
+            return 400, {'code': 'INVALID_PARAMETER'}
+        if not UUID.match(reference_id):
+            return 400, {'code': 'INVALID_REFERENCE_ID'}
+        result = self.add_transaction(
+            reference_id, product, data, headers.get('X-Callback-Url'), party in self.inactive_numbers)
+        if result is None:
+            return 409, {'code': 'RESOURCE_ALREADY_EXIST'}
+        return 202, None
+
+    def request_to_pay(self, headers, data):
+        return self.create_transaction(headers, data, 'collection', 'payer')
+
+    def deposit(self, headers, data):
+        return self.create_transaction(headers, data, 'disbursement', 'payee')
+
+    def transaction_status(self, headers, data, product, reference_id):
+        if not self.is_authorized(headers):
+            return 401, {'code': 'UNAUTHORIZED'}
+        if not UUID.match(reference_id):
+            return 400, {'code': 'INVALID_REFERENCE_ID'}
+        transaction = self.transactions.get(reference_id)
+        if transaction is None or transaction['product'] != product:
+            return 404, {'code': 'RESOURCE_NOT_FOUND'}
+        return 200, self.mtn_transaction(reference_id)
+
+    def account_holder(self, headers, data, product, id_type, account_id):
+        if not self.is_authorized(headers):
+            return 401, {'code': 'UNAUTHORIZED'}
+        return 200, {'result': account_id not in self.inactive_numbers}
+
+    def balance(self, headers, data, product):
+        if not self.is_authorized(headers):
+            return 401, {'code': 'UNAUTHORIZED'}
+        return 200, {'availableBalance': '1000000', 'currency': 'EUR'}
+
+    # Airtel
+    def airtel_token(self, headers, data):
+        if not isinstance(data, dict) or not data.get('client_id'):
+            return 400, {'error': 'invalid_request'}
+        token = self.new_token()
+        token['token_type'] = 'bearer'
+        return 200, token
+
+    def airtel_transaction(self, headers, data, product):
+        if not self.is_authorized(headers):
+            return 401, {'status': {'code': '401', 'success': False}}
+        try:
+            transaction_id = str(data['transaction']['id'])
+            float(data['transaction']['amount'])
+        except (KeyError, TypeError, ValueError):
+            return 400, {'status': {'code': '400', 'success': False}}
+        if self.add_transaction(transaction_id, product, data, None, False) is None:
+            return 400, {'status': {'code': '400', 'message': 'Duplicate transaction', 'success': False}}
+        return 200, {'data': {'transaction': {'id': transaction_id, 'status': 'Success.'}},
+                     'status': {'code': '200', 'message': 'SUCCESS', 'success': True}}
+
+    def airtel_payment(self, headers, data, version):
+        return self.airtel_transaction(headers, data, 'airtel_collection')
+
+    def airtel_disbursement(self, headers, data, version):
+        return self.airtel_transaction(headers, data, 'airtel_disbursement')
+
+    def airtel_status(self, headers, data, version, kind, transaction_id):
+        if not self.is_authorized(headers):
+            return 401, {'status': {'code': '401', 'success': False}}
+        transaction = self.transactions.get(transaction_id)
+        if transaction is None:
+            return 404, {'status': {'code': '404', 'message': 'Transaction not found', 'success': False}}
+        status = AIRTEL_STATUSES[self.get_status(transaction)]
+        return 200, {'data': {'transaction': {'id': transaction_id, 'status': status,
+                                              'airtel_money_id': transaction['financial_id']}},
+                     'status': {'code': '200', 'message': 'SUCCESS', 'success': True}}
+
+    def airtel_balance(self, headers, data):
+        if not self.is_authorized(headers):
+            return 401, {'status': {'code': '401', 'success': False}}
+        return 200, {'data': {'balance': '1000000', 'currency': 'ZMW', 'account_status': 'ACTIVE'},
+                     'status': {'code': '200', 'success': True}}
+
+    routes = (
+        (r'^/v1_0/apiuser$', ('POST', create_api_user)),
+        (r'^/v1_0/apiuser/([^/]+)/apikey$', ('POST', create_api_key)),
+        (r'^/v1_0/apiuser/([^/]+)$', ('GET', get_api_user)),
+        (r'^/(collection|disbursement)/token/?$', ('POST', create_token)),
+        (r'^/collection/v1_0/requesttopay$', ('POST', request_to_pay)),
+        (r'^/disbursement/v1_0/deposit$', ('POST', deposit)),
+        (r'^/(collection)/v[12]_0/(?:payment|requesttopay)/([^/]+)$', ('GET', transaction_status)),
+        (r'^/(disbursement)/v1_0/deposit/([^/]+)$', ('GET', transaction_status)),
+        (r'^/(collection|disbursement)/v1_0/accountholder/([^/]+)/([^/]+)/active$', ('GET', account_holder)),
+        (r'^/(collection|disbursement)/v1_0/account/balance$', ('GET', balance)),
+        (r'^/auth/oauth2/token$', ('POST', airtel_token)),
+        (r'^/merchant/v(\d)/payments/?$', ('POST', airtel_payment)),
+        (r'^/standard/v(\d)/disbursements/?$', ('POST', airtel_disbursement)),
+        (r'^/standard/v(\d)/(payments|disbursements)/([^/]+)$', ('GET', airtel_status)),
+        (r'^/standard/v1/users/balance$', ('GET', airtel_balance)),
+    )
+
+    # transactions
+    def add_transaction(self, reference_id: str, product: str, data: dict,
+                        callback_url: str, fail: bool):
+        """Stores a transaction, returns None when the reference id is taken"""
+        with self.lock:
+            if reference_id in self.transactions:
+                return None
+            if not fail:
+                fail = self.random.random() < self.failure_rate
+            transaction = self.transactions[reference_id] = {
+                'product': product,
+                'data': data,
+                'final': 'failed' if fail else 'success',
+                'completes_at': time.monotonic() + self.completion_delay,
+                'financial_id': str(self.random.randint(10 ** 8, 10 ** 9)),
+            }
+        if callback_url:
+            timer = threading.Timer(
+                self.completion_delay, self.send_callback, (reference_id, callback_url))
+            timer.daemon = True
+            timer.start()
+        return transaction
+
+    def get_status(self, transaction: dict) -> str:
+        if time.monotonic() < transaction['completes_at']:
+            return 'pending'
+        return transaction['final']
+
+    def mtn_transaction(self, reference_id: str) -> dict:
+        transaction = self.transactions[reference_id]
+        data = transaction['data']
+        party_key = 'payer' if transaction['product'] == 'collection' else 'payee'
+        status = self.get_status(transaction)
+        result = {
+            'financialTransactionId': transaction['financial_id'],
+            'externalId': data.get('externalId'),
+            'amount': data.get('amount'),
+            'currency': data.get('currency'),
+            party_key: data.get(party_key),
+            'payerMessage': data.get('payerMessage'),
+            'payeeNote': data.get('payeeNote'),
+            'status': MTN_STATUSES[status],
+        }
+        if status == 'failed':
+            result['reason'] = 'APPROVAL_REJECTED' if party_key == 'payer' else 'PAYEE_NOT_FOUND'
+        return result
+
+    def send_callback(self, reference_id: str, callback_url: str):
+        """Notifies the callback url like the gateway does, errors are ignored"""
+        body = json.dumps(self.mtn_transaction(reference_id)).encode()
+        request = Request(callback_url, data=body, method='PUT',
+                          headers={'Content-Type': 'application/json'})
+        try:
+            urlopen(request, timeout=5).close()
+        except Exception:
+            pass
@@ -0,0 +1,107 @@
+"""Defines the coalescing of concurrent transaction status lookups"""
+import functools
+import threading
+import time
+
+from django.conf import settings
+
+
+class SingleFlight():
+    """
+    Runs one call per key at a time and shares its result.
+
+    Callers asking for a key while a call for it is in flight wait for that
+    call instead of making their own. Results that should be kept are then
+    reused for a few seconds, so users refreshing a payment page or a poller
+    running next to a callback do not each reach the gateway or database.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._results = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, func, ttl: float = None, keep=None):
+        """
+        Calls func once for concurrent callers of the same key.
+
+        Args:
+            key: A hashable that identifies the lookup.
+            func(callable): Makes the lookup, called without arguments.
+            ttl(float): Seconds a result is reused, defaults to MOMO_STATUS_CACHE_TTL.
+            keep(callable): Called with the result, returns False for results
+                that should not be reused e.g errors. All results are kept when None.
+
+        Returns:
+            The result of func. Exceptions raised by func are raised in every
+            waiting caller.
+        """
+        if ttl is None:
+            ttl = getattr(settings, 'MOMO_STATUS_CACHE_TTL', 2)
+        with self._lock:
+            cached = self._results.get(key)
+            if cached is not None and cached[1] > time.monotonic():
+                return cached[0]
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = {'done': threading.Event()}
+
+        if not leader:
+            call['done'].wait()
+            if 'error' in call:
+                raise call['error']
+            return call['result']
+
+        try:
+            call['result'] = func()
+        except Exception as e:
+            call['error'] = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+                if 'result' in call and ttl > 0 and (keep is None or keep(call['result'])):
+                    self._results[key] = (call['result'], time.monotonic() + ttl)
+                self._drop_expired()
+            call['done'].set()
+        return call['result']
+
+    def _drop_expired(self):
+        now = time.monotonic()
+        for key in [key for key, (result, expires_at) in self._results.items() if expires_at <= now]:
+            del self._results[key]
+
+    def forget(self, key):
+        """Drops the kept result of a key"""
+        with self._lock:
+            self._results.pop(key, None)
+
+    def clear(self):
+        """Drops every kept result"""
+        with self._lock:
+            self._results.clear()
+
+
+status_lookups = SingleFlight()
+
+
+def coalesced(product: str):
+    """
+    Decorates the status methods of gateway clients so that concurrent
+    lookups of a transaction share one gateway call. Only answers with the
+    status code 200 are reused after the call.
+
+    Args:
+        product(str): collection or disbursement.
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            key = (self.provider, product, self.base_url, method.__name__,
+                   args, tuple(sorted(kwargs.items())))
+            return status_lookups.do(
+                key, lambda: method(self, *args, **kwargs),
+                keep=lambda response: getattr(response, 'status_code', None) == 200)
+        return wrapper
+    return decorator
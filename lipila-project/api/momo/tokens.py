@@ -0,0 +1,244 @@
+"""Defines a process wide store for momo api access tokens"""
+import asyncio
+import hashlib
+import threading
+import time
+import uuid
+import weakref
+
+from django.conf import settings
+from django.core.cache import caches
+
+
+class TokenCache():
+    """
+    Caches OAuth access tokens so that a token is minted once and reused
+    by every request until shortly before it expires.
+
+    Tokens are always kept in process memory. When the MOMO_TOKEN_CACHE
+    setting names a django cache alias the tokens are also shared through
+    that cache so that all worker processes reuse the same token, and a
+    lock in that cache lets a single process mint a new one.
+    """
+
+    def __init__(self):
+        self._tokens = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+        self._async_locks = weakref.WeakKeyDictionary()
+
+    @staticmethod
+    def make_key(product: str, subscription_key: str, api_user: str = '') -> str:
+        """
+        Builds the cache key for a product, subscription key and api user.
+        The keys are hashed so they never appear in the cache.
+
+        Args:
+            product(str): The api product (collection, disbursement, airtel...)
+            subscription_key(str): The key used to mint the token.
+            api_user(str): The api user the token is minted for.
+
+        Returns:
+            str: The cache key.
+        """
+        digest = hashlib.sha256(f'{subscription_key}:{api_user}'.encode('utf-8')).hexdigest()
+        return f"momo:token:{product}:{digest[:16]}"
+
+    @property
+    def refresh_margin(self) -> int:
+        return getattr(settings, 'MOMO_TOKEN_REFRESH_MARGIN', 60)
+
+    @property
+    def shared_cache(self):
+        alias = getattr(settings, 'MOMO_TOKEN_CACHE', '')
+        return caches[alias] if alias else None
+
+    @property
+    def lock_timeout(self) -> int:
+        return getattr(settings, 'MOMO_TOKEN_LOCK_TIMEOUT', 10)
+
+    def _key_lock(self, key: str) -> threading.Lock:
+        with self._lock:
+            return self._locks.setdefault(key, threading.Lock())
+
+    def _async_key_lock(self, key: str) -> asyncio.Lock:
+        locks = self._async_locks.setdefault(asyncio.get_running_loop(), {})
+        return locks.setdefault(key, asyncio.Lock())
+
+    def _lookup(self, key: str):
+        """
+        Returns the (token, expires_at) entry for key or None. The shared
+        cache is read whenever the entry in process memory is not fresh,
+        another process may have stored a newer token there.
+        """
+        entry = self._tokens.get(key)
+        if not self._is_fresh(entry) and self.shared_cache is not None:
+            shared = self.shared_cache.get(key)
+            if shared is not None and (entry is None or shared[1] > entry[1]):
+                entry = shared
+                self._tokens[key] = entry
+        if entry is not None and entry[1] <= time.time():
+            return None
+        return entry
+
+    def _acquire_shared(self, key: str):
+        """
+        Takes the lock that lets a single process mint the token of key.
+
+        Returns:
+            str: The lock id, empty without a shared cache, or None when
+            another process holds the lock.
+        """
+        if self.shared_cache is None:
+            return ''
+        lock_id = uuid.uuid4().hex
+        if self.shared_cache.add(f'{key}:lock', lock_id, timeout=self.lock_timeout):
+            return lock_id
+        return None
+
+    def _release_shared(self, key: str, lock_id: str):
+        # the lock may have expired and been taken by another process
+        if lock_id and self.shared_cache.get(f'{key}:lock') == lock_id:
+            self.shared_cache.delete(f'{key}:lock')
+
+    def _is_minting(self, key: str) -> bool:
+        return self.shared_cache.get(f'{key}:lock') is not None
+
+    def _wait_shared(self, key: str):
+        """Waits for the process holding the lock of key to store a token"""
+        deadline = time.monotonic() + self.lock_timeout
+        while time.monotonic() < deadline and self._is_minting(key):
+            time.sleep(0.05)
+        return self._lookup(key)
+
+    async def _await_shared(self, key: str):
+        """Async version of _wait_shared"""
+        deadline = time.monotonic() + self.lock_timeout
+        while time.monotonic() < deadline and self._is_minting(key):
+            await asyncio.sleep(0.05)
+        return self._lookup(key)
+
+    def _store(self, key: str, entry, result):
+        """Stores the (token, expires_in) result of a fetch, returns the token to use"""
+        if not result:
+            return entry[0] if entry is not None else None
+        token, expires_in = result
+        self.set(key, token, expires_in)
+        return token
+
+    def _is_fresh(self, entry) -> bool:
+        return entry is not None and entry[1] - self.refresh_margin > time.time()
+
+    def get(self, key: str):
+        """
+        Gets a token that is not about to expire.
+
+        Args:
+            key(str): The cache key, see make_key.
+
+        Returns:
+            str: The token or None.
+        """
+        entry = self._lookup(key)
+        return entry[0] if self._is_fresh(entry) else None
+
+    def set(self, key: str, token: str, expires_in: int):
+        """
+        Stores a token.
+
+        Args:
+            key(str): The cache key, see make_key.
+            token(str): The access token.
+            expires_in(int): Lifetime of the token in seconds.
+        """
+        expires_in = int(expires_in)
+        entry = (token, time.time() + expires_in)
+        self._tokens[key] = entry
+        if self.shared_cache is not None:
+            self.shared_cache.set(key, entry, timeout=expires_in)
+
+    def invalidate(self, key: str):
+        """Drops a token, e.g after the gateway rejected it with a 401"""
+        self._tokens.pop(key, None)
+        if self.shared_cache is not None:
+            self.shared_cache.delete(key)
+
+    def clear(self):
+        """Drops every token held in process memory"""
+        self._tokens.clear()
+
+    def get_or_fetch(self, key: str, fetch):
+        """
+        Gets a token, calling fetch only when no fresh token is stored.
+
+        Concurrent callers for the same key share a single fetch, across
+        processes when there is a shared cache. While a token is being
+        refreshed ahead of its expiry, other callers keep using the old
+        token instead of waiting.
+
+        Args:
+            key(str): The cache key, see make_key.
+            fetch(callable): Returns a (token, expires_in) tuple or None
+                when a token could not be minted.
+
+        Returns:
+            str: The token or None.
+        """
+        entry = self._lookup(key)
+        if self._is_fresh(entry):
+            return entry[0]
+
+        lock = self._key_lock(key)
+        if entry is not None:
+            # still valid, let a single caller refresh it
+            if not lock.acquire(blocking=False):
+                return entry[0]
+        else:
+            lock.acquire()
+        try:
+            entry = self._lookup(key)
+            if self._is_fresh(entry):
+                return entry[0]
+            lock_id = self._acquire_shared(key)
+            if lock_id is None:
+                # another process is minting the token
+                if entry is None:
+                    entry = self._wait_shared(key)
+                if entry is not None:
+                    return entry[0]
+            try:
+                return self._store(key, entry, fetch())
+            finally:
+                self._release_shared(key, lock_id)
+        finally:
+            lock.release()
+
+    async def aget_or_fetch(self, key: str, fetch):
+        """
+        Async version of get_or_fetch, fetch is a coroutine function.
+        Callers on the same event loop share a single fetch.
+        """
+        entry = self._lookup(key)
+        if self._is_fresh(entry):
+            return entry[0]
+
+        lock = self._async_key_lock(key)
+        if entry is not None and lock.locked():
+            return entry[0]
+        async with lock:
+            entry = self._lookup(key)
+            if self._is_fresh(entry):
+                return entry[0]
+            lock_id = self._acquire_shared(key)
+            if lock_id is None:
+                if entry is None:
+                    entry = await self._await_shared(key)
+                if entry is not None:
+                    return entry[0]
+            try:
+                return self._store(key, entry, await fetch())
+            finally:
+                self._release_shared(key, lock_id)
+
+
+token_cache = TokenCache()
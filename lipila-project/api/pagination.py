@@ -0,0 +1,113 @@
+"""
+Keyset pagination of the transaction list endpoints
+"""
+import base64
+import json
+from datetime import datetime, time
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+
+def encode_cursor(updated_at, pk: int) -> str:
+    """Returns the opaque cursor of the page that starts after a row"""
+    payload = json.dumps([updated_at.isoformat(), pk]).encode()
+    return base64.urlsafe_b64encode(payload).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str) -> tuple:
+    """
+    Reads a cursor made by encode_cursor.
+
+    Returns:
+        tuple: The updated_at and pk of the last row of the previous page.
+
+    Raises:
+        ValueError: When the cursor was not made by encode_cursor.
+    """
+    try:
+        payload = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        updated_at, pk = json.loads(payload)
+        updated_at = parse_datetime(updated_at)
+    except (TypeError, ValueError):
+        raise ValueError('Invalid cursor')
+    if updated_at is None or not isinstance(pk, int):
+        raise ValueError('Invalid cursor')
+    return updated_at, pk
+
+
+def parse_time(value: str, end_of_day: bool = False):
+    """Reads a since or until filter, an ISO date or datetime"""
+    day = parse_date(value)
+    if day is not None:
+        moment = datetime.combine(day, time.max if end_of_day else time.min)
+    else:
+        moment = parse_datetime(value)
+        if moment is None:
+            raise ValueError(f'Invalid date {value}')
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
+
+def filter_transactions(params, queryset):
+    """
+    Applies the status, since and until filters of the list and export
+    endpoints.
+
+    Raises:
+        ValueError: When a date is invalid.
+    """
+    if params.get('status'):
+        queryset = queryset.filter(status=params['status'])
+    if params.get('since'):
+        queryset = queryset.filter(updated_at__gte=parse_time(params['since']))
+    if params.get('until'):
+        queryset = queryset.filter(updated_at__lte=parse_time(params['until'], end_of_day=True))
+    return queryset
+
+
+def paginate(request, queryset) -> tuple:
+    """
+    Gets one page of transactions, newest first.
+
+    Pages are read with a keyset on (updated_at, id) instead of an offset,
+    so every page costs the same however deep it is. The query parameters
+    are limit (MOMO_PAGE_SIZE by default, at most MOMO_MAX_PAGE_SIZE),
+    cursor, status, since and until.
+
+    Args:
+        request: The list request.
+        queryset: The transactions of the api user.
+
+    Returns:
+        tuple: The rows of the page and the headers pointing at the next page.
+
+    Raises:
+        ValueError: When a query parameter is invalid.
+    """
+    params = request.query_params
+    limit = params.get('limit', getattr(settings, 'MOMO_PAGE_SIZE', 100))
+    try:
+        limit = int(limit)
+    except ValueError:
+        raise ValueError('Invalid limit')
+    limit = max(1, min(limit, getattr(settings, 'MOMO_MAX_PAGE_SIZE', 1000)))
+
+    queryset = filter_transactions(params, queryset)
+    if params.get('cursor'):
+        updated_at, pk = decode_cursor(params['cursor'])
+        queryset = queryset.filter(Q(updated_at__lt=updated_at) | Q(updated_at=updated_at, pk__lt=pk))
+
+    rows = list(queryset.order_by('-updated_at', '-pk')[:limit + 1])
+    headers = {}
+    if len(rows) > limit:
+        rows = rows[:limit]
+        cursor = encode_cursor(rows[-1].updated_at, rows[-1].pk)
+        query = params.copy()
+        query['cursor'] = cursor
+        url = request.build_absolute_uri(f'{request.path}?{query.urlencode()}')
+        headers = {'Link': f'<{url}>; rel="next"', 'X-Next-Cursor': cursor}
+    return rows, headers
@@ -0,0 +1,151 @@
+"""
+Background polling of the gateway for accepted transactions
+"""
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import F, Q
+from django.utils import timezone
+from rest_framework.response import Response
+
+from api.bulk import run_concurrently
+from api.models import LipilaCollection, LipilaDisbursement
+from api.momo.breaker import GatewayUnavailable
+from api.momo.gateways import get_client, get_provider
+from api.transactions import get_gateway_status, get_poll_delay, propagate_status
+
+
+class StatusPoller():
+    """
+    Polls the gateway for LipilaCollection and LipilaDisbursement rows in the
+    accepted state. Due rows are polled concurrently, the results are saved
+    with a few bulk updates per batch and final statuses are propagated to
+    the Payments, Contributions and WithdrawalRequest models.
+    """
+
+    def __init__(self, batch_size: int = None, concurrency: int = None):
+        self.batch_size = batch_size or getattr(settings, 'MOMO_POLL_BATCH_SIZE', 100)
+        self.concurrency = concurrency or getattr(settings, 'MOMO_POLL_CONCURRENCY', 8)
+        self.max_attempts = getattr(settings, 'MOMO_POLL_MAX_ATTEMPTS', 12)
+
+    def get_client(self, model, payment_method: str = 'mtn'):
+        """Returns a ready gateway client for transactions of model or None"""
+        product = 'collection' if model is LipilaCollection else 'disbursement'
+        client = get_client(payment_method, product)
+        try:
+            return client if client.setup() else None
+        except GatewayUnavailable:
+            return None
+
+    def fetch_status(self, client, transaction):
+        """
+        Asks the gateway for the status of a transaction.
+
+        Returns:
+            str: 'success' or 'failed', 'pending' while the gateway has no
+            final status or does not know the transaction, None when the
+            gateway did not answer.
+        """
+        try:
+            if isinstance(transaction, LipilaCollection):
+                response = client.get_payment_status(transaction.reference_id)
+            else:
+                response = client.get_transaction_status('deposit', transaction.reference_id)
+            if response is not None and response.status_code == 404:
+                return 'pending'
+            if response is None or response.status_code != 200:
+                return None
+            data = response.data if isinstance(response, Response) else response.json()
+            return get_gateway_status(data) or 'pending'
+        except Exception:
+            return None
+
+    def get_due(self, model) -> list:
+        """Returns the accepted transactions whose next poll is due"""
+        due = Q(next_poll_at__isnull=True) | Q(next_poll_at__lte=timezone.now())
+        return list(model.objects.filter(due, status='accepted').order_by(
+            F('next_poll_at').asc(nulls_first=True))[:self.batch_size])
+
+    def poll_model(self, model) -> dict:
+        """
+        Polls one batch of due transactions of model.
+
+        Returns:
+            dict: The number of transactions polled, completed and failed.
+        """
+        counts = {'polled': 0, 'success': 0, 'failed': 0}
+        transactions = self.get_due(model)
+        if not transactions:
+            return counts
+        # every gateway gets its own client
+        clients = {}
+        for transaction in transactions:
+            provider = get_provider(transaction.payment_method)
+            if provider not in clients:
+                clients[provider] = self.get_client(model, provider)
+
+        def fetch(transaction):
+            client = clients[get_provider(transaction.payment_method)]
+            return None if client is None else self.fetch_status(client, transaction)
+
+        statuses = run_concurrently(fetch, transactions, self.concurrency)
+
+        now = timezone.now()
+        pending, final = [], {}
+        for transaction, status in zip(transactions, statuses):
+            if status is None:
+                # no answer, e.g the gateway is down, does not count toward the limit.
+                # rows never answered for stay accepted for the reconciler
+                transaction.next_poll_at = now + timedelta(
+                    seconds=get_poll_delay(transaction.poll_attempts + 1))
+                pending.append(transaction)
+                continue
+            transaction.poll_attempts += 1
+            if status == 'pending' and transaction.poll_attempts >= self.max_attempts:
+                status = 'failed'
+            if status == 'pending':
+                transaction.next_poll_at = now + timedelta(
+                    seconds=get_poll_delay(transaction.poll_attempts))
+                pending.append(transaction)
+            else:
+                final.setdefault(status, []).append(transaction.reference_id)
+        counts['polled'] = len(transactions)
+
+        model.objects.bulk_update(pending, ['poll_attempts', 'next_poll_at'])
+        for status, reference_ids in final.items():
+            # a callback may have completed the transaction meanwhile
+            counts[status] += model.objects.filter(
+                reference_id__in=reference_ids, status='accepted').update(
+                status=status, poll_attempts=F('poll_attempts') + 1,
+                next_poll_at=None, updated_at=now)
+        propagate_status({reference_id: status for status, reference_ids in final.items()
+                          for reference_id in reference_ids})
+        return counts
+
+    def poll_once(self) -> dict:
+        """
+        Polls one batch of collections and one of disbursements.
+
+        Returns:
+            dict: The counts of poll_model per model name.
+        """
+        return {
+            'collections': self.poll_model(LipilaCollection),
+            'disbursements': self.poll_model(LipilaDisbursement),
+        }
+
+    def run(self, interval: float = 2, iterations: int = None):
+        """
+        Polls until stopped, sleeping interval seconds when nothing was due.
+
+        Args:
+            interval(float): Seconds to sleep between idle batches.
+            iterations(int): Stop after this many batches, runs forever when None.
+        """
+        count = 0
+        while iterations is None or count < iterations:
+            result = self.poll_once()
+            count += 1
+            if not any(counts['polled'] for counts in result.values()):
+                time.sleep(interval)
@@ -0,0 +1,173 @@
+"""
+Reconciliation of transactions that never reached a final status
+"""
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from api.bulk import run_concurrently
+from api.models import LipilaCollection, LipilaDisbursement
+from api.momo.gateways import get_provider
+from api.poller import StatusPoller
+from api.transactions import FINAL_STATUSES, propagate_status
+
+
+def parse_cursor(cursor: str) -> tuple:
+    """
+    Reads a cursor printed by reconcile_transactions.
+
+    Args:
+        cursor(str): '<name>:<pk>' e.g 'disbursements:1520'.
+
+    Returns:
+        tuple: The model name and the last reconciled pk.
+    """
+    name, _, pk = str(cursor).partition(':')
+    if name not in Reconciler.names or not pk.isdigit():
+        raise ValueError(f'Invalid cursor {cursor}')
+    return name, int(pk)
+
+
+class Reconciler():
+    """
+    Finds transactions that are not final after older_than minutes and
+    settles them.
+
+    Collections and disbursements are checked with the gateway concurrently
+    and saved with bulk_update one chunk at a time. Payments, Contributions
+    and WithdrawalRequest rows are compared with their api transaction:
+    rows behind a final transaction are mismatches and are updated, rows
+    without a transaction are reported as missing.
+
+    Rows are scanned in pk order and the cursor of the last chunk is kept,
+    so an interrupted run can be resumed where it stopped.
+    """
+
+    names = ('collections', 'disbursements', 'payments', 'contributions', 'withdrawals')
+
+    def __init__(self, older_than: float = None, chunk_size: int = None,
+                 concurrency: int = None, dry_run: bool = False):
+        if older_than is None:
+            older_than = getattr(settings, 'MOMO_RECONCILE_AFTER', 30)
+        self.cutoff = timezone.now() - timedelta(minutes=older_than)
+        self.chunk_size = chunk_size or getattr(settings, 'MOMO_RECONCILE_CHUNK_SIZE', 500)
+        self.poller = StatusPoller(concurrency=concurrency)
+        self.dry_run = dry_run
+        self.cursor = None
+
+    def get_querysets(self) -> dict:
+        """Returns the non final rows of every model that are older than the cutoff"""
+        # imported here, the patron models import api utils
+        from patron.models import Payments, Contributions, WithdrawalRequest
+
+        return {
+            'collections': LipilaCollection.objects.filter(processed_date__lte=self.cutoff),
+            # processed_date of disbursements is a date
+            'disbursements': LipilaDisbursement.objects.filter(processed_date__lte=self.cutoff.date()),
+            'payments': Payments.objects.filter(timestamp__lte=self.cutoff),
+            'contributions': Contributions.objects.filter(timestamp__lte=self.cutoff),
+            'withdrawals': WithdrawalRequest.objects.filter(
+                request_date__lte=self.cutoff, reference_id__isnull=False),
+        }
+
+    def get_chunks(self, queryset, after: int = 0):
+        """Yields chunks of non final rows in pk order, starting after the pk after"""
+        queryset = queryset.exclude(status__in=FINAL_STATUSES).order_by('pk')
+        while True:
+            chunk = list(queryset.filter(pk__gt=after)[:self.chunk_size])
+            if not chunk:
+                return
+            yield chunk
+            after = chunk[-1].pk
+
+    def reconcile_transactions(self, model, chunk: list, counts: dict):
+        """Asks the gateway for the status of a chunk of api transactions and saves the final ones"""
+        clients = {}
+        for transaction in chunk:
+            provider = get_provider(transaction.payment_method)
+            if provider not in clients:
+                clients[provider] = self.poller.get_client(model, provider)
+
+        def fetch(transaction):
+            client = clients[get_provider(transaction.payment_method)]
+            return None if client is None else self.poller.fetch_status(client, transaction)
+
+        statuses = run_concurrently(fetch, chunk, self.poller.concurrency)
+        now = timezone.now()
+        # a callback or the poller may have settled some rows meanwhile
+        settled = set(model.objects.filter(
+            pk__in=[transaction.pk for transaction in chunk],
+            status__in=FINAL_STATUSES).values_list('pk', flat=True))
+        updated = []
+        for transaction, status in zip(chunk, statuses):
+            if status in (None, 'pending') or transaction.pk in settled:
+                counts['pending'] += 1
+                continue
+            if transaction.status != 'accepted':
+                # the gateway has a result for a row that was never accepted
+                counts['mismatches'] += 1
+            transaction.status = status
+            transaction.updated_at = now
+            transaction.next_poll_at = None
+            updated.append(transaction)
+            counts[status] += 1
+        if not self.dry_run and updated:
+            model.objects.bulk_update(updated, ['status', 'updated_at', 'next_poll_at'])
+            propagate_status({transaction.reference_id: transaction.status for transaction in updated})
+
+    def reconcile_references(self, model, chunk: list, counts: dict):
+        """Compares a chunk of patron rows with the status of their api transactions"""
+        statuses = dict(model.objects.filter(
+            reference_id__in=[row.reference_id for row in chunk]).values_list('reference_id', 'status'))
+        updates = {}
+        for row in chunk:
+            status = statuses.get(row.reference_id)
+            if status is None:
+                counts['missing'] += 1
+            elif status in FINAL_STATUSES:
+                counts['mismatches'] += 1
+                counts[status] += 1
+                updates[row.reference_id] = status
+            else:
+                counts['pending'] += 1
+        if not self.dry_run and updates:
+            propagate_status(updates)
+
+    def reconcile(self, name: str, queryset, after: int = 0) -> dict:
+        """
+        Reconciles the non final rows of one model.
+
+        Returns:
+            dict: The counts of scanned, success, failed, pending, mismatched
+            and missing rows and the seconds it took.
+        """
+        counts = {'scanned': 0, 'success': 0, 'failed': 0, 'pending': 0,
+                  'mismatches': 0, 'missing': 0}
+        start = time.monotonic()
+        for chunk in self.get_chunks(queryset, after):
+            counts['scanned'] += len(chunk)
+            if name == 'collections':
+                self.reconcile_transactions(LipilaCollection, chunk, counts)
+            elif name == 'disbursements':
+                self.reconcile_transactions(LipilaDisbursement, chunk, counts)
+            elif name == 'withdrawals':
+                self.reconcile_references(LipilaDisbursement, chunk, counts)
+            else:
+                self.reconcile_references(LipilaCollection, chunk, counts)
+            self.cursor = f'{name}:{chunk[-1].pk}'
+        counts['seconds'] = round(time.monotonic() - start, 3)
+        return counts
+
+    def run(self, cursor: str = None):
+        """
+        Reconciles every model, resuming after cursor when it is given.
+
+        Yields:
+            tuple: The model name and its counts, see reconcile.
+        """
+        start_name, after = parse_cursor(cursor) if cursor else (self.names[0], 0)
+        querysets = self.get_querysets()
+        for name in self.names[self.names.index(start_name):]:
+            yield name, self.reconcile(name, querysets[name], after if name == start_name else 0)
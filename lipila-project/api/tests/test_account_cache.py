@@ -0,0 +1,106 @@
+"""
+Tests the account holder validation cache
+"""
+import time
+from unittest.mock import Mock, patch
+from django.test import SimpleTestCase, override_settings
+from api.momo.accounts import AccountCache, account_cache
+from api.momo.mtn import Collections, Disbursement
+
+
+def active_response(result=True, status_code=200):
+    return Mock(status_code=status_code, json=Mock(return_value={'result': result}))
+
+
+class AccountCacheTestCase(SimpleTestCase):
+    """Test AccountCache"""
+
+    def setUp(self):
+        self.cache = AccountCache()
+        self.key = AccountCache.make_key('collection', 'MSISDN', '0966443322', 'sandbox')
+
+    def test_make_key(self):
+        self.assertEqual(self.key, 'momo:account:sandbox:collection:msisdn:0966443322')
+
+    @override_settings(MOMO_ACCOUNT_TTL=60, MOMO_ACCOUNT_NEGATIVE_TTL=0.01)
+    def test_separate_ttls(self):
+        other = AccountCache.make_key('collection', 'msisdn', '0977112233', 'sandbox')
+        self.cache.set(self.key, True)
+        self.cache.set(other, False)
+        self.assertIs(self.cache.get(other), False)
+        time.sleep(0.02)
+        self.assertIsNone(self.cache.get(other))
+        self.assertIs(self.cache.get(self.key), True)
+
+    @override_settings(MOMO_ACCOUNT_CACHE_SIZE=2)
+    def test_size_is_bounded(self):
+        for number in ('1', '2'):
+            self.cache.set(number, True)
+        self.cache.get('1')
+        self.cache.set('3', True)
+        self.assertIsNone(self.cache.get('2'))
+        self.assertTrue(self.cache.get('1'))
+        self.assertTrue(self.cache.get('3'))
+
+    @override_settings(
+        MOMO_ACCOUNT_CACHE='accounts',
+        CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+                'accounts': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                             'LOCATION': 'accounts'}})
+    def test_shared_cache(self):
+        self.cache.set(self.key, False)
+        self.assertIs(AccountCache().get(self.key), False)
+
+
+class AccountValidationTestCase(SimpleTestCase):
+    """Test MTNBase.is_account_active and the checks before payments"""
+
+    def setUp(self):
+        account_cache.clear()
+
+    def tearDown(self):
+        account_cache.clear()
+
+    @patch('api.momo.mtn.MTNBase.validate_account_holder', return_value=active_response())
+    def test_result_is_cached(self, mock_validate):
+        momo = Collections()
+        for i in range(3):
+            self.assertTrue(momo.is_account_active('key', 'collection', '0966443322'))
+        mock_validate.assert_called_once()
+
+    @patch('api.momo.mtn.MTNBase.validate_account_holder', return_value=active_response(status_code=404))
+    def test_not_found_is_inactive(self, mock_validate):
+        self.assertIs(Collections().is_account_active('key', 'collection', '0966443322'), False)
+        self.assertIs(Collections().is_account_active('key', 'collection', '0966443322'), False)
+        mock_validate.assert_called_once()
+
+    @patch('api.momo.mtn.MTNBase.validate_account_holder', return_value=active_response(status_code=500))
+    def test_errors_are_not_cached(self, mock_validate):
+        self.assertIsNone(Collections().is_account_active('key', 'collection', '0966443322'))
+        self.assertIsNone(Collections().is_account_active('key', 'collection', '0966443322'))
+        self.assertEqual(mock_validate.call_count, 2)
+
+    @override_settings(MOMO_VALIDATE_ACCOUNTS=False)
+    @patch('api.momo.mtn.MTNBase.validate_account_holder')
+    def test_validation_disabled(self, mock_validate):
+        self.assertIsNone(Collections().is_account_active('key', 'collection', '0966443322'))
+        mock_validate.assert_not_called()
+
+    @patch('api.momo.mtn.send')
+    @patch('api.momo.mtn.MTNBase.validate_account_holder', return_value=active_response(False))
+    def test_inactive_payer_is_not_charged(self, mock_validate, mock_send):
+        response = Collections().request_to_pay('100', '0966443322', 'ref-1')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['reason'], 'Account holder not active')
+        response = Disbursement().deposit('100', '0966443322', 'ref-2')
+        self.assertEqual(response.status_code, 400)
+        mock_send.assert_not_called()
+
+    @patch('api.momo.mtn.MTNBase.validate_account_holder')
+    def test_validate_accounts(self, mock_validate):
+        mock_validate.side_effect = lambda key, id_type, account_id, endpoint: active_response(
+            account_id != '0977112233')
+        result = Disbursement().validate_accounts(
+            'key', 'disbursement', ['0966443322', '0977112233', '0966443322'])
+        self.assertEqual(result, {'0966443322': True, '0977112233': False})
+        self.assertEqual(mock_validate.call_count, 2)
@@ -0,0 +1,172 @@
+"""
+Tests the airtel money client against the local gateway simulator
+"""
+import os
+import time
+from unittest.mock import Mock, patch
+import requests
+from django.contrib.auth.models import User
+from django.test import SimpleTestCase, override_settings
+from rest_framework.test import APITestCase
+from api.models import LipilaCollection
+from api.momo.airtel import AirtelMomo
+from api.momo.breaker import reset_breakers
+from api.momo.gateways import get_client, get_quota_name
+from api.momo.mtn import Collections, Disbursement
+from api.momo.simulator import GatewaySimulator
+from api.momo.tokens import token_cache
+from api.utils import generate_reference_id
+
+simulator = GatewaySimulator()
+credentials = {'AIRTEL_CLIENT_ID': 'lipila', 'AIRTEL_CLIENT_SECRET': 'secret'}
+
+
+def setUpModule():
+    global settings_override, env_override
+    simulator.start()
+    settings_override = override_settings(AIRTEL_BASE_URL=simulator.url)
+    settings_override.enable()
+    env_override = patch.dict(os.environ, credentials)
+    env_override.start()
+
+
+def tearDownModule():
+    env_override.stop()
+    settings_override.disable()
+    simulator.stop()
+
+
+class GatewaysTestCase(SimpleTestCase):
+    """Test that payment methods are mapped to their clients"""
+
+    def test_get_client(self):
+        self.assertIsInstance(get_client('mtn', 'collection'), Collections)
+        self.assertIsInstance(get_client('mtn', 'disbursement'), Disbursement)
+        self.assertIsInstance(get_client('Airtel', 'collection'), AirtelMomo)
+        self.assertIsInstance(get_client('airtel', 'disbursement'), AirtelMomo)
+        # unknown methods are sent to the default gateway
+        self.assertIsInstance(get_client('', 'collection'), Collections)
+
+    def test_get_quota_name(self):
+        self.assertEqual(get_quota_name('mtn', 'collection'), 'collection')
+        self.assertEqual(get_quota_name('airtel', 'disbursement'), 'airtel_disbursement')
+
+
+# statuses are polled until they change
+@override_settings(MOMO_STATUS_CACHE_TTL=0)
+class AirtelMomoTestCase(SimpleTestCase):
+    """Test the airtel money client"""
+
+    def setUp(self):
+        token_cache.clear()
+        reset_breakers()
+        simulator.completion_delay = 0
+        self.airtel = AirtelMomo()
+
+    def tearDown(self):
+        token_cache.clear()
+
+    def test_get_msisdn(self):
+        self.assertEqual(AirtelMomo.get_msisdn('0977123456'), '977123456')
+        self.assertEqual(AirtelMomo.get_msisdn('260977123456'), '977123456')
+        self.assertEqual(AirtelMomo.get_msisdn('977123456'), '977123456')
+
+    def test_setup_without_credentials(self):
+        self.airtel.client_id = ''
+        self.assertFalse(self.airtel.setup())
+
+    def test_token_is_cached(self):
+        with patch.object(AirtelMomo, 'authorization', wraps=self.airtel.authorization) as mock_auth:
+            self.assertTrue(self.airtel.setup())
+            self.assertTrue(AirtelMomo().setup())
+        mock_auth.assert_called_once()
+        self.assertTrue(self.airtel.api_token.startswith('Bearer '))
+        self.assertGreater(len(self.airtel.api_token), len('Bearer '))
+
+    def test_request_to_pay(self):
+        self.airtel.setup()
+        reference_id = generate_reference_id()
+        response = self.airtel.request_to_pay('100', '0977123456', reference_id)
+        self.assertEqual(response.status_code, 202)
+        status = self.airtel.get_payment_status(reference_id)
+        self.assertEqual(status.status_code, 200)
+        self.assertEqual(status.data['externalId'], reference_id)
+        self.assertIn(status.data['status'], ('SUCCESSFUL', 'FAILED'))
+
+    def test_deposit_completes_later(self):
+        simulator.completion_delay = 0.2
+        self.airtel.setup()
+        reference_id = generate_reference_id()
+        response = self.airtel.deposit('100', '0977123456', reference_id)
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(
+            self.airtel.get_transaction_status('deposit', reference_id).data['status'], 'PENDING')
+        time.sleep(0.3)
+        self.assertIn(
+            self.airtel.get_transaction_status('deposit', reference_id).data['status'],
+            ('SUCCESSFUL', 'FAILED'))
+
+    def test_duplicate_and_unknown_transactions(self):
+        self.airtel.setup()
+        reference_id = generate_reference_id()
+        self.assertEqual(self.airtel.request_to_pay('100', '0977123456', reference_id).status_code, 202)
+        self.assertEqual(self.airtel.request_to_pay('100', '0977123456', reference_id).status_code, 400)
+        self.assertEqual(self.airtel.get_payment_status(generate_reference_id()).status_code, 404)
+
+    def test_unauthorized_token_is_replaced(self):
+        self.airtel.setup()
+        self.airtel.api_token = 'Bearer expired'
+        response = self.airtel.request_to_pay('100', '0977123456', generate_reference_id())
+        self.assertEqual(response.status_code, 202)
+        self.assertNotEqual(self.airtel.api_token, 'Bearer expired')
+
+    def test_rejected_credentials(self):
+        self.airtel.setup()
+        self.airtel.api_token = 'Bearer expired'
+        with patch.object(AirtelMomo, 'authorize', return_value=None):
+            response = self.airtel.request_to_pay('100', '0977123456', generate_reference_id())
+        # not made, the router may try another gateway
+        self.assertEqual(response.status_code, 503)
+        self.assertIsNone(token_cache.get(self.airtel.token_key))
+
+    def test_invalid_payment(self):
+        self.assertEqual(self.airtel.request_to_pay('100', '12', generate_reference_id()).status_code, 400)
+        self.assertEqual(self.airtel.request_to_pay(100, '0977123456', generate_reference_id()).status_code, 400)
+
+    @patch('api.momo.airtel.send')
+    def test_gateway_errors(self, mock_send):
+        mock_send.side_effect = requests.ReadTimeout('read')
+        # the payment may have been taken, it is polled
+        self.assertEqual(self.airtel.request_to_pay('100', '0977123456', generate_reference_id()).status_code, 500)
+        self.assertEqual(self.airtel.get_payment_status(generate_reference_id()).status_code, 500)
+        self.assertEqual(self.airtel.get_account_balance().status_code, 500)
+        mock_send.side_effect = requests.ConnectTimeout('connect')
+        self.assertEqual(self.airtel.deposit('100', '0977123456', generate_reference_id()).status_code, 503)
+        mock_send.side_effect = None
+        mock_send.return_value = Mock(status_code=502)
+        self.assertEqual(self.airtel.deposit('100', '0977123456', generate_reference_id()).status_code, 500)
+
+    def test_get_account_balance(self):
+        self.airtel.setup()
+        self.assertEqual(self.airtel.get_account_balance().status_code, 200)
+
+
+class AirtelViewTestCase(APITestCase):
+    """Test that payments with the airtel payment method use the airtel client"""
+
+    def setUp(self):
+        token_cache.clear()
+        reset_breakers()
+        user = User.objects.create_user(pk=1, username='lipila', password='password')
+        self.client.force_authenticate(user)
+
+    @patch('api.momo.mtn.Collections.setup')
+    def test_airtel_payment(self, mock_setup):
+        reference_id = generate_reference_id()
+        data = {'payer_account_number': '0977123456', 'amount': '100',
+                'payment_method': 'airtel', 'description': 'test'}
+        response = self.client.post(f'/api/v1/payments/?reference_id={reference_id}', data, format='json')
+        self.assertEqual(response.status_code, 202)
+        mock_setup.assert_not_called()
+        self.assertEqual(LipilaCollection.objects.get(reference_id=reference_id).payment_method, 'airtel')
+        self.assertIn(reference_id, simulator.transactions)
@@ -0,0 +1,152 @@
+"""
+Tests the per-merchant API keys and the user cache
+"""
+from io import StringIO
+from unittest.mock import patch
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from rest_framework.authtoken.models import Token
+from rest_framework.response import Response
+from rest_framework.test import APITestCase
+from api.models import LipilaCollection
+from api.users import get_default_api_user, user_cache
+from api.utils import get_api_user
+from lipila.utils import get_user_object
+
+PAYMENT = {'payer_account_number': '0966443322', 'amount': '100',
+           'payment_method': 'mtn', 'description': 'test'}
+
+
+class UserCacheTestCase(TestCase):
+    """Test the username lookups of get_api_user and get_user_object"""
+
+    def setUp(self):
+        user_cache.clear()
+        self.user = User.objects.create(username='merchant')
+
+    def tearDown(self):
+        user_cache.clear()
+
+    def test_lookup_is_cached(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(get_api_user('merchant'), self.user)
+            self.assertEqual(get_user_object('merchant'), self.user)
+            self.assertEqual(get_user_object(self.user), self.user)
+
+    def test_missing_user(self):
+        self.assertEqual(get_api_user('nobody').status_code, 404)
+        self.assertIsNone(get_user_object('nobody'))
+        User.objects.create(username='nobody')
+        self.assertEqual(get_api_user('nobody').username, 'nobody')
+
+    def test_saved_user_is_dropped(self):
+        get_api_user('merchant')
+        self.user.username = 'renamed'
+        self.user.save()
+        self.assertEqual(get_api_user('merchant').status_code, 404)
+        self.assertEqual(get_api_user('renamed'), self.user)
+        self.user.delete()
+        self.assertIsNone(get_user_object('renamed'))
+
+    def test_callers_get_a_copy(self):
+        get_api_user('merchant').email = 'changed@bot.com'
+        self.assertEqual(get_api_user('merchant').email, '')
+
+    @override_settings(API_USER_CACHE_SIZE=2)
+    def test_least_recently_used_is_dropped(self):
+        for name in ('a', 'b', 'c'):
+            User.objects.create(username=name)
+        get_api_user('a')
+        get_api_user('b')
+        get_api_user('a')
+        get_api_user('c')
+        with self.assertNumQueries(0):
+            get_api_user('a')
+        with self.assertNumQueries(1):
+            get_api_user('b')
+
+    def test_default_api_user(self):
+        User.objects.filter(pk=1).delete()
+        with self.assertRaises(User.DoesNotExist):
+            get_default_api_user()
+        User.objects.create(pk=1, username='lipila')
+        self.assertEqual(get_default_api_user().username, 'lipila')
+
+
+@patch('api.momo.mtn.Collections.setup', return_value=True)
+@patch('api.momo.mtn.Collections.request_to_pay', return_value=Response(status=202))
+class ApiKeyRequestTestCase(APITestCase):
+    """Test that payments belong to the merchant whose key made the request"""
+
+    def setUp(self):
+        cache.clear()
+        user_cache.clear()
+        User.objects.create(pk=1, username='lipila')
+        self.merchant = User.objects.create(username='merchant')
+        self.key = Token.objects.create(user=self.merchant).key
+
+    def tearDown(self):
+        cache.clear()
+        user_cache.clear()
+
+    def test_payment_owner(self, mock_pay, mock_setup):
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.key}')
+        response = self.client.post('/api/v1/payments/?reference_id=ref-1', PAYMENT, format='json')
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(LipilaCollection.objects.get().api_user, self.merchant)
+
+    def test_payment_needs_credentials(self, mock_pay, mock_setup):
+        response = self.client.post('/api/v1/payments/?reference_id=ref-1', PAYMENT, format='json')
+        self.assertEqual(response.status_code, 401)
+        mock_pay.assert_not_called()
+
+    @override_settings(API_ALLOW_ANONYMOUS=True)
+    def test_anonymous_payment_owner(self, mock_pay, mock_setup):
+        self.client.post('/api/v1/payments/?reference_id=ref-2', PAYMENT, format='json')
+        self.assertEqual(LipilaCollection.objects.get(reference_id='ref-2').api_user.username, 'lipila')
+
+    def test_list_without_extra_queries(self, mock_pay, mock_setup):
+        LipilaCollection.objects.create(api_user=self.merchant, amount=100, reference_id='ref-1')
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.key}')
+        self.client.get('/api/v1/payments/')
+        with self.assertNumQueries(2):
+            # the etag aggregate and the page
+            response = self.client.get('/api/v1/payments/', {'api_user': 'lipila'})
+        self.assertEqual(len(response.data), 1)
+
+    def test_list_needs_credentials(self, mock_pay, mock_setup):
+        self.assertEqual(self.client.get('/api/v1/payments/', {'api_user': 'merchant'}).status_code, 401)
+
+    @override_settings(API_ALLOW_ANONYMOUS=True)
+    def test_anonymous_list_needs_a_user(self, mock_pay, mock_setup):
+        self.assertEqual(self.client.get('/api/v1/payments/').status_code, 400)
+
+    def test_retrieve_own_payments_only(self, mock_pay, mock_setup):
+        own = LipilaCollection.objects.create(api_user=self.merchant, amount=100, reference_id='ref-1')
+        other = LipilaCollection.objects.create(
+            api_user=User.objects.get(pk=1), amount=100, reference_id='ref-2')
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.key}')
+        self.assertEqual(self.client.get(f'/api/v1/payments/{own.pk}/').status_code, 200)
+        self.assertEqual(self.client.get(f'/api/v1/payments/{other.pk}/').status_code, 404)
+
+
+class CreateApiKeyTestCase(TestCase):
+    """Test the create_api_key command"""
+
+    def test_create_and_rotate(self):
+        user = User.objects.create(username='merchant')
+        out = StringIO()
+        call_command('create_api_key', 'merchant', stdout=out)
+        key = out.getvalue().strip()
+        self.assertEqual(Token.objects.get(user=user).key, key)
+
+        out = StringIO()
+        call_command('create_api_key', 'merchant', stdout=out)
+        self.assertEqual(out.getvalue().strip(), key)
+
+        out = StringIO()
+        call_command('create_api_key', 'merchant', '--rotate', stdout=out)
+        self.assertNotEqual(out.getvalue().strip(), key)
+        self.assertEqual(Token.objects.count(), 1)
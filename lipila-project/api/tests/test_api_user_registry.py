@@ -0,0 +1,77 @@
+"""
+Tests the mtn momo api user registry
+"""
+from io import StringIO
+from unittest.mock import Mock, patch
+from django.core.management import call_command
+from django.test import TestCase
+from api.models import MomoApiUser
+from api.momo.mtn import Collections, Disbursement, forget_credentials
+
+
+def provisioned(status_code=201):
+    return Mock(status_code=status_code)
+
+
+class LoadCredentialsTestCase(TestCase):
+    """Test MTNBase.load_credentials"""
+
+    def setUp(self):
+        forget_credentials()
+
+    def tearDown(self):
+        forget_credentials()
+
+    def test_registered_api_user_is_used(self):
+        MomoApiUser.objects.create(
+            product='collection', target_environment='sandbox',
+            api_user='registered-user', api_key='registered-key')
+        momo = Collections()
+        with patch.object(Collections, 'provision_sandbox') as mock_provision:
+            self.assertTrue(momo.load_credentials(momo.subscription_col_key, 'collection'))
+        mock_provision.assert_not_called()
+        self.assertEqual(momo.api_user, 'registered-user')
+        self.assertEqual(momo.api_key, 'registered-key')
+
+    def test_provisioned_once_on_first_use(self):
+        def provision(momo, subscription_key, reference_id):
+            momo.api_key = 'new-key'
+            return provisioned()
+
+        with patch.object(Disbursement, 'provision_sandbox', autospec=True,
+                          side_effect=provision) as mock_provision:
+            for _ in range(3):
+                momo = Disbursement()
+                self.assertTrue(momo.load_credentials(momo.subscription_dis_key, 'disbursement'))
+        mock_provision.assert_called_once()
+        self.assertEqual(MomoApiUser.objects.count(), 1)
+        self.assertEqual(MomoApiUser.objects.get().api_key, 'new-key')
+        self.assertEqual(momo.api_user, MomoApiUser.objects.get().api_user)
+
+    def test_failed_provisioning(self):
+        momo = Collections()
+        with patch.object(Collections, 'provision_sandbox', return_value=provisioned(409)):
+            self.assertFalse(momo.load_credentials(momo.subscription_col_key, 'collection'))
+        self.assertEqual(MomoApiUser.objects.count(), 0)
+
+
+class ProvisionCommandTestCase(TestCase):
+    """Test the provision_momo_users command"""
+
+    def tearDown(self):
+        forget_credentials()
+
+    @patch('api.momo.mtn.MTNBase.provision_sandbox', return_value=provisioned())
+    def test_provision_all(self, mock_provision):
+        call_command('provision_momo_users', stdout=StringIO())
+        self.assertEqual(MomoApiUser.objects.count(), 2)
+        # already registered users are kept
+        call_command('provision_momo_users', stdout=StringIO())
+        self.assertEqual(mock_provision.call_count, 2)
+
+    @patch('api.momo.mtn.MTNBase.provision_sandbox', return_value=provisioned())
+    def test_force(self, mock_provision):
+        call_command('provision_momo_users', product='collection', stdout=StringIO())
+        first = MomoApiUser.objects.get().api_user
+        call_command('provision_momo_users', product='collection', force=True, stdout=StringIO())
+        self.assertNotEqual(MomoApiUser.objects.get().api_user, first)
@@ -0,0 +1,73 @@
+"""
+Tests the cached token authentication
+"""
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import TestCase
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.test import APITestCase
+from api.authentication import CachedTokenAuthentication, token_auth_cache
+
+
+class CachedTokenAuthenticationTestCase(TestCase):
+    """Test CachedTokenAuthentication"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='merchant', password='password')
+        self.token = Token.objects.create(user=self.user)
+        self.auth = CachedTokenAuthentication()
+
+    def tearDown(self):
+        cache.clear()
+
+    def test_token_is_resolved_once(self):
+        with self.assertNumQueries(1):
+            user, token = self.auth.authenticate_credentials(self.token.key)
+        with self.assertNumQueries(0):
+            cached_user, cached_token = self.auth.authenticate_credentials(self.token.key)
+        self.assertEqual((cached_user, cached_token), (user, token))
+        self.assertNotIn(self.token.key, token_auth_cache.make_key(self.token.key))
+
+    def test_deleted_token(self):
+        key = self.token.key
+        self.auth.authenticate_credentials(key)
+        self.token.delete()
+        with self.assertRaises(AuthenticationFailed):
+            self.auth.authenticate_credentials(key)
+
+    def test_deactivated_user(self):
+        self.auth.authenticate_credentials(self.token.key)
+        self.user.is_active = False
+        self.user.save()
+        with self.assertRaises(AuthenticationFailed):
+            self.auth.authenticate_credentials(self.token.key)
+
+    def test_login_keeps_the_cache(self):
+        self.auth.authenticate_credentials(self.token.key)
+        self.user.save(update_fields=['last_login'])
+        self.assertIsNotNone(token_auth_cache.get(self.token.key))
+
+
+class TokenRequestTestCase(APITestCase):
+    """Test authenticated requests"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='merchant', password='password')
+
+    def tearDown(self):
+        cache.clear()
+
+    def test_login_caches_the_token(self):
+        response = self.client.post('/api/v1/login/', {'username': 'merchant', 'password': 'password'})
+        self.assertEqual(response.status_code, 200)
+        with self.assertNumQueries(0):
+            user, token = CachedTokenAuthentication().authenticate_credentials(response.data['token'])
+        self.assertEqual(user, self.user)
+
+    def test_invalid_token(self):
+        response = self.client.get('/api/v1/payments/', {'api_user': 'merchant'},
+                                   HTTP_AUTHORIZATION='Token invalid')
+        self.assertEqual(response.status_code, 401)
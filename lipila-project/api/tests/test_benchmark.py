@@ -0,0 +1,27 @@
+"""
+Tests the transaction query benchmark
+"""
+from django.test import TestCase
+from api import benchmark
+from api.models import LipilaCollection
+from patron.models import Payments, WithdrawalRequest
+
+
+class BenchmarkTestCase(TestCase):
+    """Test the seeding and timing of the benchmark"""
+
+    def test_seed(self):
+        seeded = benchmark.seed(30, merchants=3, batch_size=7)
+        self.assertEqual(len(seeded['users']), 3)
+        self.assertEqual(LipilaCollection.objects.count(), 30)
+        self.assertEqual(Payments.objects.count(), 30)
+        self.assertEqual(WithdrawalRequest.objects.filter(creator__in=seeded['creators']).count(), 30)
+
+    def test_time_queries(self):
+        seeded = benchmark.seed(10, merchants=2)
+        queries = benchmark.get_queries(seeded['users'], seeded['creators'])
+        timings = benchmark.time_queries(queries, repeat=3)
+        self.assertEqual(set(timings), set(queries))
+        for timing in timings.values():
+            self.assertLessEqual(timing['median'], timing['max'])
+        self.assertEqual(set(benchmark.explain(queries)), set(queries))
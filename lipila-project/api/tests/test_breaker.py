@@ -0,0 +1,156 @@
+"""
+Tests the gateway circuit breakers and request deadlines
+"""
+import time
+from unittest.mock import Mock, patch
+import requests
+from django.contrib.auth.models import User
+from django.test import SimpleTestCase, override_settings
+from rest_framework.test import APITestCase
+from api.momo import pool
+from api.momo.breaker import (
+    CircuitBreaker, CircuitOpenError, DeadlineExceeded,
+    deadline, get_breaker, get_endpoint_family, get_remaining, reset_breakers)
+from api.momo.mtn import Disbursement
+
+MTN = 'https://sandbox.momodeveloper.mtn.com'
+
+
+class CircuitBreakerTestCase(SimpleTestCase):
+    """Test CircuitBreaker"""
+
+    def test_opens_after_threshold(self):
+        breaker = CircuitBreaker('test', failure_threshold=3, reset_timeout=60)
+        for i in range(2):
+            breaker.record_failure()
+        self.assertTrue(breaker.allow())
+        breaker.record_failure()
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        self.assertFalse(breaker.allow())
+
+    def test_success_resets_failures(self):
+        breaker = CircuitBreaker('test', failure_threshold=2, reset_timeout=60)
+        breaker.record_failure()
+        breaker.record_success()
+        breaker.record_failure()
+        self.assertTrue(breaker.allow())
+
+    def test_half_open_probe(self):
+        breaker = CircuitBreaker('test', failure_threshold=1, reset_timeout=0.01)
+        breaker.record_failure()
+        self.assertFalse(breaker.allow())
+        time.sleep(0.02)
+        # one probe is let through, others fail fast until it completes
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow())
+        breaker.record_failure()
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        time.sleep(0.02)
+        self.assertTrue(breaker.allow())
+        breaker.record_success()
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+        self.assertTrue(breaker.allow())
+
+    def test_endpoint_families(self):
+        host = 'sandbox.momodeveloper.mtn.com'
+        self.assertEqual(get_endpoint_family('POST', f'{MTN}/collection/token/'), f'{host}:token')
+        self.assertEqual(get_endpoint_family('POST', f'{MTN}/collection/v1_0/requesttopay'), f'{host}:requesttopay')
+        self.assertEqual(get_endpoint_family('POST', f'{MTN}/disbursement/v1_0/deposit'), f'{host}:deposit')
+        self.assertEqual(get_endpoint_family('GET', f'{MTN}/disbursement/v1_0/deposit/ref'), f'{host}:status')
+        self.assertEqual(get_endpoint_family('GET', f'{MTN}/disbursement/v1_0/account/balance'), f'{host}:balance')
+        self.assertEqual(get_endpoint_family('POST', f'{MTN}/v1_0/apiuser'), f'{host}:apiuser')
+        self.assertEqual(get_endpoint_family('POST', 'https://openapiuat.airtel.africa/merchant/v1/payments/'),
+                         'openapiuat.airtel.africa:requesttopay')
+
+
+class DeadlineTestCase(SimpleTestCase):
+    """Test deadline"""
+
+    def test_no_deadline(self):
+        self.assertIsNone(get_remaining())
+
+    def test_nested_deadline_does_not_extend(self):
+        with deadline(1):
+            with deadline(60):
+                self.assertLessEqual(get_remaining(), 1)
+        self.assertIsNone(get_remaining())
+
+    def test_deadline_exceeded(self):
+        with deadline(0.01):
+            time.sleep(0.02)
+            with self.assertRaises(DeadlineExceeded):
+                get_remaining()
+
+
+@override_settings(MOMO_BREAKER_FAILURES=2, MOMO_BREAKER_RESET=60,
+                   MOMO_CONNECT_TIMEOUT=5, MOMO_READ_TIMEOUT=30)
+class SendTestCase(SimpleTestCase):
+    """Test the breakers and deadlines applied by pool.send"""
+
+    def setUp(self):
+        reset_breakers()
+
+    def tearDown(self):
+        reset_breakers()
+
+    def test_deadline_cuts_timeout(self):
+        session = Mock()
+        session.request.return_value = Mock(status_code=200)
+        with patch('api.momo.pool.get_session', return_value=session), deadline(2):
+            pool.send('GET', f'{MTN}/disbursement/v1_0/account/balance')
+        connect, read = session.request.call_args.kwargs['timeout']
+        self.assertLessEqual(connect, 2)
+        self.assertLessEqual(read, 2)
+
+    def test_open_circuit_fails_fast(self):
+        session = Mock()
+        session.request.side_effect = requests.ConnectionError()
+        url = f'{MTN}/disbursement/v1_0/deposit'
+        with patch('api.momo.pool.get_session', return_value=session):
+            for i in range(2):
+                with self.assertRaises(requests.ConnectionError):
+                    pool.send('POST', url)
+            with self.assertRaises(CircuitOpenError):
+                pool.send('POST', url)
+            # other endpoint families are not affected
+            session.request.side_effect = None
+            session.request.return_value = Mock(status_code=200)
+            pool.send('GET', f'{MTN}/disbursement/v1_0/account/balance')
+        self.assertEqual(session.request.call_count, 3)
+
+    def test_server_errors_open_circuit(self):
+        session = Mock()
+        session.request.return_value = Mock(status_code=500)
+        with patch('api.momo.pool.get_session', return_value=session):
+            pool.send('GET', f'{MTN}/collection/v2_0/payment/ref')
+            pool.send('GET', f'{MTN}/collection/v2_0/payment/ref')
+        self.assertEqual(get_breaker('GET', f'{MTN}/collection/v2_0/payment/ref').state,
+                         CircuitBreaker.OPEN)
+
+    def test_deposit_returns_503_when_open(self):
+        breaker = get_breaker('POST', f'{MTN}/disbursement/v1_0/deposit')
+        for i in range(2):
+            breaker.record_failure()
+        response = Disbursement().deposit('100', '0966443322', '78bd2e9e-4cf7-4f25-8cd4-28b4d3c3e3c1')
+        self.assertEqual(response.status_code, 503)
+
+
+@override_settings(MOMO_BREAKER_FAILURES=1, MOMO_BREAKER_RESET=60)
+class GatewayUnavailableViewTestCase(APITestCase):
+    """Test that payment views fail fast while a circuit is open"""
+
+    def setUp(self):
+        reset_breakers()
+        self.client.force_authenticate(User.objects.create(username='merchant'))
+
+    def tearDown(self):
+        reset_breakers()
+
+    @patch('api.momo.mtn.Disbursement.setup', side_effect=CircuitOpenError('token'))
+    def test_disburse_returns_503(self, mock_setup):
+        data = {'payee_account_number': '0966443322', 'amount': '100',
+                'payment_method': 'mtn', 'description': 'test'}
+        response = self.client.post('/api/v1/disburse/?reference_id=78bd2e9e-4cf7-4f25-8cd4-28b4d3c3e3c1',
+                                    data, format='json')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.data['message'], 'Payment gateway unavailable')
@@ -0,0 +1,254 @@
+"""
+Tests bulk collections and disbursements
+"""
+import threading
+import time
+import requests
+from unittest.mock import Mock, patch
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import override_settings
+from rest_framework import status
+from rest_framework.test import APITestCase
+from rest_framework.reverse import reverse
+from api.bulk import bulk_collect, bulk_disburse, run_concurrently
+from api.models import LipilaCollection, LipilaDisbursement
+from api.momo.accounts import account_cache
+
+
+def item(payee='0966443322', amount='100', **kwargs):
+    data = {'payee_account_number': payee, 'amount': amount,
+            'payment_method': 'mtn', 'description': 'payout'}
+    data.update(kwargs)
+    return data
+
+
+class RunConcurrentlyTestCase(APITestCase):
+    """Test run_concurrently"""
+
+    def test_concurrency_is_bounded(self):
+        lock = threading.Lock()
+        running = [0, 0]  # current, max
+
+        def work(value):
+            with lock:
+                running[0] += 1
+                running[1] = max(running)
+            time.sleep(0.02)
+            with lock:
+                running[0] -= 1
+            return value * 2
+
+        self.assertEqual(run_concurrently(work, list(range(12)), 3), [i * 2 for i in range(12)])
+        self.assertLessEqual(running[1], 3)
+        self.assertGreater(running[1], 1)
+
+
+@override_settings(MOMO_VALIDATE_ACCOUNTS=False)
+@patch('api.momo.mtn.Disbursement.setup', return_value=True)
+class BulkDisburseTestCase(APITestCase):
+    """Test bulk_disburse and the bulk endpoint"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='testuser')
+        cls.url = reverse('disburse-bulk')
+
+    def setUp(self):
+        self.client.force_authenticate(self.user)
+
+    @patch('api.momo.mtn.Disbursement.deposit', return_value=Mock(status_code=202))
+    def test_all_accepted(self, mock_deposit, mock_setup):
+        result = bulk_disburse(self.user, [item(), item(payee='0977112233')])
+        self.assertEqual(result['accepted'], 2)
+        self.assertEqual(mock_deposit.call_count, 2)
+        self.assertEqual(LipilaDisbursement.objects.filter(status='accepted').count(), 2)
+        mock_setup.assert_called_once()
+
+    @patch('api.momo.mtn.Disbursement.deposit')
+    def test_partial_failure(self, mock_deposit, mock_setup):
+        mock_deposit.side_effect = lambda amount, payee, reference_id: Mock(
+            status_code=202 if payee == '0966443322' else 400)
+        items = [item(), item(payee='0977112233'), item(payee='123'),
+                 item(amount='5'), item(reference_id='dup'), item(reference_id='dup')]
+        result = bulk_disburse(self.user, items)
+        self.assertEqual(result['accepted'], 2)
+        self.assertEqual(result['failed'], 1)
+        self.assertEqual(result['invalid'], 3)
+        self.assertEqual(len(result['results']), 6)
+        # invalid items are never sent nor saved
+        self.assertEqual(mock_deposit.call_count, 3)
+        self.assertEqual(LipilaDisbursement.objects.count(), 3)
+        self.assertEqual(LipilaDisbursement.objects.get(payee_account_number='0977112233').status, 'failed')
+
+    @patch('api.momo.mtn.Disbursement.deposit', return_value=Mock(status_code=202))
+    def test_inserted_ids_not_returned(self, mock_deposit, mock_setup):
+        bulk_create = LipilaDisbursement.objects.bulk_create
+
+        def without_ids(objs, *args, **kwargs):
+            # like mysql, the ids of the inserted rows are not set
+            created = bulk_create(objs, *args, **kwargs)
+            for obj in created:
+                obj.pk = None
+            return created
+
+        with patch.object(LipilaDisbursement.objects, 'bulk_create', side_effect=without_ids):
+            result = bulk_disburse(self.user, [item(), item(payee='0977112233')])
+        self.assertEqual(result['accepted'], 2)
+        self.assertEqual(LipilaDisbursement.objects.filter(status='accepted').count(), 2)
+
+    @patch('api.momo.mtn.Disbursement.deposit', return_value=Mock(status_code=202))
+    def test_existing_reference_rejected(self, mock_deposit, mock_setup):
+        LipilaDisbursement.objects.create(amount=100, reference_id='taken')
+        result = bulk_disburse(self.user, [item(reference_id='taken'), item()])
+        self.assertEqual(result['invalid'], 1)
+        self.assertEqual(result['accepted'], 1)
+
+    @override_settings(MOMO_USER_RATE_LIMITS={'disbursement': (0.001, 2)}, MOMO_BULK_RATE_LIMIT_WAIT=0)
+    @patch('api.momo.mtn.Disbursement.deposit', return_value=Mock(status_code=202))
+    def test_rate_limited(self, mock_deposit, mock_setup):
+        cache.clear()
+        result = bulk_disburse(self.user, [item() for i in range(4)])
+        cache.clear()
+        self.assertEqual(result['accepted'], 2)
+        self.assertEqual(result['failed'], 2)
+        self.assertEqual(mock_deposit.call_count, 2)
+        self.assertEqual(sorted(r['status_code'] for r in result['results']), [202, 202, 429, 429])
+
+    @patch('api.momo.mtn.Disbursement.deposit', return_value=Mock(status_code=202))
+    def test_endpoint(self, mock_deposit, mock_setup):
+        response = self.client.post(self.url, {'payments': [item(), item(payee='12')]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(response.data['accepted'], 1)
+        self.assertEqual(response.data['invalid'], 1)
+
+    @patch('api.momo.mtn.Disbursement.deposit')
+    def test_unknown_outcome_is_polled(self, mock_deposit, mock_setup):
+        def deposit(amount, payee, reference_id):
+            if payee == '0977112233':
+                raise requests.ReadTimeout('read timed out')
+            return Mock(status_code=500)
+        mock_deposit.side_effect = deposit
+        result = bulk_disburse(self.user, [item(), item(payee='0977112233')])
+        self.assertEqual(result['accepted'], 2)
+        self.assertEqual(sorted(r['status_code'] for r in result['results']), [500, 504])
+        self.assertEqual(LipilaDisbursement.objects.filter(
+            status='accepted', next_poll_at__isnull=False).count(), 2)
+
+    @patch('api.momo.mtn.Disbursement.deposit', side_effect=requests.ConnectTimeout('connect timed out'))
+    def test_not_sent(self, mock_deposit, mock_setup):
+        result = bulk_disburse(self.user, [item()])
+        self.assertEqual(result['failed'], 1)
+        self.assertEqual(result['results'][0]['status_code'], 503)
+        self.assertEqual(LipilaDisbursement.objects.get().status, 'failed')
+
+    @patch('api.momo.mtn.Disbursement.deposit')
+    def test_setup_error(self, mock_deposit, mock_setup):
+        mock_setup.side_effect = requests.ConnectionError('connection refused')
+        result = bulk_disburse(self.user, [item(), item(payee='0977112233')])
+        self.assertEqual(result['failed'], 2)
+        mock_deposit.assert_not_called()
+        self.assertEqual(LipilaDisbursement.objects.filter(status='failed').count(), 2)
+
+    def test_endpoint_all_invalid(self, mock_setup):
+        response = self.client.post(self.url, [item(payee='12')], format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(LipilaDisbursement.objects.count(), 0)
+
+    def test_endpoint_missing_payments(self, mock_setup):
+        response = self.client.post(self.url, {}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+@patch('api.momo.mtn.Disbursement.setup', return_value=True)
+class BulkAccountValidationTestCase(APITestCase):
+    """Test that payout batches skip payees without an active account"""
+
+    def setUp(self):
+        account_cache.clear()
+        self.user = User.objects.create(username='testuser')
+
+    def tearDown(self):
+        account_cache.clear()
+
+    @patch('api.momo.mtn.Disbursement.deposit', return_value=Mock(status_code=202))
+    @patch('api.momo.mtn.MTNBase.validate_account_holder')
+    def test_inactive_payees_are_not_sent(self, mock_validate, mock_deposit, mock_setup):
+        def validate(subscription_key, id_type, account_id, endpoint):
+            if account_id == '0977112233':
+                return Mock(status_code=200, json=Mock(return_value={'result': False}))
+            return Mock(status_code=200, json=Mock(return_value={'result': True}))
+
+        mock_validate.side_effect = validate
+        items = [item(), item(), item(payee='0977112233')]
+        result = bulk_disburse(self.user, items)
+        self.assertEqual(result['accepted'], 2)
+        self.assertEqual(result['invalid'], 1)
+        self.assertEqual(mock_deposit.call_count, 2)
+        # every payee is validated once
+        self.assertEqual(mock_validate.call_count, 2)
+        self.assertFalse(LipilaDisbursement.objects.filter(payee_account_number='0977112233').exists())
+
+
+def collection(payer='0966443322', amount='100', **kwargs):
+    data = {'payer_account_number': payer, 'amount': amount,
+            'payment_method': 'mtn', 'description': 'school fees'}
+    data.update(kwargs)
+    return data
+
+
+@override_settings(MOMO_VALIDATE_ACCOUNTS=False)
+@patch('api.momo.mtn.Collections.setup', return_value=True)
+class BulkCollectTestCase(APITestCase):
+    """Test bulk_collect and the payments bulk endpoint"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(pk=1, username='testuser')
+        cls.url = reverse('payments-bulk')
+
+    def setUp(self):
+        self.client.force_authenticate(self.user)
+
+    @patch('api.momo.mtn.Collections.request_to_pay')
+    def test_partial_failure(self, mock_pay, mock_setup):
+        mock_pay.side_effect = lambda amount, payer, reference_id: Mock(
+            status_code=400 if payer == '0977112233' else 202)
+        items = [collection(reference_id=f'ref-{i}') for i in range(5)]
+        items.append(collection(payer='0977112233', reference_id='ref-5'))
+        items.append(collection(amount='1'))
+        result = bulk_collect(self.user, items)
+        self.assertEqual((result['accepted'], result['failed'], result['invalid']), (5, 1, 1))
+        # the client is authorized once for the whole batch
+        mock_setup.assert_called_once()
+        self.assertEqual(mock_pay.call_count, 6)
+        self.assertEqual(LipilaCollection.objects.filter(api_user=self.user).count(), 6)
+        self.assertEqual(LipilaCollection.objects.get(reference_id='ref-5').status, 'failed')
+        accepted = LipilaCollection.objects.get(reference_id='ref-0')
+        self.assertEqual(accepted.status, 'accepted')
+        self.assertIsNotNone(accepted.next_poll_at)
+        self.assertIn({'reference_id': 'ref-0', 'payer_account_number': '0966443322',
+                       'status': 'accepted', 'status_code': 202}, result['results'])
+
+    @patch('api.momo.mtn.Collections.request_to_pay', return_value=Mock(status_code=202))
+    def test_duplicate_reference_ids(self, mock_pay, mock_setup):
+        LipilaCollection.objects.create(amount=100, reference_id='ref-1', api_user=self.user)
+        result = bulk_collect(self.user, [collection(reference_id='ref-1'),
+                                          collection(reference_id='ref-2'),
+                                          collection(reference_id='ref-2')])
+        self.assertEqual((result['accepted'], result['invalid']), (1, 2))
+        mock_pay.assert_called_once()
+
+    @patch('api.momo.mtn.Collections.request_to_pay', return_value=Mock(status_code=202))
+    def test_endpoint(self, mock_pay, mock_setup):
+        response = self.client.post(self.url, {'payments': [collection(), collection(payer='12')]},
+                                    format='json')
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(response.data['accepted'], 1)
+        self.assertEqual(response.data['invalid'], 1)
+
+    @override_settings(MOMO_BULK_MAX_ITEMS=2)
+    def test_endpoint_too_many_items(self, mock_setup):
+        response = self.client.post(self.url, [collection()] * 3, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(LipilaCollection.objects.count(), 0)
@@ -0,0 +1,96 @@
+"""
+Tests the MTN callback endpoint
+"""
+from unittest.mock import Mock, patch
+from django.contrib.auth.models import User
+from django.test import override_settings
+from django.urls import reverse
+from rest_framework.test import APITestCase
+from api.models import LipilaCollection, LipilaDisbursement
+from api.momo.mtn import Collections, Disbursement
+from patron.models import Contributions
+
+
+class MTNCallbackTestCase(APITestCase):
+    """Posts callbacks the way the MTN gateway does"""
+
+    def setUp(self):
+        self.creator = User.objects.create(username='creator')
+        self.patron = User.objects.create(username='patron')
+        self.collection = LipilaCollection.objects.create(
+            amount=100, reference_id='ref-1', status='accepted')
+        self.contribution = Contributions.objects.create(
+            creator=self.creator, patron=self.patron, amount=100,
+            reference_id='ref-1', status='accepted')
+
+    def post_callback(self, product, reference_id, status, method='post', token=None):
+        url = reverse('mtn-callback', kwargs={'product': product, 'reference_id': reference_id})
+        data = {
+            'financialTransactionId': '1234',
+            'externalId': reference_id,
+            'amount': '100',
+            'currency': 'EUR',
+            'status': status,
+        }
+        if token is not None:
+            url += f'?token={token}'
+        return getattr(self.client, method)(url, data, format='json')
+
+    def test_success_callback(self):
+        response = self.post_callback('collection', 'ref-1', 'SUCCESSFUL')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['status'], 'success')
+        self.collection.refresh_from_db()
+        self.contribution.refresh_from_db()
+        self.assertEqual(self.collection.status, 'success')
+        self.assertEqual(self.contribution.status, 'success')
+
+    def test_callback_is_idempotent(self):
+        self.post_callback('collection', 'ref-1', 'FAILED', method='put')
+        response = self.post_callback('collection', 'ref-1', 'SUCCESSFUL')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['status'], 'failed')
+        self.assertEqual(LipilaCollection.objects.get().status, 'failed')
+        self.assertEqual(Contributions.objects.get().status, 'failed')
+
+    def test_pending_callback(self):
+        response = self.post_callback('collection', 'ref-1', 'PENDING')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(LipilaCollection.objects.get().status, 'accepted')
+
+    def test_unknown_transaction(self):
+        self.assertEqual(self.post_callback('collection', 'missing', 'SUCCESSFUL').status_code, 404)
+        self.assertEqual(self.post_callback('disbursement', 'ref-1', 'SUCCESSFUL').status_code, 404)
+        self.assertEqual(self.post_callback('airtime', 'ref-1', 'SUCCESSFUL').status_code, 404)
+
+    @override_settings(MOMO_CALLBACK_TOKEN='secret')
+    def test_callback_token(self):
+        self.assertEqual(self.post_callback('collection', 'ref-1', 'SUCCESSFUL').status_code, 403)
+        self.assertEqual(
+            self.post_callback('collection', 'ref-1', 'SUCCESSFUL', token='wrong').status_code, 403)
+        response = self.post_callback('collection', 'ref-1', 'SUCCESSFUL', token='secret')
+        self.assertEqual(response.status_code, 200)
+
+
+@override_settings(MOMO_CALLBACK_URL='https://lipila.test/api/v1/', MOMO_CALLBACK_TOKEN='')
+class CallbackUrlTestCase(APITestCase):
+    """Test that payment requests ask MTN for a callback"""
+
+    @patch('api.momo.mtn.send', return_value=Mock(status_code=202))
+    def test_request_to_pay_sends_callback_url(self, mock_send):
+        Collections().request_to_pay('100', '0966443322', 'ref-1')
+        headers = mock_send.call_args.kwargs['headers']
+        self.assertEqual(headers['X-Callback-Url'],
+                         'https://lipila.test/api/v1/callbacks/mtn/collection/ref-1/')
+
+    @override_settings(MOMO_CALLBACK_TOKEN='secret')
+    @patch('api.momo.mtn.send', return_value=Mock(status_code=202))
+    def test_deposit_sends_callback_url(self, mock_send):
+        Disbursement().deposit('100', '0966443322', 'ref-1')
+        headers = mock_send.call_args.kwargs['headers']
+        self.assertEqual(headers['X-Callback-Url'],
+                         'https://lipila.test/api/v1/callbacks/mtn/disbursement/ref-1/?token=secret')
+
+    @override_settings(MOMO_CALLBACK_URL='')
+    def test_no_callback_url(self):
+        self.assertIsNone(Collections().get_callback_url('collection', 'ref-1'))
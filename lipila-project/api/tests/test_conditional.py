@@ -0,0 +1,68 @@
+"""
+Tests conditional GET on the transaction endpoints
+"""
+from datetime import timedelta
+from django.contrib.auth.models import User
+from django.utils import timezone
+from rest_framework.test import APITestCase
+from api.models import LipilaCollection, LipilaDisbursement
+
+
+class ConditionalListTestCase(APITestCase):
+    """Test ETag and Last-Modified on the payments and disburse lists"""
+
+    def setUp(self):
+        self.user = User.objects.create(username='merchant')
+        self.client.force_authenticate(self.user)
+        self.payment = LipilaCollection.objects.create(
+            api_user=self.user, amount=100, reference_id='ref-1',
+            updated_at=timezone.now() - timedelta(minutes=5))
+
+    def get(self, url='/api/v1/payments/', **headers):
+        return self.client.get(url, **headers)
+
+    def test_unchanged_list(self):
+        first = self.get()
+        self.assertEqual(first.status_code, 200)
+        self.assertTrue(first['ETag'].startswith('W/"'))
+        self.assertIn('Last-Modified', first)
+        with self.assertNumQueries(1):
+            # the aggregate, the api user is cached and no rows are read
+            second = self.get(HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(second.status_code, 304)
+        self.assertEqual(second.content, b'')
+        self.assertEqual(second['ETag'], first['ETag'])
+        self.assertEqual(self.get(HTTP_IF_MODIFIED_SINCE=first['Last-Modified']).status_code, 304)
+
+    def test_changed_list(self):
+        etag = self.get()['ETag']
+        LipilaCollection.objects.filter(pk=self.payment.pk).update(status='success', updated_at=timezone.now())
+        response = self.get(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+        etag = response['ETag']
+        LipilaCollection.objects.create(api_user=self.user, amount=100, reference_id='ref-2',
+                                        updated_at=timezone.now() - timedelta(days=1))
+        self.assertEqual(self.get(HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_pages_have_their_own_etag(self):
+        etag = self.get()['ETag']
+        response = self.client.get('/api/v1/payments/', {'status': 'failed'},
+                                   HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_empty_disbursement_list(self):
+        first = self.get('/api/v1/disburse/')
+        self.assertNotIn('Last-Modified', first)
+        self.assertEqual(self.get('/api/v1/disburse/', HTTP_IF_NONE_MATCH=first['ETag']).status_code, 304)
+        LipilaDisbursement.objects.create(api_user=self.user, amount=100, reference_id='dis-1')
+        self.assertEqual(self.get('/api/v1/disburse/', HTTP_IF_NONE_MATCH=first['ETag']).status_code, 200)
+
+    def test_retrieve(self):
+        url = f'/api/v1/payments/{self.payment.pk}/'
+        first = self.client.get(url)
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=first['ETag']).status_code, 304)
+        self.assertEqual(self.client.get('/api/v1/payments/abc/').status_code, 404)
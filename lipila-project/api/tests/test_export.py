@@ -0,0 +1,91 @@
+"""
+Tests the streaming exports
+"""
+import csv
+import io
+import json
+from datetime import timedelta
+from django.contrib.auth.models import User
+from django.http import StreamingHttpResponse
+from django.test import TestCase
+from django.utils import timezone
+from rest_framework.test import APITestCase
+from api.export import get_rows, stream_csv
+from api.models import LipilaCollection, LipilaDisbursement
+
+
+class ExportTestCase(APITestCase):
+    """Test the payments and disburse export endpoints"""
+
+    def setUp(self):
+        self.user = User.objects.create(username='merchant')
+        other = User.objects.create(username='other')
+        for i in range(5):
+            LipilaCollection.objects.create(
+                api_user=self.user, amount=10 * i, reference_id=f'ref-{i}',
+                payer_account_number='0966443322', description=f'fees {i}',
+                status='success' if i % 2 else 'failed',
+                updated_at=timezone.now() - timedelta(days=i))
+        LipilaCollection.objects.create(api_user=other, amount=1, reference_id='other')
+        self.client.force_authenticate(self.user)
+
+    def export(self, url='/api/v1/payments/export/', **params):
+        return self.client.get(url, params)
+
+    def test_csv(self):
+        response = self.export()
+        self.assertEqual(response.status_code, 200)
+        self.assertIsInstance(response, StreamingHttpResponse)
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        self.assertIn('attachment; filename="collections-', response['Content-Disposition'])
+        rows = list(csv.DictReader(io.StringIO(b''.join(response.streaming_content).decode())))
+        self.assertEqual([row['reference_id'] for row in rows], [f'ref-{i}' for i in range(5)])
+        self.assertEqual(rows[1]['amount'], '10.00')
+        self.assertEqual(rows[1]['description'], 'fees 1')
+
+    def test_ndjson_with_filters(self):
+        since = (timezone.now() - timedelta(days=2, hours=1)).isoformat()
+        response = self.export(type='ndjson', status='success', since=since)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual([row['reference_id'] for row in rows], ['ref-1'])
+        self.assertEqual(rows[0]['status'], 'success')
+
+    def test_disbursements(self):
+        LipilaDisbursement.objects.create(api_user=self.user, amount=5, reference_id='dis-1',
+                                          payee_account_number='0977112233')
+        response = self.export('/api/v1/disburse/export/', type='ndjson')
+        row = json.loads(b''.join(response.streaming_content))
+        self.assertEqual(row['payee_account_number'], '0977112233')
+
+    def test_errors(self):
+        self.assertEqual(self.export(type='xml').status_code, 400)
+        self.assertEqual(self.export(until='someday').status_code, 400)
+
+    def test_authentication_required(self):
+        self.client.force_authenticate(None)
+        for url in ('/api/v1/payments/export/', '/api/v1/disburse/export/'):
+            self.assertEqual(self.client.get(url, {'api_user': 'merchant'}).status_code, 401)
+
+
+class StreamTestCase(TestCase):
+    """Test the row streaming"""
+
+    def test_rows_are_read_in_chunks(self):
+        user = User.objects.create(username='merchant')
+        LipilaCollection.objects.bulk_create([
+            LipilaCollection(api_user=user, amount=1, reference_id=f'ref-{i}') for i in range(10)])
+        rows = get_rows(LipilaCollection.objects.all(), ('reference_id',), chunk_size=3)
+        # nothing is read before the stream is consumed
+        with self.assertNumQueries(0):
+            lines = stream_csv(rows, ('reference_id',))
+        with self.assertNumQueries(1):
+            self.assertEqual(len(list(lines)), 11)
+
+    def test_formulas_are_escaped(self):
+        lines = list(stream_csv([('=HYPERLINK("x")', 5)], ('description', 'amount')))
+        self.assertEqual(lines[1], '"\'=HYPERLINK(""x"")",5\r\n')
+
+    def test_numbers_are_not_escaped(self):
+        lines = list(stream_csv([('+260966443322', '-5', '+1+cmd')], ('payer', 'amount', 'description')))
+        self.assertEqual(lines[1], "+260966443322,-5,'+1+cmd\r\n")
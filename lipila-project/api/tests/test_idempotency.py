@@ -0,0 +1,135 @@
+"""
+Tests the Idempotency-Key support of the payment endpoints
+"""
+from datetime import timedelta
+from unittest.mock import Mock, patch
+import requests
+from django.contrib.auth.models import User
+from django.test import override_settings
+from django.utils import timezone
+from rest_framework.response import Response
+from rest_framework.test import APITestCase
+from api.idempotency import idempotent
+from api.models import IdempotencyKey, LipilaCollection, LipilaDisbursement
+
+PAYMENT = {'payer_account_number': '0966443322', 'amount': '100',
+           'payment_method': 'mtn', 'description': 'test'}
+DISBURSEMENT = {'payee_account_number': '0966443322', 'amount': '100',
+                'payment_method': 'mtn', 'description': 'test'}
+URL = '/api/v1/payments/?reference_id=78bd2e9e-4cf7-4f25-8cd4-28b4d3c3e3c1'
+
+
+@patch('api.momo.mtn.Collections.setup', return_value=True)
+@patch('api.momo.mtn.Collections.request_to_pay', return_value=Response(status=202))
+class IdempotentPaymentTestCase(APITestCase):
+    """Test Idempotency-Key on the payments endpoint"""
+
+    def setUp(self):
+        user = User.objects.create_user(pk=1, username='lipila', password='password')
+        self.client.force_authenticate(user)
+
+    def post(self, data=PAYMENT, key='key-1', url=URL):
+        return self.client.post(url, data, format='json', HTTP_IDEMPOTENCY_KEY=key)
+
+    def test_retry_is_replayed(self, mock_pay, mock_setup):
+        first = self.post()
+        second = self.post()
+        self.assertEqual(first.status_code, 202)
+        self.assertEqual(second.status_code, 202)
+        self.assertEqual(second.data, first.data)
+        self.assertEqual(second['Idempotent-Replayed'], 'true')
+        mock_pay.assert_called_once()
+        self.assertEqual(LipilaCollection.objects.count(), 1)
+
+    def test_key_reused_with_another_body(self, mock_pay, mock_setup):
+        self.post()
+        response = self.post(dict(PAYMENT, amount='200'))
+        self.assertEqual(response.status_code, 422)
+        mock_pay.assert_called_once()
+
+    def test_request_in_progress(self, mock_pay, mock_setup):
+        self.post()
+        IdempotencyKey.objects.update(status_code=None, response=None)
+        response = self.post()
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response['Retry-After'], '1')
+        mock_pay.assert_called_once()
+
+    @override_settings(IDEMPOTENCY_LOCK_TIMEOUT=60)
+    def test_stale_lock_is_taken_over(self, mock_pay, mock_setup):
+        self.post(key='key-2', url=URL.replace('78bd', '88bd'))
+        IdempotencyKey.objects.update(status_code=None, response=None,
+                                      created_at=timezone.now() - timedelta(minutes=5))
+        response = self.post(key='key-2', url=URL.replace('78bd', '98bd'))
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(mock_pay.call_count, 2)
+
+    def test_unavailable_gateway_may_be_retried(self, mock_pay, mock_setup):
+        mock_pay.return_value = Response(status=503)
+        self.assertEqual(self.post().status_code, 503)
+        self.assertFalse(IdempotencyKey.objects.exists())
+        mock_pay.return_value = Response(status=202)
+        self.assertEqual(self.post().status_code, 202)
+        self.assertEqual(mock_pay.call_count, 2)
+
+    def test_gateway_error(self, mock_pay, mock_setup):
+        mock_pay.return_value = Response(status=500)
+        response = self.post()
+        self.assertEqual(response.status_code, 502)
+        # the payment is left to the status poller and a retry is replayed
+        payment = LipilaCollection.objects.get()
+        self.assertEqual(payment.status, 'accepted')
+        self.assertIsNotNone(payment.next_poll_at)
+        retry = self.post()
+        self.assertEqual(retry.status_code, 502)
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        mock_pay.assert_called_once()
+
+    def test_gateway_timeout_is_replayed(self, mock_pay, mock_setup):
+        mock_pay.side_effect = requests.ReadTimeout('read timed out')
+        self.assertEqual(self.post().status_code, 502)
+        self.assertEqual(IdempotencyKey.objects.get().status_code, 502)
+        retry = self.post()
+        self.assertEqual(retry.status_code, 502)
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        mock_pay.assert_called_once()
+        self.assertEqual(LipilaCollection.objects.get().status, 'accepted')
+
+    def test_gateway_refusal(self, mock_pay, mock_setup):
+        mock_pay.return_value = Response(status=401)
+        self.assertEqual(self.post().status_code, 502)
+        self.assertEqual(LipilaCollection.objects.get().status, 'failed')
+        # not left in flight, a retry gets the stored answer and not a 409
+        self.assertEqual(self.post()['Idempotent-Replayed'], 'true')
+        mock_pay.assert_called_once()
+
+    def test_view_without_response(self, mock_pay, mock_setup):
+        view = idempotent('payments')(lambda self, request: None)
+        request = Mock(headers={'Idempotency-Key': 'key-1'}, query_params={}, data={},
+                       user=Mock(is_authenticated=False))
+        self.assertIsNone(view(None, request))
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+    def test_without_key(self, mock_pay, mock_setup):
+        self.client.post(URL, PAYMENT, format='json')
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+
+@patch('api.momo.mtn.Disbursement.setup', return_value=True)
+@patch('api.momo.mtn.Disbursement.deposit', return_value=Response(status=202))
+class IdempotentDisbursementTestCase(APITestCase):
+    """Test Idempotency-Key on the disburse endpoint"""
+
+    def setUp(self):
+        user = User.objects.create_user(pk=1, username='lipila', password='password')
+        self.client.force_authenticate(user)
+
+    def test_retry_is_replayed(self, mock_deposit, mock_setup):
+        url = '/api/v1/disburse/?reference_id=78bd2e9e-4cf7-4f25-8cd4-28b4d3c3e3c1'
+        for i in range(3):
+            response = self.client.post(url, DISBURSEMENT, format='json', HTTP_IDEMPOTENCY_KEY='key-1')
+            self.assertEqual(response.status_code, 202)
+        mock_deposit.assert_called_once()
+        self.assertEqual(LipilaDisbursement.objects.count(), 1)
+        # keys are unique per endpoint and api user
+        self.assertEqual(IdempotencyKey.objects.get().scope, 'disburse:1')
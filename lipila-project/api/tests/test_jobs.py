@@ -0,0 +1,150 @@
+"""
+Tests the payment job queue
+"""
+from datetime import timedelta
+from io import StringIO
+from unittest.mock import patch
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from rest_framework.response import Response
+from rest_framework.test import APITestCase
+from api.jobs import JobWorker, submit
+from api.models import LipilaCollection, LipilaDisbursement, PaymentJob
+from api.momo.breaker import GatewayUnavailable
+
+REFERENCE_ID = '78bd2e9e-4cf7-4f25-8cd4-28b4d3c3e3c1'
+
+
+@override_settings(MOMO_QUEUE_PAYMENTS=True)
+@patch('api.momo.router.PaymentRouter.send')
+class QueuedPaymentViewTestCase(APITestCase):
+    """Test that payments are queued instead of sent when MOMO_QUEUE_PAYMENTS is set"""
+
+    def setUp(self):
+        user = User.objects.create_user(pk=1, username='lipila', password='password')
+        self.client.force_authenticate(user)
+
+    def test_collection_is_queued(self, mock_send):
+        data = {'payer_account_number': '0966443322', 'amount': '100',
+                'payment_method': 'mtn', 'description': 'test'}
+        response = self.client.post(f'/api/v1/payments/?reference_id={REFERENCE_ID}', data, format='json')
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.data['reference_id'], REFERENCE_ID)
+        mock_send.assert_not_called()
+        self.assertEqual(LipilaCollection.objects.get().status, 'pending')
+        job = PaymentJob.objects.get()
+        self.assertEqual((job.product, job.reference_id, job.status), ('collection', REFERENCE_ID, 'queued'))
+
+    def test_disbursement_is_queued(self, mock_send):
+        data = {'payee_account_number': '0966443322', 'amount': '100',
+                'payment_method': 'mtn', 'description': 'test'}
+        response = self.client.post(f'/api/v1/disburse/?reference_id={REFERENCE_ID}', data, format='json')
+        self.assertEqual(response.status_code, 202)
+        mock_send.assert_not_called()
+        self.assertEqual(PaymentJob.objects.get().product, 'disbursement')
+
+
+class JobWorkerTestCase(TestCase):
+    """Test JobWorker"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(pk=1, username='lipila', password='password')
+
+    def queue(self, reference_id, product='collection'):
+        if product == 'collection':
+            payment = LipilaCollection(amount=100, payer_account_number='0966443322',
+                                       payment_method='mtn', reference_id=reference_id, api_user=self.user)
+        else:
+            payment = LipilaDisbursement(amount=100, payee_account_number='0966443322',
+                                         payment_method='mtn', reference_id=reference_id, api_user=self.user)
+        return submit(payment, product)
+
+    @patch('api.momo.router.PaymentRouter.send', return_value=('mtn', Response(status=202)))
+    def test_accepted(self, mock_send):
+        self.queue('ref-1')
+        self.queue('ref-2', 'disbursement')
+        counts = JobWorker().work_once()
+        self.assertEqual(counts, {'run': 2, 'accepted': 2, 'failed': 0, 'retry': 0})
+        self.assertEqual(LipilaCollection.objects.get().status, 'accepted')
+        self.assertIsNotNone(LipilaCollection.objects.get().next_poll_at)
+        self.assertEqual(LipilaDisbursement.objects.get().status, 'accepted')
+        self.assertFalse(PaymentJob.objects.exclude(status='done').exists())
+        payment_method, msisdn, product, call, api_user = mock_send.call_args_list[0][0]
+        self.assertEqual((payment_method, msisdn, product, api_user), ('mtn', '0966443322', 'collection', 1))
+
+    @patch('api.momo.router.PaymentRouter.send', return_value=('mtn', Response(status=400)))
+    def test_rejected(self, mock_send):
+        self.queue('ref-1')
+        self.assertEqual(JobWorker().work_once()['failed'], 1)
+        self.assertEqual(LipilaCollection.objects.get().status, 'failed')
+        self.assertEqual(PaymentJob.objects.get().last_error, 'status 400')
+
+    @patch('api.momo.router.PaymentRouter.send', return_value=('mtn', Response(status=504)))
+    def test_status_unknown(self, mock_send):
+        self.queue('ref-1')
+        self.assertEqual(JobWorker().work_once()['accepted'], 1)
+        payment = LipilaCollection.objects.get()
+        # left to the status poller
+        self.assertEqual(payment.status, 'accepted')
+        self.assertIsNotNone(payment.next_poll_at)
+
+    @patch('api.momo.router.PaymentRouter.send', side_effect=RuntimeError('connection reset'))
+    def test_error_is_not_retried(self, mock_send):
+        self.queue('ref-1')
+        self.assertEqual(JobWorker().work_once()['accepted'], 1)
+        mock_send.assert_called_once()
+        self.assertEqual(PaymentJob.objects.get().status, 'done')
+        payment = LipilaCollection.objects.get()
+        # the payment may have been taken, it is polled instead of sent again
+        self.assertEqual(payment.status, 'accepted')
+        self.assertIsNotNone(payment.next_poll_at)
+
+    @patch('api.momo.router.PaymentRouter.send', side_effect=GatewayUnavailable('deadline'))
+    def test_not_sent_is_retried(self, mock_send):
+        self.queue('ref-1')
+        self.assertEqual(JobWorker().work_once()['retry'], 1)
+        self.assertEqual(PaymentJob.objects.get().status, 'queued')
+        self.assertEqual(LipilaCollection.objects.get().status, 'pending')
+
+    @override_settings(MOMO_JOB_MAX_ATTEMPTS=2)
+    @patch('api.momo.router.PaymentRouter.send', return_value=(None, Response(status=503)))
+    def test_retried_with_backoff(self, mock_send):
+        self.queue('ref-1')
+        self.assertEqual(JobWorker().work_once()['retry'], 1)
+        job = PaymentJob.objects.get()
+        self.assertEqual((job.status, job.attempts), ('queued', 1))
+        self.assertGreater(job.run_at, timezone.now())
+        self.assertEqual(LipilaCollection.objects.get().status, 'pending')
+        # not due yet
+        self.assertEqual(JobWorker().work_once()['run'], 0)
+        PaymentJob.objects.update(run_at=timezone.now())
+        self.assertEqual(JobWorker().work_once()['failed'], 1)
+        self.assertEqual(LipilaCollection.objects.get().status, 'failed')
+
+    def test_claimed_once(self):
+        for i in range(5):
+            self.queue(f'ref-{i}')
+        first, second = JobWorker(batch_size=3), JobWorker(batch_size=3)
+        claimed = first.claim() + second.claim()
+        self.assertEqual(len(claimed), 5)
+        self.assertEqual(len({job.pk for job in claimed}), 5)
+        self.assertEqual(PaymentJob.objects.filter(locked_by=first.name).count(), 3)
+
+    @patch('api.momo.router.PaymentRouter.send')
+    def test_stale_jobs_are_not_resent(self, mock_send):
+        self.queue('ref-1')
+        PaymentJob.objects.update(status='running', locked_at=timezone.now() - timedelta(hours=1))
+        JobWorker().work_once()
+        mock_send.assert_not_called()
+        self.assertEqual(PaymentJob.objects.get().status, 'done')
+        # the status poller finds out whether the payment was made
+        self.assertEqual(LipilaCollection.objects.get().status, 'accepted')
+
+    @patch('api.momo.router.PaymentRouter.send', return_value=('mtn', Response(status=202)))
+    def test_command(self, mock_send):
+        self.queue('ref-1')
+        out = StringIO()
+        call_command('run_workers', '--once', stdout=out)
+        self.assertIn('run 1, accepted 1, failed 0, retry 0', out.getvalue())
@@ -0,0 +1,156 @@
+"""
+Tests the gateway call metrics
+"""
+import json
+import os
+import tempfile
+from unittest.mock import Mock, patch
+import requests
+from django.test import SimpleTestCase, override_settings
+from rest_framework.test import APITestCase
+from api.momo.breaker import CircuitOpenError, reset_breakers
+from api.momo.metrics import RETIRED_FILE, GatewayMetrics, gateway_metrics
+from api.momo.pool import send
+
+URL = 'https://sandbox.momodeveloper.mtn.com/collection/v1_0/requesttopay'
+
+
+class GatewayMetricsTestCase(SimpleTestCase):
+    """Test GatewayMetrics"""
+
+    def setUp(self):
+        self.metrics = GatewayMetrics()
+
+    def test_histogram(self):
+        self.metrics.observe('POST', URL, 0.07, 202)
+        self.metrics.observe('POST', URL, 3, 500)
+        self.metrics.observe('POST', URL, 40, error='ReadTimeout')
+        text = self.metrics.render()
+        labels = 'host="sandbox.momodeveloper.mtn.com",endpoint="requesttopay"'
+        self.assertIn(f'lipila_gateway_request_duration_seconds_bucket{{{labels},le="0.05"}} 0', text)
+        self.assertIn(f'lipila_gateway_request_duration_seconds_bucket{{{labels},le="0.1"}} 1', text)
+        self.assertIn(f'lipila_gateway_request_duration_seconds_bucket{{{labels},le="5"}} 2', text)
+        self.assertIn(f'lipila_gateway_request_duration_seconds_bucket{{{labels},le="+Inf"}} 3', text)
+        self.assertIn(f'lipila_gateway_request_duration_seconds_count{{{labels}}} 3', text)
+        self.assertIn(f'lipila_gateway_requests_total{{{labels},status="202"}} 1', text)
+        self.assertIn(f'lipila_gateway_requests_total{{{labels},status="none"}} 1', text)
+        self.assertIn(f'lipila_gateway_errors_total{{{labels},error="ReadTimeout"}} 1', text)
+
+    def test_processes_are_added_up(self):
+        with tempfile.TemporaryDirectory() as directory:
+            # the totals written by another worker
+            other = GatewayMetrics()
+            other.observe('POST', URL, 0.2, 202)
+            with open(os.path.join(directory, 'gateway-1.json'), 'w') as f:
+                json.dump(other.snapshot(), f)
+            with override_settings(MOMO_METRICS_DIR=directory):
+                self.metrics.observe('POST', URL, 0.2, 202)
+                totals = self.metrics.collect()
+                self.assertTrue(os.path.exists(self.metrics.get_path()))
+        key = ('sandbox.momodeveloper.mtn.com', 'requesttopay', '202')
+        self.assertEqual(totals['requests'][key], 2)
+
+    def test_stale_files_are_dropped(self):
+        with tempfile.TemporaryDirectory() as directory:
+            other = GatewayMetrics()
+            other.observe('POST', URL, 0.2, 202)
+            # an idle worker that still runs and one that was killed
+            idle = os.path.join(directory, 'gateway-1.json')
+            dead = os.path.join(directory, 'gateway-999999999.json')
+            for path in (idle, dead):
+                with open(path, 'w') as f:
+                    json.dump(other.snapshot(), f)
+                os.utime(path, (0, 0))
+            with override_settings(MOMO_METRICS_DIR=directory):
+                totals = self.metrics.collect()
+            self.assertTrue(os.path.exists(idle))
+            self.assertFalse(os.path.exists(dead))
+            self.assertTrue(os.path.exists(os.path.join(directory, RETIRED_FILE)))
+        key = ('sandbox.momodeveloper.mtn.com', 'requesttopay', '202')
+        # the calls of the killed worker are still counted
+        self.assertEqual(totals['requests'][key], 2)
+
+    def test_totals_kept_after_reaping(self):
+        with tempfile.TemporaryDirectory() as directory:
+            other = GatewayMetrics()
+            other.observe('POST', URL, 0.2, 202)
+            other.observe('POST', URL, 40, error='ReadTimeout')
+            dead = os.path.join(directory, 'gateway-999999999.json')
+            with open(dead, 'w') as f:
+                json.dump(other.snapshot(), f)
+            with override_settings(MOMO_METRICS_DIR=directory):
+                self.metrics.observe('POST', URL, 0.2, 202)
+                before = self.metrics.collect()
+                os.utime(dead, (0, 0))
+                reaped = self.metrics.collect()
+                self.assertFalse(os.path.exists(dead))
+                again = self.metrics.collect()
+        self.assertEqual(reaped, before)
+        self.assertEqual(again, before)
+
+    def test_file_removed_on_exit(self):
+        with tempfile.TemporaryDirectory() as directory:
+            with override_settings(MOMO_METRICS_DIR=directory), patch('atexit.register') as mock_register:
+                self.metrics.observe('POST', URL, 0.2, 202)
+                self.assertTrue(os.path.exists(self.metrics.get_path()))
+                mock_register.assert_called_once_with(self.metrics.remove)
+                self.metrics.remove()
+                self.assertFalse(os.path.exists(self.metrics.get_path()))
+                # the calls of the process are still reported by the others
+                totals = GatewayMetrics().collect()
+        key = ('sandbox.momodeveloper.mtn.com', 'requesttopay', '202')
+        self.assertEqual(totals['requests'][key], 1)
+
+    @override_settings(MOMO_METRICS_DIR='/nonexistent/metrics')
+    def test_missing_directory(self):
+        self.metrics.observe('POST', URL, 0.2, 202)
+        self.assertEqual(self.metrics.collect()['requests'], {})
+
+
+class InstrumentedSendTestCase(SimpleTestCase):
+    """Test that pooled gateway calls are measured"""
+
+    def setUp(self):
+        gateway_metrics.reset()
+        reset_breakers()
+
+    def tearDown(self):
+        gateway_metrics.reset()
+        reset_breakers()
+
+    @patch('api.momo.pool.get_session')
+    def test_send(self, mock_session):
+        mock_session.return_value.request.return_value = Mock(status_code=202)
+        send('POST', URL)
+        mock_session.return_value.request.side_effect = requests.ConnectionError()
+        with self.assertRaises(requests.ConnectionError):
+            send('POST', URL)
+        totals = gateway_metrics.collect()
+        self.assertEqual(totals['requests'][('sandbox.momodeveloper.mtn.com', 'requesttopay', '202')], 1)
+        self.assertEqual(totals['errors'][('sandbox.momodeveloper.mtn.com', 'requesttopay', 'ConnectionError')], 1)
+
+    @override_settings(MOMO_BREAKER_FAILURES=1)
+    @patch('api.momo.pool.get_session')
+    def test_circuit_open(self, mock_session):
+        mock_session.return_value.request.return_value = Mock(status_code=500)
+        send('POST', URL)
+        with self.assertRaises(CircuitOpenError):
+            send('POST', URL)
+        totals = gateway_metrics.collect()
+        self.assertEqual(totals['errors'][('sandbox.momodeveloper.mtn.com', 'requesttopay', 'circuit_open')], 1)
+
+
+class GatewayMetricsViewTestCase(APITestCase):
+    """Test the metrics endpoint"""
+
+    def test_metrics(self):
+        response = self.client.get('/api/v1/metrics/')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+        self.assertIn(b'# TYPE lipila_gateway_request_duration_seconds histogram', response.content)
+
+    @override_settings(MOMO_METRICS_TOKEN='secret')
+    def test_token(self):
+        self.assertEqual(self.client.get('/api/v1/metrics/').status_code, 403)
+        response = self.client.get('/api/v1/metrics/', HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(response.status_code, 200)
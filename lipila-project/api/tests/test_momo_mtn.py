@@ -1,11 +1,33 @@
 """
-Tests the mtn momo API
+Tests the mtn momo API against the local gateway simulator
 """
-from django.test import TestCase, Client
+from django.test import TestCase, Client, override_settings
+from api.momo.accounts import account_cache
+from api.momo.breaker import reset_breakers
 from api.momo.mtn import Collections, Disbursement
+from api.momo.simulator import GatewaySimulator
 from api.utils import generate_reference_id
 from lipila.utils import check_payment_status
 
+simulator = GatewaySimulator()
+settings_override = None
+
+
+def setUpModule():
+    global settings_override
+    simulator.start()
+    settings_override = override_settings(MTN_BASE_URL=simulator.url)
+    settings_override.enable()
+    account_cache.clear()
+    reset_breakers()
+
+
+def tearDownModule():
+    settings_override.disable()
+    simulator.stop()
+    account_cache.clear()
+    reset_breakers()
+
 
 class MTNBaseTestCase(TestCase):
     """ Tests inheritance """
@@ -0,0 +1,112 @@
+"""
+Tests the async mtn momo api clients
+"""
+import asyncio
+import json
+from unittest.mock import patch
+import httpx
+from django.test import SimpleTestCase
+from api.momo.accounts import account_cache
+from api.momo.mtn_async import AsyncCollections, AsyncDisbursement
+from api.momo.tokens import token_cache
+
+
+def fake_gateway(request):
+    """Answers like the mtn sandbox"""
+    path = request.url.path
+    if path.endswith('/token/'):
+        return httpx.Response(200, json={'access_token': 'async-token', 'expires_in': 3600})
+    if path.endswith('/requesttopay') or path.endswith('/deposit'):
+        assert request.headers['Authorization'] == 'Bearer async-token'
+        return httpx.Response(202)
+    if '/payment/' in path or '/deposit/' in path:
+        return httpx.Response(200, json={'status': 'SUCCESSFUL'})
+    if path.endswith('/account/balance'):
+        return httpx.Response(200, json={'availableBalance': '100', 'currency': 'EUR'})
+    if path.endswith('/active'):
+        return httpx.Response(200, json={'result': True})
+    return httpx.Response(404)
+
+
+class AsyncMTNTestCase(SimpleTestCase):
+    """Test AsyncCollections and AsyncDisbursement"""
+
+    def setUp(self):
+        token_cache.clear()
+        account_cache.clear()
+        self.requests = []
+
+        def handler(request):
+            self.requests.append(request)
+            return fake_gateway(request)
+
+        self.client_patch = patch(
+            'api.momo.pool.get_async_client',
+            side_effect=lambda: httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+        self.client_patch.start()
+        self.credentials_patch = patch(
+            'api.momo.mtn.MTNBase.load_credentials', return_value=True)
+        self.credentials_patch.start()
+
+    def tearDown(self):
+        self.client_patch.stop()
+        self.credentials_patch.stop()
+        token_cache.clear()
+        account_cache.clear()
+
+    async def test_request_to_pay(self):
+        momo = AsyncCollections()
+        self.assertTrue(await momo.setup())
+        payment = await momo.request_to_pay('100', '0966443322', 'ref-1')
+        self.assertEqual(payment.status_code, 202)
+        self.assertEqual(payment.data['message'], 'pending')
+        status = await momo.get_payment_status('ref-1')
+        self.assertEqual(status.json()['status'], 'SUCCESSFUL')
+        payment_request = [r for r in self.requests if r.url.path.endswith('/requesttopay')][0]
+        body = json.loads(payment_request.content)
+        self.assertEqual(body['payer']['partyId'], '0966443322')
+
+    async def test_request_to_pay_invalid(self):
+        with self.assertRaises(ValueError):
+            await AsyncCollections().request_to_pay('5', '0966443322', 'ref-1')
+
+    async def test_concurrent_deposits_share_one_token(self):
+        clients = [AsyncDisbursement() for _ in range(5)]
+        self.assertTrue(all(await asyncio.gather(*[client.setup() for client in clients])))
+        deposits = await asyncio.gather(*[
+            client.deposit('100', '0966443322', f'ref-{i}') for i, client in enumerate(clients)])
+        self.assertEqual([deposit.status_code for deposit in deposits], [202] * 5)
+        token_calls = [r for r in self.requests if r.url.path.endswith('/token/')]
+        self.assertEqual(len(token_calls), 1)
+
+    async def test_deposit_status_balance_and_validation(self):
+        momo = AsyncDisbursement()
+        await momo.setup()
+        status = await momo.get_transaction_status('deposit', 'ref-1')
+        self.assertEqual(status.status_code, 200)
+        balance = await momo.get_account_balance()
+        self.assertEqual(balance.json()['currency'], 'EUR')
+        active = await momo.validate_account_holder(
+            momo.subscription_dis_key, 'msisdn', '0966443322', 'disbursement')
+        self.assertEqual(active.status_code, 200)
+
+    async def test_account_validation_is_cached(self):
+        momo = AsyncDisbursement()
+        await momo.setup()
+        accounts = await momo.validate_accounts(
+            momo.subscription_dis_key, 'disbursement', ['0966443322', '0966443322', '0977000000'])
+        self.assertEqual(accounts, {'0966443322': True, '0977000000': True})
+        await momo.deposit('100', '0966443322', 'ref-1')
+        active_calls = [r for r in self.requests if r.url.path.endswith('/active')]
+        self.assertEqual(len(active_calls), 2)
+
+    async def test_not_found(self):
+        momo = AsyncDisbursement()
+        await momo.setup()
+        status = await momo.get_transaction_status('refund', 'ref-1')
+        self.assertEqual(status.status_code, 404)
+        self.assertEqual(status.data['reason'], 'Not Found')
+
+    async def test_invalid_deposit(self):
+        deposit = await AsyncDisbursement().deposit('100', '096', 'ref-1')
+        self.assertEqual(deposit.status_code, 400)
@@ -0,0 +1,88 @@
+"""
+Tests the keyset pagination of the list endpoints
+"""
+from datetime import timedelta
+from urllib.parse import parse_qs, urlsplit
+from django.contrib.auth.models import User
+from django.test import SimpleTestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APITestCase
+from api.models import LipilaCollection, LipilaDisbursement
+from api.pagination import decode_cursor, encode_cursor
+
+
+class CursorTestCase(SimpleTestCase):
+    """Test the cursor encoding"""
+
+    def test_round_trip(self):
+        now = timezone.now()
+        self.assertEqual(decode_cursor(encode_cursor(now, 42)), (now, 42))
+
+    def test_invalid(self):
+        for cursor in ('', 'abc', encode_cursor(timezone.now(), 1)[:-3], 'W10'):
+            with self.assertRaises(ValueError):
+                decode_cursor(cursor)
+
+
+class PaginatedListTestCase(APITestCase):
+    """Test the payments and disburse list endpoints"""
+
+    def setUp(self):
+        self.user = User.objects.create(username='merchant')
+        other = User.objects.create(username='other')
+        self.client.force_authenticate(self.user)
+        now = timezone.now()
+        for i in range(7):
+            LipilaCollection.objects.create(
+                api_user=self.user, amount=i, reference_id=f'ref-{i}',
+                status='success' if i % 2 else 'failed',
+                # two rows share every timestamp so ties are broken by id
+                updated_at=now - timedelta(hours=i // 2))
+        LipilaCollection.objects.create(api_user=other, amount=100, reference_id='other')
+
+    def get(self, **params):
+        return self.client.get('/api/v1/payments/', params)
+
+    def test_pages(self):
+        seen = []
+        params = {'limit': 3}
+        for i in range(3):
+            response = self.get(**params)
+            self.assertEqual(response.status_code, 200)
+            seen += [float(row['amount']) for row in response.data]
+            if 'X-Next-Cursor' not in response:
+                break
+            next_url = response['Link'][1:response['Link'].index('>')]
+            self.assertEqual(parse_qs(urlsplit(next_url).query)['cursor'], [response['X-Next-Cursor']])
+            params['cursor'] = response['X-Next-Cursor']
+        self.assertEqual(i, 2)
+        # newest first, the later row first on ties
+        self.assertEqual(seen, [1, 0, 3, 2, 5, 4, 6])
+
+    @override_settings(MOMO_PAGE_SIZE=2, MOMO_MAX_PAGE_SIZE=5)
+    def test_page_size(self):
+        self.assertEqual(len(self.get().data), 2)
+        self.assertEqual(len(self.get(limit=100).data), 5)
+        self.assertEqual(self.get(limit='x').status_code, 400)
+
+    def test_filters(self):
+        self.assertEqual(len(self.get(status='success').data), 3)
+        since = (timezone.now() - timedelta(minutes=30)).isoformat()
+        self.assertEqual(len(self.get(since=since).data), 2)
+        today = timezone.localdate().isoformat()
+        self.assertEqual(len(self.get(until=today).data), 7)
+        self.assertEqual(self.get(since='yesterday').status_code, 400)
+
+    def test_invalid_cursor(self):
+        response = self.get(cursor='not-a-cursor')
+        self.assertEqual(response.status_code, 400)
+
+    def test_disbursements(self):
+        for i in range(3):
+            LipilaDisbursement.objects.create(api_user=self.user, amount=i, reference_id=f'dis-{i}')
+        response = self.client.get('/api/v1/disburse/', {'limit': 2})
+        self.assertEqual(len(response.data), 2)
+        response = self.client.get('/api/v1/disburse/', {
+            'limit': 2, 'cursor': response['X-Next-Cursor']})
+        self.assertEqual(len(response.data), 1)
+        self.assertNotIn('Link', response)
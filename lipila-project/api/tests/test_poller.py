@@ -0,0 +1,130 @@
+"""
+Tests the transaction status poller
+"""
+from datetime import timedelta
+from io import StringIO
+from unittest.mock import Mock, patch
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from rest_framework.response import Response
+from accounts.models import CreatorProfile
+from api.models import LipilaCollection, LipilaDisbursement
+from api.momo.mtn import Collections, Disbursement
+from api.poller import StatusPoller
+from api.transactions import get_gateway_status, get_poll_delay, propagate_status
+from patron.models import Contributions, WithdrawalRequest, ProcessedWithdrawals
+
+
+def gateway_response(status):
+    response = Mock(status_code=200)
+    response.json.return_value = {'status': status}
+    return response
+
+
+class TransactionStatusTestCase(TestCase):
+    """Test the status helpers"""
+
+    def test_get_gateway_status(self):
+        self.assertEqual(get_gateway_status({'status': 'SUCCESSFUL'}), 'success')
+        self.assertEqual(get_gateway_status({'status': 'FAILED'}), 'failed')
+        self.assertIsNone(get_gateway_status({'status': 'PENDING'}))
+        self.assertIsNone(get_gateway_status(None))
+
+    @override_settings(MOMO_POLL_BASE_DELAY=2, MOMO_POLL_MAX_DELAY=60)
+    def test_poll_delay_backs_off(self):
+        self.assertTrue(1 <= get_poll_delay(0) <= 3)
+        self.assertTrue(8 <= get_poll_delay(3) <= 24)
+        self.assertTrue(30 <= get_poll_delay(20) <= 90)
+
+
+@patch('api.poller.StatusPoller.get_client', side_effect=lambda model, payment_method: (
+    Collections() if model is LipilaCollection else Disbursement()))
+class StatusPollerTestCase(TestCase):
+    """Test StatusPoller"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.creator = User.objects.create(username='creator')
+        cls.patron = User.objects.create(username='patron')
+        cls.profile = CreatorProfile.objects.create(user=cls.creator, patron_title='creator')
+
+    def collection(self, reference_id, **kwargs):
+        return LipilaCollection.objects.create(
+            amount=100, reference_id=reference_id, status='accepted', **kwargs)
+
+    @patch('api.momo.mtn.Collections.get_payment_status', return_value=gateway_response('SUCCESSFUL'))
+    def test_success_is_propagated(self, mock_status, mock_client):
+        self.collection('ref-1')
+        Contributions.objects.create(
+            creator=self.creator, patron=self.patron, amount=100,
+            reference_id='ref-1', status='accepted')
+        result = StatusPoller().poll_once()
+        self.assertEqual(result['collections'], {'polled': 1, 'success': 1, 'failed': 0})
+        self.assertEqual(LipilaCollection.objects.get().status, 'success')
+        self.assertEqual(Contributions.objects.get().status, 'success')
+
+    @patch('api.momo.mtn.Collections.get_payment_status', return_value=gateway_response('PENDING'))
+    def test_pending_backs_off(self, mock_status, mock_client):
+        self.collection('ref-1')
+        StatusPoller().poll_once()
+        collection = LipilaCollection.objects.get()
+        self.assertEqual(collection.status, 'accepted')
+        self.assertEqual(collection.poll_attempts, 1)
+        self.assertGreater(collection.next_poll_at, timezone.now())
+        # not due yet
+        self.assertEqual(StatusPoller().poll_once()['collections']['polled'], 0)
+
+    @override_settings(MOMO_POLL_MAX_ATTEMPTS=3)
+    @patch('api.momo.mtn.Collections.get_payment_status', return_value=gateway_response('PENDING'))
+    def test_failed_after_max_attempts(self, mock_status, mock_client):
+        self.collection('ref-1', poll_attempts=2)
+        StatusPoller().poll_once()
+        self.assertEqual(LipilaCollection.objects.get().status, 'failed')
+
+    @override_settings(MOMO_POLL_MAX_ATTEMPTS=3)
+    @patch('api.momo.mtn.Collections.get_payment_status', return_value=Response(status=500))
+    def test_gateway_errors_do_not_fail(self, mock_status, mock_client):
+        self.collection('ref-1', poll_attempts=2)
+        StatusPoller().poll_once()
+        collection = LipilaCollection.objects.get()
+        # left for a later poll or the reconciler
+        self.assertEqual(collection.status, 'accepted')
+        self.assertEqual(collection.poll_attempts, 2)
+        self.assertGreater(collection.next_poll_at, timezone.now())
+
+    @patch('api.momo.mtn.Collections.get_payment_status', return_value=gateway_response('SUCCESSFUL'))
+    def test_batches_and_skips_final(self, mock_status, mock_client):
+        for i in range(5):
+            self.collection(f'ref-{i}')
+        LipilaCollection.objects.create(amount=100, reference_id='done', status='success')
+        poller = StatusPoller(batch_size=3)
+        self.assertEqual(poller.poll_once()['collections']['polled'], 3)
+        self.assertEqual(poller.poll_once()['collections']['polled'], 2)
+        self.assertEqual(mock_status.call_count, 5)
+
+    @patch('api.momo.mtn.Disbursement.get_transaction_status', return_value=gateway_response('FAILED'))
+    def test_withdrawal_is_propagated(self, mock_status, mock_client):
+        LipilaDisbursement.objects.create(
+            amount=100, reference_id='ref-1', status='accepted',
+            next_poll_at=timezone.now() - timedelta(seconds=1))
+        withdrawal = WithdrawalRequest.objects.create(
+            creator=self.profile, amount=100, account_number='0966443322',
+            status='accepted', reference_id='ref-1')
+        ProcessedWithdrawals.objects.create(withdrawal_request=withdrawal, status='accepted')
+        StatusPoller().poll_once()
+        self.assertEqual(WithdrawalRequest.objects.get().status, 'failed')
+        self.assertEqual(ProcessedWithdrawals.objects.get().status, 'failed')
+
+    def test_command_once(self, mock_client):
+        out = StringIO()
+        call_command('poll_transactions', once=True, stdout=out)
+        self.assertIn('collections: polled 0', out.getvalue())
+
+    def test_propagate_keeps_final_status(self, mock_client):
+        Contributions.objects.create(
+            creator=self.creator, patron=self.patron, amount=100,
+            reference_id='ref-1', status='success')
+        propagate_status({'ref-1': 'failed'})
+        self.assertEqual(Contributions.objects.get().status, 'success')
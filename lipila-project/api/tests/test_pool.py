@@ -0,0 +1,52 @@
+"""
+Tests the pooled momo http sessions
+"""
+from unittest.mock import Mock, patch
+from django.test import SimpleTestCase, override_settings
+from api.momo import pool
+from api.momo.mtn import Disbursement
+
+
+class PoolTestCase(SimpleTestCase):
+    """Test the pooled sessions"""
+
+    def setUp(self):
+        pool.close_sessions()
+
+    def tearDown(self):
+        pool.close_sessions()
+
+    def test_session_reused_per_host(self):
+        first = pool.get_session('https://sandbox.momodeveloper.mtn.com/v1_0/apiuser')
+        second = pool.get_session('https://sandbox.momodeveloper.mtn.com/collection/token/')
+        airtel = pool.get_session('https://openapiuat.airtel.africa/auth/oauth2/token')
+        self.assertIs(first, second)
+        self.assertIsNot(first, airtel)
+
+    @override_settings(MOMO_POOL_SIZE=25, MOMO_MAX_RETRIES=3)
+    def test_pool_configuration(self):
+        session = pool.get_session('https://sandbox.momodeveloper.mtn.com/')
+        adapter = session.get_adapter('https://sandbox.momodeveloper.mtn.com/')
+        self.assertEqual(adapter._pool_maxsize, 25)
+        self.assertEqual(adapter.max_retries.total, 3)
+        # payments are never resubmitted after a read error
+        self.assertNotIn('POST', adapter.max_retries.allowed_methods)
+
+    @override_settings(MOMO_CONNECT_TIMEOUT=2, MOMO_READ_TIMEOUT=7)
+    def test_send_applies_timeout(self):
+        session = Mock()
+        session.request.return_value = Mock(status_code=200)
+        with patch('api.momo.pool.get_session', return_value=session):
+            pool.send('GET', 'https://sandbox.momodeveloper.mtn.com/')
+            pool.send('GET', 'https://sandbox.momodeveloper.mtn.com/', timeout=1)
+        self.assertEqual(session.request.call_args_list[0].kwargs['timeout'], (2, 7))
+        self.assertEqual(session.request.call_args_list[1].kwargs['timeout'], 1)
+
+    def test_mtn_calls_use_pool(self):
+        session = Mock()
+        session.request.return_value = Mock(status_code=200)
+        with patch('api.momo.pool.get_session', return_value=session):
+            response = Disbursement().get_account_balance()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(session.request.call_args.args[0], 'GET')
+        self.assertIn('timeout', session.request.call_args.kwargs)
@@ -0,0 +1,145 @@
+"""
+Tests the gateway rate limits
+"""
+import threading
+import time
+from unittest.mock import patch
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import SimpleTestCase, override_settings
+from rest_framework.test import APITestCase
+from api.momo import ratelimit
+from api.momo.ratelimit import TokenBucket
+
+
+class TokenBucketTestCase(SimpleTestCase):
+    """Test TokenBucket"""
+
+    def setUp(self):
+        cache.clear()
+
+    def tearDown(self):
+        cache.clear()
+
+    def test_burst_then_refill(self):
+        bucket = TokenBucket('test', rate=20, capacity=3)
+        self.assertEqual([bucket.take() for i in range(3)], [0, 0, 0])
+        wait = bucket.take()
+        self.assertGreater(wait, 0)
+        self.assertLessEqual(wait, 0.05)
+        time.sleep(wait)
+        self.assertEqual(bucket.take(), 0)
+
+    def test_acquire_waits_for_refill(self):
+        bucket = TokenBucket('test', rate=50, capacity=1)
+        self.assertTrue(bucket.acquire())
+        self.assertFalse(bucket.acquire(timeout=0))
+        start = time.monotonic()
+        self.assertTrue(bucket.acquire(timeout=1))
+        self.assertGreater(time.monotonic() - start, 0.01)
+
+    def test_bucket_is_shared(self):
+        # buckets with the same name in other processes share the cache entry
+        TokenBucket('test', rate=1, capacity=2).take(2)
+        self.assertGreater(TokenBucket('test', rate=1, capacity=2).take(), 0)
+        self.assertEqual(TokenBucket('other', rate=1, capacity=2).take(), 0)
+
+    def test_concurrent_takes(self):
+        bucket = TokenBucket('test', rate=0.001, capacity=5)
+        taken = []
+
+        def take():
+            if TokenBucket('test', rate=0.001, capacity=5).acquire():
+                taken.append(1)
+
+        threads = [threading.Thread(target=take) for i in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(taken), 5)
+        self.assertGreater(bucket.take(), 0)
+
+    def test_refund(self):
+        bucket = TokenBucket('test', rate=0.001, capacity=2)
+        bucket.take(2)
+        bucket.refund()
+        self.assertEqual(bucket.take(), 0)
+        # never above capacity
+        bucket.refund(5)
+        self.assertEqual(bucket.take(2), 0)
+        self.assertGreater(bucket.take(), 0)
+
+    def test_held_lock_expires(self):
+        # a holder that crashed, its lock is not deleted by others
+        bucket = TokenBucket('test', rate=1, capacity=1)
+        cache.add(bucket.lock_key, 'crashed', timeout=1)
+        start = time.monotonic()
+        self.assertEqual(bucket.take(), 0)
+        self.assertGreater(time.monotonic() - start, 0.5)
+
+
+class AcquireTestCase(SimpleTestCase):
+    """Test ratelimit.acquire"""
+
+    def setUp(self):
+        cache.clear()
+
+    def tearDown(self):
+        cache.clear()
+
+    def test_no_limits(self):
+        self.assertEqual(ratelimit.get_buckets('collection', 1), [])
+        for i in range(100):
+            self.assertTrue(ratelimit.acquire('collection', 1))
+
+    @override_settings(MOMO_RATE_LIMITS={'disbursement': (0.001, 3)},
+                       MOMO_USER_RATE_LIMITS={'disbursement': (0.001, 2)})
+    def test_product_and_user_limits(self):
+        buckets = ratelimit.get_buckets('disbursement', 7)
+        self.assertEqual([bucket.name for bucket in buckets], ['disbursement:user:7', 'disbursement'])
+        self.assertTrue(ratelimit.acquire('disbursement', 1, timeout=0))
+        self.assertTrue(ratelimit.acquire('disbursement', 1, timeout=0))
+        # api user 1 is over its own limit
+        self.assertFalse(ratelimit.acquire('disbursement', 1, timeout=0))
+        self.assertTrue(ratelimit.acquire('disbursement', 2, timeout=0))
+        # the product limit is shared by every api user
+        self.assertFalse(ratelimit.acquire('disbursement', 3, timeout=0))
+        self.assertTrue(ratelimit.acquire('collection', 3, timeout=0))
+
+    @override_settings(MOMO_RATE_LIMITS={'disbursement': (0.001, 1)},
+                       MOMO_USER_RATE_LIMITS={'disbursement': (0.001, 1)})
+    def test_shed_call_keeps_user_quota(self):
+        self.assertTrue(ratelimit.acquire('disbursement', 1, timeout=0))
+        self.assertFalse(ratelimit.acquire('disbursement', 2, timeout=0))
+        ratelimit.TokenBucket('disbursement', 0.001, 1).reset()
+        # api user 2 was shed by the product limit, its own token was put back
+        self.assertTrue(ratelimit.acquire('disbursement', 2, timeout=0))
+
+    @override_settings(MOMO_RATE_LIMITS={'disbursement': (0.001, 1)},
+                       MOMO_USER_RATE_LIMITS={'disbursement': (0.001, 1)})
+    def test_refund(self):
+        self.assertTrue(ratelimit.acquire('disbursement', 1, timeout=0))
+        ratelimit.refund('disbursement', 1)
+        self.assertTrue(ratelimit.acquire('disbursement', 1, timeout=0))
+        self.assertFalse(ratelimit.acquire('disbursement', 1, timeout=0))
+
+
+class RateLimitedViewTestCase(APITestCase):
+    """Test that payment views shed requests over the limit"""
+
+    def setUp(self):
+        self.user = User.objects.create(username='merchant')
+        self.client.force_authenticate(self.user)
+
+    @patch('api.momo.router.ratelimit.acquire', return_value=False)
+    @patch('api.momo.mtn.Collections.setup')
+    def test_collection_returns_429(self, mock_setup, mock_acquire):
+        data = {'payer_account_number': '0966443322', 'amount': '100',
+                'payment_method': 'mtn', 'description': 'test'}
+        response = self.client.post(
+            '/api/v1/payments/?reference_id=78bd2e9e-4cf7-4f25-8cd4-28b4d3c3e3c1', data, format='json')
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '1')
+        mock_setup.assert_not_called()
+        mock_acquire.assert_called_once_with('collection', self.user.pk)
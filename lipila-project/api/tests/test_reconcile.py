@@ -0,0 +1,110 @@
+"""
+Tests the reconciliation of transactions that are not final
+"""
+from io import StringIO
+from unittest.mock import Mock, patch
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase
+from accounts.models import CreatorProfile
+from api.models import LipilaCollection, LipilaDisbursement
+from api.momo.mtn import Collections, Disbursement
+from api.momo.singleflight import status_lookups
+from api.reconcile import Reconciler, parse_cursor
+from patron.models import Contributions, WithdrawalRequest
+
+
+def gateway_response(status):
+    response = Mock(status_code=200)
+    response.json.return_value = {'status': status}
+    return response
+
+
+def get_status(reference_id):
+    return gateway_response({'ref-1': 'SUCCESSFUL', 'ref-2': 'FAILED'}.get(reference_id, 'PENDING'))
+
+
+@patch('api.poller.StatusPoller.get_client', side_effect=lambda model, payment_method: (
+    Collections() if model is LipilaCollection else Disbursement()))
+@patch('api.momo.mtn.Collections.get_payment_status', side_effect=get_status)
+class ReconcilerTestCase(TestCase):
+    """Test Reconciler"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.creator = User.objects.create(username='creator')
+        cls.patron = User.objects.create(username='patron')
+        cls.profile = CreatorProfile.objects.create(user=cls.creator, patron_title='creator')
+
+    def setUp(self):
+        status_lookups.clear()
+        for reference_id in ('ref-1', 'ref-2', 'ref-3'):
+            LipilaCollection.objects.create(amount=100, reference_id=reference_id, status='accepted')
+
+    def test_parse_cursor(self, mock_status, mock_client):
+        self.assertEqual(parse_cursor('payments:12'), ('payments', 12))
+        with self.assertRaises(ValueError):
+            parse_cursor('transactions:12')
+        with self.assertRaises(ValueError):
+            parse_cursor('payments')
+
+    def test_collections(self, mock_status, mock_client):
+        Contributions.objects.create(
+            creator=self.creator, patron=self.patron, amount=100,
+            reference_id='ref-1', status='accepted')
+        counts = dict(Reconciler(older_than=0, chunk_size=2).run())
+        self.assertEqual(counts['collections']['scanned'], 3)
+        self.assertEqual(counts['collections']['success'], 1)
+        self.assertEqual(counts['collections']['failed'], 1)
+        self.assertEqual(counts['collections']['pending'], 1)
+        self.assertEqual(LipilaCollection.objects.get(reference_id='ref-1').status, 'success')
+        self.assertEqual(LipilaCollection.objects.get(reference_id='ref-2').status, 'failed')
+        self.assertEqual(LipilaCollection.objects.get(reference_id='ref-3').status, 'accepted')
+        self.assertEqual(Contributions.objects.get().status, 'success')
+
+    def test_recent_rows_are_skipped(self, mock_status, mock_client):
+        counts = dict(Reconciler(older_than=60).run())
+        self.assertEqual(counts['collections']['scanned'], 0)
+        mock_status.assert_not_called()
+
+    def test_dry_run(self, mock_status, mock_client):
+        counts = dict(Reconciler(older_than=0, dry_run=True).run())
+        self.assertEqual(counts['collections']['success'], 1)
+        self.assertEqual(LipilaCollection.objects.filter(status='accepted').count(), 3)
+
+    def test_mismatches_and_missing(self, mock_status, mock_client):
+        LipilaCollection.objects.filter(reference_id='ref-3').update(status='failed')
+        LipilaDisbursement.objects.create(amount=100, reference_id='ref-4', status='success')
+        Contributions.objects.create(
+            creator=self.creator, patron=self.patron, amount=100,
+            reference_id='ref-3', status='accepted')
+        Contributions.objects.create(
+            creator=self.creator, patron=self.patron, amount=100,
+            reference_id='ref-5', status='pending')
+        WithdrawalRequest.objects.create(
+            creator=self.profile, amount=100, account_number='0966443322',
+            reference_id='ref-4', status='accepted')
+        counts = dict(Reconciler(older_than=0).run('contributions:0'))
+        self.assertNotIn('collections', counts)
+        self.assertEqual(counts['contributions']['mismatches'], 1)
+        self.assertEqual(counts['contributions']['missing'], 1)
+        self.assertEqual(counts['withdrawals']['mismatches'], 1)
+        self.assertEqual(Contributions.objects.get(reference_id='ref-3').status, 'failed')
+        self.assertEqual(WithdrawalRequest.objects.get().status, 'success')
+
+    def test_resume_after_cursor(self, mock_status, mock_client):
+        first = LipilaCollection.objects.get(reference_id='ref-1')
+        reconciler = Reconciler(older_than=0)
+        counts = dict(reconciler.run(f'collections:{first.pk}'))
+        self.assertEqual(counts['collections']['scanned'], 2)
+        self.assertEqual(LipilaCollection.objects.get(reference_id='ref-1').status, 'accepted')
+        self.assertEqual(reconciler.cursor, f"collections:{LipilaCollection.objects.latest('pk').pk}")
+
+    def test_command(self, mock_status, mock_client):
+        out = StringIO()
+        call_command('reconcile_transactions', '--older-than', '0', stdout=out)
+        self.assertIn('collections: scanned 3, success 1, failed 1, pending 1', out.getvalue())
+        self.assertIn('cursor: collections:', out.getvalue())
+        with self.assertRaises(CommandError):
+            call_command('reconcile_transactions', '--cursor', 'unknown:1', stdout=out)
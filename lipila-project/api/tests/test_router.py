@@ -0,0 +1,172 @@
+"""
+Tests the payment router
+"""
+from unittest.mock import Mock, patch
+import requests
+from django.core.cache import cache
+from django.test import SimpleTestCase, override_settings
+from rest_framework.response import Response
+from api.momo.breaker import GatewayUnavailable
+from api.momo.router import PaymentRouter, ProviderHealth
+
+
+class ProviderHealthTestCase(SimpleTestCase):
+    """Test the rolling latency and error rate"""
+
+    def test_empty(self):
+        health = ProviderHealth(window=3)
+        self.assertEqual(health.latency, 0)
+        self.assertEqual(health.error_rate, 0)
+        self.assertTrue(health.is_healthy())
+
+    def test_window(self):
+        health = ProviderHealth(window=3)
+        health.record(1, False)
+        health.record(0.1, True)
+        health.record(0.2, False)
+        self.assertAlmostEqual(health.error_rate, 2 / 3)
+        self.assertFalse(health.is_healthy())
+        # the oldest call is dropped
+        health.record(0.3, True)
+        self.assertAlmostEqual(health.latency, 0.2)
+        self.assertAlmostEqual(health.error_rate, 1 / 3)
+        self.assertTrue(health.is_healthy())
+
+
+@override_settings(MOMO_NETWORK_PREFIXES={'mtn': ['096', '076'], 'airtel': ['097', '077']},
+                   MOMO_COUNTRY_CODE='260')
+class GetProvidersTestCase(SimpleTestCase):
+    """Test how payments are mapped to gateways"""
+
+    def setUp(self):
+        self.router = PaymentRouter()
+
+    def test_payment_method(self):
+        self.assertEqual(self.router.get_providers('airtel', '0966443322'), ['airtel'])
+        self.assertEqual(self.router.get_providers('MTN', '0977443322'), ['mtn'])
+
+    def test_network_prefix(self):
+        self.assertEqual(self.router.get_providers('momo', '0966443322'), ['mtn'])
+        self.assertEqual(self.router.get_providers('', '260977443322'), ['airtel'])
+        self.assertEqual(self.router.get_providers(None, '+260766443322'), ['mtn'])
+
+    def test_unknown_prefix_uses_default_gateway(self):
+        for i in range(10):
+            self.router.get_health('mtn').record(0.5, False)
+        # the number is not failed over to another network
+        self.assertEqual(self.router.get_providers('momo', '46733123450'), ['mtn'])
+
+
+class SendTestCase(SimpleTestCase):
+    """Test sending payments and failing over"""
+
+    def setUp(self):
+        cache.clear()
+        self.router = PaymentRouter()
+
+    def tearDown(self):
+        cache.clear()
+
+    @patch('api.momo.router.get_client')
+    def test_send(self, mock_get_client):
+        client = mock_get_client.return_value
+        client.setup.return_value = True
+        call = Mock(return_value=Response(status=202))
+        provider, response = self.router.send('mtn', '0966443322', 'collection', call)
+        self.assertEqual(provider, 'mtn')
+        self.assertEqual(response.status_code, 202)
+        call.assert_called_once_with(client)
+        mock_get_client.assert_called_once_with('mtn', 'collection')
+        self.assertEqual(self.router.get_health('mtn').error_rate, 0)
+
+    @patch('api.momo.router.get_client')
+    def test_fail_over(self, mock_get_client):
+        mtn, airtel = Mock(), Mock()
+        mtn.setup.side_effect = GatewayUnavailable('open')
+        airtel.setup.return_value = True
+        mock_get_client.side_effect = lambda provider, product: {'mtn': mtn, 'airtel': airtel}[provider]
+        with patch.object(self.router, 'get_providers', return_value=['mtn', 'airtel']):
+            provider, response = self.router.send(
+                'momo', '46733123450', 'disbursement', lambda client: Response(status=202))
+        self.assertEqual(provider, 'airtel')
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(self.router.get_health('mtn').error_rate, 1)
+
+    @patch('api.momo.router.get_client')
+    def test_all_unavailable(self, mock_get_client):
+        mock_get_client.return_value.setup.return_value = True
+        provider, response = self.router.send(
+            'mtn', '0966443322', 'collection', lambda client: Response(status=503))
+        self.assertIsNone(provider)
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(self.router.get_health('mtn').error_rate, 1)
+
+    @patch('api.momo.router.get_client')
+    def test_fail_over_when_not_sent(self, mock_get_client):
+        mock_get_client.return_value.setup.return_value = True
+        calls = [requests.ConnectTimeout('connect'), Response(status=202)]
+
+        def call(client):
+            result = calls.pop(0)
+            if isinstance(result, Exception):
+                raise result
+            return result
+
+        with patch.object(self.router, 'get_providers', return_value=['mtn', 'airtel']):
+            provider, response = self.router.send('momo', '46733123450', 'collection', call)
+        self.assertEqual(provider, 'airtel')
+        self.assertEqual(response.status_code, 202)
+
+    @patch('api.momo.router.get_client')
+    def test_no_fail_over_when_status_unknown(self, mock_get_client):
+        mock_get_client.return_value.setup.return_value = True
+        call = Mock(side_effect=requests.ReadTimeout('read'))
+        with patch.object(self.router, 'get_providers', return_value=['mtn', 'airtel']):
+            provider, response = self.router.send('momo', '46733123450', 'collection', call)
+        # the payment may have been taken, it is polled instead of sent again
+        self.assertEqual(provider, 'mtn')
+        self.assertEqual(response.status_code, 504)
+        call.assert_called_once()
+        self.assertEqual(self.router.get_health('mtn').error_rate, 1)
+
+    @patch('api.momo.router.get_client')
+    def test_no_answer(self, mock_get_client):
+        mock_get_client.return_value.setup.return_value = True
+        provider, response = self.router.send('mtn', '0966443322', 'collection', lambda client: None)
+        self.assertEqual(provider, 'mtn')
+        self.assertEqual(response.status_code, 502)
+
+    @override_settings(MOMO_RATE_LIMITS={'collection': (0.001, 1), 'airtel_collection': (0.001, 1)})
+    @patch('api.momo.router.get_client')
+    def test_quota_refunded_when_not_sent(self, mock_get_client):
+        mtn, airtel = Mock(), Mock()
+        mtn.setup.side_effect = requests.ConnectionError('refused')
+        airtel.setup.return_value = True
+        mock_get_client.side_effect = lambda provider, product: {'mtn': mtn, 'airtel': airtel}[provider]
+        calls = [requests.ConnectTimeout('connect'), Response(status=202)]
+
+        def call(client):
+            result = calls.pop(0)
+            if isinstance(result, Exception):
+                raise result
+            return result
+
+        with patch.object(self.router, 'get_providers', return_value=['mtn', 'airtel']):
+            provider, response = self.router.send('momo', '46733123450', 'collection', call)
+            self.assertIsNone(provider)
+            # neither gateway was sent the payment, both still have their token
+            mtn.setup.side_effect = None
+            mtn.setup.return_value = True
+            provider, response = self.router.send('momo', '46733123450', 'collection', call)
+        self.assertEqual(provider, 'mtn')
+        self.assertEqual(response.status_code, 202)
+
+    @patch('api.momo.router.ratelimit.acquire', return_value=False)
+    @patch('api.momo.router.get_client')
+    def test_rate_limited(self, mock_get_client, mock_acquire):
+        provider, response = self.router.send(
+            'airtel', '0977443322', 'disbursement', Mock(), api_user=3)
+        self.assertIsNone(provider)
+        self.assertEqual(response.status_code, 429)
+        mock_acquire.assert_called_once_with('airtel_disbursement', 3)
+        mock_get_client.assert_not_called()
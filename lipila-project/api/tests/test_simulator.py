@@ -0,0 +1,135 @@
+"""
+Tests the local gateway simulator
+"""
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from django.test import SimpleTestCase, override_settings
+from api.momo.accounts import account_cache
+from api.momo.breaker import reset_breakers
+from api.momo.mtn import Collections, Disbursement
+from api.momo.pool import send
+from api.momo.simulator import GatewaySimulator
+from api.utils import generate_reference_id
+
+
+class CallbackReceiver():
+    """Collects the callbacks sent by the simulator"""
+
+    def __init__(self):
+        self.callbacks = []
+        self.received = threading.Event()
+        receiver = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def do_PUT(self):
+                body = self.rfile.read(int(self.headers['Content-Length']))
+                receiver.callbacks.append((self.path, json.loads(body)))
+                self.send_response(200)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                receiver.received.set()
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = 'http://127.0.0.1:%d' % self.server.server_address[1]
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+# statuses are polled until they change
+@override_settings(MOMO_STATUS_CACHE_TTL=0)
+class GatewaySimulatorTestCase(SimpleTestCase):
+    """Test GatewaySimulator with the mtn clients"""
+
+    def setUp(self):
+        account_cache.clear()
+        reset_breakers()
+        self.simulator = GatewaySimulator(completion_delay=0.05, inactive_numbers=['0977000000'])
+        self.simulator.start()
+        self.settings_override = override_settings(
+            MTN_BASE_URL=self.simulator.url, AIRTEL_BASE_URL=self.simulator.url)
+        self.settings_override.enable()
+
+    def tearDown(self):
+        self.settings_override.disable()
+        self.simulator.stop()
+        account_cache.clear()
+        reset_breakers()
+
+    def provision(self, momo, subscription_key, product):
+        reference_id = generate_reference_id()
+        self.assertEqual(momo.provision_sandbox(subscription_key, reference_id).status_code, 201)
+        self.assertEqual(momo.create_api_token(subscription_key, product, reference_id).status_code, 200)
+
+    def test_collection_completes(self):
+        momo = Collections()
+        self.provision(momo, momo.subscription_col_key, 'collection')
+        reference_id = generate_reference_id()
+        self.assertEqual(momo.request_to_pay('100', '0966443322', reference_id).status_code, 202)
+        self.assertEqual(momo.get_payment_status(reference_id).json()['status'], 'PENDING')
+        time.sleep(0.06)
+        self.assertEqual(momo.get_payment_status(reference_id).json()['status'], 'SUCCESSFUL')
+        # duplicate and unknown references
+        self.assertEqual(momo.request_to_pay('100', '0966443322', reference_id).status_code, 409)
+        self.assertEqual(momo.get_payment_status(generate_reference_id()).status_code, 404)
+
+    def test_inactive_account_and_failures(self):
+        self.simulator.failure_rate = 1
+        momo = Disbursement()
+        self.provision(momo, momo.subscription_dis_key, 'disbursement')
+        self.assertEqual(momo.deposit('100', '0977000000', generate_reference_id()).status_code, 400)
+        reference_id = generate_reference_id()
+        self.assertEqual(momo.deposit('100', '0966443322', reference_id).status_code, 202)
+        time.sleep(0.06)
+        status = momo.get_transaction_status('deposit', reference_id).json()
+        self.assertEqual(status['status'], 'FAILED')
+        self.assertEqual(momo.get_account_balance().status_code, 200)
+
+    def test_token_requires_known_api_user(self):
+        momo = Collections()
+        momo.api_key = 'unknown'
+        response = momo.create_api_token(momo.subscription_col_key, 'collection', generate_reference_id())
+        self.assertEqual(response.status_code, 401)
+
+    def test_errors_and_latency(self):
+        self.simulator.error_rate = 1
+        self.simulator.latency = 0.05
+        start = time.monotonic()
+        response = send('GET', f'{self.simulator.url}/collection/v1_0/account/balance')
+        self.assertEqual(response.status_code, 500)
+        self.assertGreaterEqual(time.monotonic() - start, 0.05)
+
+    def test_callback_is_sent(self):
+        receiver = CallbackReceiver()
+        try:
+            with override_settings(MOMO_CALLBACK_URL=receiver.url + '/api/v1'):
+                momo = Collections()
+                self.provision(momo, momo.subscription_col_key, 'collection')
+                reference_id = generate_reference_id()
+                momo.request_to_pay('100', '0966443322', reference_id)
+            self.assertTrue(receiver.received.wait(2))
+        finally:
+            receiver.stop()
+        path, body = receiver.callbacks[0]
+        self.assertEqual(path, f'/api/v1/callbacks/mtn/collection/{reference_id}/')
+        self.assertEqual(body['status'], 'SUCCESSFUL')
+
+    def test_airtel_endpoints(self):
+        url = self.simulator.url
+        token = send('POST', f'{url}/auth/oauth2/token', json={
+            'client_id': 'id', 'client_secret': 'secret', 'grant_type': 'client_credentials'}).json()
+        headers = {'Authorization': 'Bearer ' + token['access_token']}
+        payment = send('POST', f'{url}/merchant/v1/payments/', headers=headers, json={
+            'reference': 'test', 'subscriber': {'msisdn': '0966443322'},
+            'transaction': {'amount': 100, 'id': 'airtel-1'}})
+        self.assertTrue(payment.json()['status']['success'])
+        status = send('GET', f'{url}/standard/v1/payments/airtel-1', headers=headers).json()
+        self.assertEqual(status['data']['transaction']['status'], 'TIP')
+        self.assertEqual(send('GET', f'{url}/standard/v1/payments/airtel-1').status_code, 401)
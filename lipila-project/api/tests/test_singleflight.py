@@ -0,0 +1,110 @@
+"""
+Tests the coalescing of status lookups
+"""
+import threading
+import time
+from unittest.mock import Mock, patch
+from django.test import SimpleTestCase, TestCase, override_settings
+from api.models import LipilaCollection
+from api.momo.mtn import Collections
+from api.momo.singleflight import SingleFlight, status_lookups
+from api.transactions import update_transaction_status
+from lipila.utils import check_payment_status
+
+
+class SingleFlightTestCase(SimpleTestCase):
+    """Test SingleFlight"""
+
+    def setUp(self):
+        self.flight = SingleFlight()
+
+    def test_concurrent_calls_share_one_call(self):
+        release = threading.Event()
+        calls = []
+
+        def lookup():
+            calls.append(1)
+            release.wait(1)
+            return 'pending'
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(self.flight.do('ref', lookup, ttl=0)))
+                   for i in range(10)]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.05)
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, ['pending'] * 10)
+
+    def test_result_is_kept_for_ttl(self):
+        lookup = Mock(side_effect=['pending', 'success'])
+        self.assertEqual(self.flight.do('ref', lookup, ttl=0.1), 'pending')
+        self.assertEqual(self.flight.do('ref', lookup, ttl=0.1), 'pending')
+        time.sleep(0.15)
+        self.assertEqual(self.flight.do('ref', lookup, ttl=0.1), 'success')
+        self.assertEqual(lookup.call_count, 2)
+
+    def test_keep_and_forget(self):
+        lookup = Mock(side_effect=['error', 'pending', 'success'])
+        keep = lambda result: result != 'error'
+        self.assertEqual(self.flight.do('ref', lookup, ttl=10, keep=keep), 'error')
+        self.assertEqual(self.flight.do('ref', lookup, ttl=10, keep=keep), 'pending')
+        self.assertEqual(self.flight.do('ref', lookup, ttl=10, keep=keep), 'pending')
+        self.flight.forget('ref')
+        self.assertEqual(self.flight.do('ref', lookup, ttl=10, keep=keep), 'success')
+
+    def test_errors_are_not_kept(self):
+        lookup = Mock(side_effect=[ValueError('down'), 'pending'])
+        with self.assertRaises(ValueError):
+            self.flight.do('ref', lookup, ttl=10)
+        self.assertEqual(self.flight.do('ref', lookup, ttl=10), 'pending')
+
+
+class CoalescedStatusTestCase(SimpleTestCase):
+    """Test that gateway status lookups are shared"""
+
+    def setUp(self):
+        status_lookups.clear()
+
+    def tearDown(self):
+        status_lookups.clear()
+
+    @patch('api.momo.mtn.send')
+    def test_get_payment_status(self, mock_send):
+        mock_send.return_value = Mock(status_code=200)
+        momo = Collections()
+        momo.get_payment_status('ref-1')
+        momo.get_payment_status('ref-1')
+        Collections().get_payment_status('ref-1')
+        momo.get_payment_status('ref-2')
+        self.assertEqual(mock_send.call_count, 2)
+
+    @patch('api.momo.mtn.send')
+    def test_errors_are_retried(self, mock_send):
+        mock_send.return_value = Mock(status_code=404)
+        momo = Collections()
+        momo.get_payment_status('ref-1')
+        momo.get_payment_status('ref-1')
+        self.assertEqual(mock_send.call_count, 2)
+
+
+@override_settings(MOMO_STATUS_CACHE_TTL=60)
+class CheckPaymentStatusTestCase(TestCase):
+    """Test that database status checks are shared and refreshed on updates"""
+
+    def setUp(self):
+        status_lookups.clear()
+        LipilaCollection.objects.create(amount=100, reference_id='ref-1', status='accepted')
+
+    def tearDown(self):
+        status_lookups.clear()
+
+    def test_check_payment_status(self):
+        self.assertEqual(check_payment_status('ref-1', 'col'), 'accepted')
+        with self.assertNumQueries(0):
+            self.assertEqual(check_payment_status('ref-1', 'col'), 'accepted')
+        update_transaction_status(LipilaCollection, 'ref-1', 'success')
+        self.assertEqual(check_payment_status('ref-1', 'col'), 'success')
@@ -0,0 +1,181 @@
+"""
+Tests the momo access token cache
+"""
+import threading
+import time
+from unittest.mock import Mock, patch
+from django.core.cache import cache
+from django.test import SimpleTestCase, override_settings
+from api.momo.tokens import TokenCache, token_cache
+from api.momo.mtn import Collections
+
+
+class TokenCacheTestCase(SimpleTestCase):
+    """Test the TokenCache class"""
+
+    def setUp(self):
+        self.tokens = TokenCache()
+        self.key = TokenCache.make_key('collection', 'subscription-key')
+
+    def test_make_key_hides_subscription_key(self):
+        self.assertNotIn('subscription-key', self.key)
+        self.assertTrue(self.key.startswith('momo:token:collection:'))
+
+    def test_fetch_called_once(self):
+        fetch = Mock(return_value=('token1', 3600))
+        self.assertEqual(self.tokens.get_or_fetch(self.key, fetch), 'token1')
+        self.assertEqual(self.tokens.get_or_fetch(self.key, fetch), 'token1')
+        fetch.assert_called_once()
+
+    def test_refresh_ahead_of_expiry(self):
+        fetch = Mock(side_effect=[('token1', 30), ('token2', 3600)])
+        self.assertEqual(self.tokens.get_or_fetch(self.key, fetch), 'token1')
+        # 30 seconds is inside the default 60 second refresh margin
+        self.assertEqual(self.tokens.get_or_fetch(self.key, fetch), 'token2')
+        self.assertEqual(fetch.call_count, 2)
+
+    def test_failed_fetch_keeps_valid_token(self):
+        fetch = Mock(side_effect=[('token1', 30), None])
+        self.tokens.get_or_fetch(self.key, fetch)
+        self.assertEqual(self.tokens.get_or_fetch(self.key, fetch), 'token1')
+
+    def test_failed_fetch_without_token(self):
+        self.assertIsNone(self.tokens.get_or_fetch(self.key, Mock(return_value=None)))
+
+    def test_invalidate(self):
+        self.tokens.set(self.key, 'token1', 3600)
+        self.tokens.invalidate(self.key)
+        self.assertIsNone(self.tokens.get(self.key))
+
+    def test_concurrent_callers_share_one_fetch(self):
+        calls = []
+
+        def fetch():
+            calls.append(1)
+            time.sleep(0.05)
+            return 'token1', 3600
+
+        results = []
+        threads = [threading.Thread(
+            target=lambda: results.append(self.tokens.get_or_fetch(self.key, fetch)))
+            for _ in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, ['token1'] * 10)
+
+    @override_settings(MOMO_TOKEN_CACHE='default')
+    def test_shared_cache(self):
+        self.tokens.set(self.key, 'token1', 3600)
+        other_process = TokenCache()
+        fetch = Mock()
+        self.assertEqual(other_process.get_or_fetch(self.key, fetch), 'token1')
+        fetch.assert_not_called()
+        cache.delete(self.key)
+
+    @override_settings(MOMO_TOKEN_CACHE='default')
+    def test_stale_entry_reads_shared_cache(self):
+        other_process = TokenCache()
+        other_process.set(self.key, 'token1', 30)
+        # this process refreshes the token, the other must not keep the old one
+        self.tokens.set(self.key, 'token2', 3600)
+        fetch = Mock()
+        self.assertEqual(other_process.get_or_fetch(self.key, fetch), 'token2')
+        fetch.assert_not_called()
+        cache.delete(self.key)
+
+    @override_settings(MOMO_TOKEN_CACHE='default', MOMO_TOKEN_LOCK_TIMEOUT=1)
+    def test_shared_lock_single_fetch(self):
+        # another process holds the lock while it mints the token
+        cache.add(f'{self.key}:lock', 'other', timeout=1)
+        other_process = TokenCache()
+
+        def mint():
+            time.sleep(0.1)
+            other_process.set(self.key, 'token1', 3600)
+            cache.delete(f'{self.key}:lock')
+
+        thread = threading.Thread(target=mint)
+        thread.start()
+        fetch = Mock()
+        self.assertEqual(self.tokens.get_or_fetch(self.key, fetch), 'token1')
+        thread.join()
+        fetch.assert_not_called()
+        cache.delete(self.key)
+
+    @override_settings(MOMO_TOKEN_CACHE='default')
+    def test_shared_lock_released(self):
+        self.tokens.get_or_fetch(self.key, Mock(return_value=('token1', 3600)))
+        self.assertIsNone(cache.get(f'{self.key}:lock'))
+        cache.delete(self.key)
+
+
+class MTNAuthorizeTestCase(SimpleTestCase):
+    """Test MTNBase.authorize"""
+
+    def setUp(self):
+        token_cache.clear()
+
+    def tearDown(self):
+        token_cache.clear()
+
+    @patch('api.momo.mtn.MTNBase.create_api_token')
+    def test_authorize_reuses_token(self, mock_create_token):
+        response = Mock(status_code=200)
+        response.json.return_value = {
+            'access_token': 'abc', 'token_type': 'access_token', 'expires_in': 3600}
+        mock_create_token.return_value = response
+
+        first = Collections()
+        second = Collections()
+        self.assertEqual(first.authorize(first.subscription_col_key, 'collection', 'ref1'), 'Bearer abc')
+        self.assertEqual(second.authorize(second.subscription_col_key, 'collection', 'ref1'), 'Bearer abc')
+        self.assertEqual(second.api_token, 'Bearer abc')
+        mock_create_token.assert_called_once()
+
+    @patch('api.momo.mtn.MTNBase.create_api_token')
+    def test_token_per_api_user(self, mock_create_token):
+        response = Mock(status_code=200)
+        response.json.side_effect = [{'access_token': 'abc'}, {'access_token': 'def'}]
+        mock_create_token.return_value = response
+
+        momo = Collections()
+        self.assertEqual(momo.authorize(momo.subscription_col_key, 'collection', 'ref1'), 'Bearer abc')
+        self.assertEqual(momo.authorize(momo.subscription_col_key, 'collection', 'ref2'), 'Bearer def')
+
+    @patch('api.momo.mtn.MTNBase.create_api_token')
+    def test_authorize_failed(self, mock_create_token):
+        mock_create_token.return_value = Mock(status_code=401)
+        momo = Collections()
+        self.assertIsNone(momo.authorize(momo.subscription_col_key, 'collection', 'ref1'))
+        self.assertEqual(momo.api_token, 'Bearer ')
+
+    @patch('api.momo.mtn.send')
+    @patch('api.momo.mtn.MTNBase.create_api_token')
+    def test_rejected_token_retried_once(self, mock_create_token, mock_send):
+        response = Mock(status_code=200)
+        response.json.side_effect = [{'access_token': 'abc'}, {'access_token': 'def'}]
+        mock_create_token.return_value = response
+        mock_send.side_effect = [Mock(status_code=401), Mock(status_code=200)]
+
+        momo = Collections()
+        momo.authorize(momo.subscription_col_key, 'collection', 'ref1')
+        result = momo.get_payment_status('ref-retry')
+        self.assertEqual(result.status_code, 200)
+        self.assertEqual(mock_send.call_count, 2)
+        self.assertEqual(mock_send.call_args.kwargs['headers']['Authorization'], 'Bearer def')
+
+    @patch('api.momo.mtn.send')
+    @patch('api.momo.mtn.MTNBase.create_api_token')
+    def test_rejected_token_not_retried_twice(self, mock_create_token, mock_send):
+        response = Mock(status_code=200)
+        response.json.return_value = {'access_token': 'abc'}
+        mock_create_token.return_value = response
+        mock_send.return_value = Mock(status_code=401)
+
+        momo = Collections()
+        momo.authorize(momo.subscription_col_key, 'collection', 'ref1')
+        momo.get_payment_status('ref-retry-twice')
+        self.assertEqual(mock_send.call_count, 2)
@@ -0,0 +1,137 @@
+"""
+Transaction status functions
+"""
+import random
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from api.momo.singleflight import status_lookups
+
+FINAL_STATUSES = ('success', 'failed', 'rejected')
+
+# Maps the status reported by the gateway to a lipila status.
+# Statuses that are not listed are still in progress.
+GATEWAY_STATUSES = {
+    'SUCCESSFUL': 'success',
+    'SUCCESS': 'success',
+    'FAILED': 'failed',
+    'REJECTED': 'failed',
+    'TIMEOUT': 'failed',
+    'EXPIRED': 'failed',
+}
+
+
+def get_gateway_status(data: dict):
+    """
+    Gets the final lipila status from a gateway transaction.
+
+    Args:
+        data(dict): The transaction returned by the gateway, e.g
+            {"status": "SUCCESSFUL", ...}
+
+    Returns:
+        str: 'success' or 'failed', None while the transaction is pending.
+    """
+    if not isinstance(data, dict):
+        return None
+    return GATEWAY_STATUSES.get(str(data.get('status', '')).upper())
+
+
+def get_status_key(transaction: str, reference_id: str) -> tuple:
+    """
+    Gets the key status lookups of a transaction are shared under.
+
+    Args:
+        transaction(str): The type of transaction, col or dis.
+        reference_id(str): The uuid that identifies the transaction.
+    """
+    return ('status', transaction, str(reference_id))
+
+
+def propagate_status(updates: dict):
+    """
+    Copies final transaction statuses to the patron side models that
+    reference the same transactions. Rows already in a final state are not
+    changed, so calling this twice with the same updates is harmless.
+
+    Args:
+        updates(dict): {reference_id: status}
+    """
+    # imported here, the patron models import api utils
+    from patron.models import Payments, Contributions, WithdrawalRequest, ProcessedWithdrawals
+
+    by_status = {}
+    for reference_id, status in updates.items():
+        # later status checks see the new status
+        status_lookups.forget(get_status_key('col', reference_id))
+        status_lookups.forget(get_status_key('dis', reference_id))
+        if status in FINAL_STATUSES:
+            by_status.setdefault(status, []).append(reference_id)
+
+    for status, reference_ids in by_status.items():
+        Payments.objects.filter(reference_id__in=reference_ids).exclude(
+            status__in=FINAL_STATUSES).update(status=status)
+        Contributions.objects.filter(reference_id__in=reference_ids).exclude(
+            status__in=FINAL_STATUSES).update(status=status)
+        withdrawals = WithdrawalRequest.objects.filter(
+            reference_id__in=reference_ids).exclude(status__in=FINAL_STATUSES)
+        ProcessedWithdrawals.objects.filter(withdrawal_request__in=withdrawals).exclude(
+            status__in=FINAL_STATUSES).update(status=status)
+        withdrawals.update(status=status, processed_date=timezone.now())
+
+
+def update_transaction_status(model, reference_id: str, status: str) -> bool:
+    """
+    Sets the final status of a collection or disbursement and propagates it.
+    Transactions that already have a final status are left unchanged.
+
+    Args:
+        model: LipilaCollection or LipilaDisbursement.
+        reference_id(str): The uuid that identifies the transaction.
+        status(str): The new status, one of FINAL_STATUSES.
+
+    Returns:
+        bool: True if the transaction was updated.
+    """
+    updated = model.objects.filter(reference_id=reference_id).exclude(
+        status__in=FINAL_STATUSES).update(status=status, updated_at=timezone.now())
+    if updated:
+        propagate_status({reference_id: status})
+    return bool(updated)
+
+
+def get_poll_delay(attempts: int) -> float:
+    """
+    Gets the seconds to wait before the next status poll of a transaction.
+    The delay doubles with every attempt up to MOMO_POLL_MAX_DELAY and is
+    jittered so transactions accepted together are not polled together.
+
+    Args:
+        attempts(int): The number of polls already made.
+
+    Returns:
+        float: The delay in seconds.
+    """
+    base = getattr(settings, 'MOMO_POLL_BASE_DELAY', 5)
+    maximum = getattr(settings, 'MOMO_POLL_MAX_DELAY', 300)
+    delay = min(maximum, base * 2 ** attempts)
+    return delay * random.uniform(0.5, 1.5)
+
+
+def schedule_first_poll(transaction):
+    """
+    Marks a transaction as accepted by the gateway and schedules its first poll.
+    When gateway callbacks are enabled the poll is only a fallback and waits
+    MOMO_CALLBACK_GRACE seconds for the callback.
+
+    Args:
+        transaction: An unsaved LipilaCollection or LipilaDisbursement.
+    """
+    delay = get_poll_delay(0)
+    if getattr(settings, 'MOMO_CALLBACK_URL', ''):
+        delay = max(delay, getattr(settings, 'MOMO_CALLBACK_GRACE', 300))
+    transaction.status = 'accepted'
+    transaction.poll_attempts = 0
+    transaction.next_poll_at = timezone.now() + timedelta(seconds=delay)
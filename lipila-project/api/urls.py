@@ -10,6 +10,9 @@ router.register(r'disburse', views.LipilaDisbursementView, basename='disburse')
 
 urlpatterns = [
     path('login/', views.APILoginView.as_view(), name='api-login'),
+    path('callbacks/mtn/<str:product>/<str:reference_id>/',
+         views.MTNCallbackView.as_view(), name='mtn-callback'),
+    path('metrics/', views.GatewayMetricsView.as_view(), name='gateway-metrics'),
 ]
 
 urlpatterns += router.urls
@@ -0,0 +1,91 @@
+"""Defines a process wide store of the users looked up by the api"""
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+
+class UserCache():
+    """
+    Keeps the users looked up by username or id in process memory so hot
+    paths, e.g the list endpoints, do not query them on every request.
+
+    Users are kept for API_USER_CACHE_TTL seconds, the least recently used
+    are dropped past API_USER_CACHE_SIZE entries. A user is dropped when it
+    is saved or deleted, missing users are not cached. Callers get a copy
+    so a changed instance never leaks into other requests.
+    """
+
+    def __init__(self):
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, **lookup):
+        """
+        Gets a user, from the database when it is not cached.
+
+        Args:
+            **lookup: One field lookup, e.g username='lipila' or pk=1.
+
+        Returns:
+            A User object or None when there is no such user.
+        """
+        key = tuple(sorted(lookup.items()))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] > time.time():
+                self._entries.move_to_end(key)
+                return copy.copy(entry[0])
+        try:
+            user = get_user_model().objects.get(**lookup)
+        except get_user_model().DoesNotExist:
+            return None
+        expires_at = time.time() + getattr(settings, 'API_USER_CACHE_TTL', 300)
+        max_size = getattr(settings, 'API_USER_CACHE_SIZE', 1000)
+        with self._lock:
+            self._entries[key] = (user, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > max_size:
+                self._entries.popitem(last=False)
+        return copy.copy(user)
+
+    def forget(self, user):
+        """Drops the entries of a user, and of any other user with its username"""
+        with self._lock:
+            for key in [key for key, (cached, expires_at) in self._entries.items()
+                        if cached.pk == user.pk or cached.username == user.username]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+user_cache = UserCache()
+
+
+def get_default_api_user():
+    """
+    Returns the user that owns payments made without api credentials.
+
+    Raises:
+        User.DoesNotExist: When there is no such user.
+    """
+    user = user_cache.get(pk=1)
+    if user is None:
+        raise get_user_model().DoesNotExist('The default api user does not exist')
+    return user
+
+
+@receiver(post_save, sender=get_user_model())
+@receiver(post_delete, sender=get_user_model())
+def forget_user(sender, instance, update_fields=None, **kwargs):
+    if update_fields == frozenset(['last_login']):
+        # logins only change last_login
+        return
+    user_cache.forget(instance)
@@ -5,6 +5,7 @@ import requests
 from base64 import b64encode
 from django.contrib.auth.models import User
 from rest_framework.response import Response
+from api.users import user_cache
 import datetime
 import random
 from uuid import uuid4
@@ -22,11 +23,30 @@ def get_api_user(user:str)-> User:
     Returns:
         A User obeject.
     """
-    try:
-        user = User.objects.get(username=user)
-        return user
-    except User.DoesNotExist:
+    api_user = user_cache.get(username=str(user))
+    if api_user is None:
         return Response({"error": "api user not found"}, status=404)
+    return api_user
+
+
+def get_request_api_user(request):
+    """
+    Gets the merchant an API request is for: the authenticated user, else
+    the user named by the api_user query parameter. Views only let requests
+    without credentials through when API_ALLOW_ANONYMOUS is set.
+
+    Args:
+        request: The API request.
+
+    Returns:
+        A User object, or a 400 or 404 Response.
+    """
+    if request.user and request.user.is_authenticated:
+        return request.user
+    api_user = request.query_params.get('api_user')
+    if not api_user:
+        return Response({"error": "api user ID is missing"}, status=400)
+    return get_api_user(api_user)
 
 
 def generate_reference_id() -> str:
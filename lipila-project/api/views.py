@@ -1,20 +1,35 @@
+import hmac
 import environ
+from django.conf import settings
 from django.contrib.auth import login, logout
 from django.contrib.auth.models import User
 from django.contrib.auth import get_user_model
+from django.http import HttpResponse
 from django.utils import timezone
 from rest_framework import status
 from rest_framework import views, viewsets
+from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.authtoken.views import ObtainAuthToken
-from rest_framework.permissions import AllowAny
+from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.authtoken.models import Token
 
 # My modules
+from .authentication import IsApiUser, token_auth_cache
 from .serializers import LipilaCollectionSerializer, LipilaDisbursementSerializer
 from .models import LipilaCollection, LipilaDisbursement
-from api.momo.mtn import Collections, Disbursement
-from .utils import get_api_user
+from api.momo.breaker import deadline
+from api.momo.metrics import gateway_metrics
+from api.momo.router import router
+from .users import get_default_api_user
+from .utils import get_request_api_user, is_payment_details_valid, is_deposit_details_valid
+from .bulk import bulk_collect, bulk_disburse
+from .conditional import conditional
+from .export import export_response
+from .idempotency import idempotent
+from .jobs import submit
+from .pagination import filter_transactions, paginate
+from .transactions import get_gateway_status, schedule_first_poll, update_transaction_status
 
 # Define global variables
 env = environ.Env()
@@ -31,6 +46,8 @@ class APILoginView(ObtainAuthToken):
             serializer.is_valid(raise_exception=True)
             user = serializer.validated_data['user']
             token, created = Token.objects.get_or_create(user=user)
+            # the first api calls with the token skip the database
+            token_auth_cache.set(user, token)
             return Response({
                 'token': token.key,
                 'user': {
@@ -51,13 +68,84 @@ class APILogoutView(views.APIView):
         return Response(status=status.HTTP_200_OK)
 
 
+def get_api_owner(request):
+    """Returns the merchant the payments of a request belong to"""
+    if request.user.is_authenticated:
+        return request.user
+    # requests without api credentials, only let through by API_ALLOW_ANONYMOUS
+    return get_default_api_user()
+
+
+def get_rate_limit_key(request):
+    """Returns the id the payment rate limits of a request are counted against"""
+    return request.user.pk if request.user.is_authenticated else None
+
+
+class MTNCallbackView(views.APIView):
+    """
+    Receives the transaction notifications MTN sends to the X-Callback-Url of
+    a request to pay or deposit, and sets the final status of the transaction.
+    Repeated callbacks for the same transaction are acknowledged without changes.
+    """
+    authentication_classes = []
+    permission_classes = [AllowAny]
+    models = {'collection': LipilaCollection, 'disbursement': LipilaDisbursement}
+
+    def post(self, request, product, reference_id):
+        """Handles the callback of the product transaction reference_id"""
+        model = self.models.get(product)
+        if model is None:
+            return Response({'error': 'unknown product'}, status=404)
+        token = getattr(settings, 'MOMO_CALLBACK_TOKEN', '')
+        if token and not hmac.compare_digest(str(request.query_params.get('token', '')), token):
+            return Response({'error': 'invalid callback token'}, status=403)
+
+        transaction_status = get_gateway_status(request.data)
+        if transaction_status is not None and update_transaction_status(
+                model, reference_id, transaction_status):
+            return Response({'reference_id': reference_id, 'status': transaction_status}, status=200)
+
+        transaction = model.objects.filter(reference_id=reference_id).only('status').first()
+        if transaction is None:
+            return Response({'error': 'transaction not found'}, status=404)
+        return Response({'reference_id': reference_id, 'status': transaction.status}, status=200)
+
+    # MTN sends PUT for some products and POST for others
+    put = post
+
+
+class GatewayMetricsView(views.APIView):
+    """
+    Serves the gateway call latencies and counters of every worker in the
+    prometheus text format. When MOMO_METRICS_TOKEN is set scrapers must
+    send it as a bearer token.
+    """
+    authentication_classes = []
+    permission_classes = [AllowAny]
+
+    def get(self, request, format=None):
+        token = getattr(settings, 'MOMO_METRICS_TOKEN', '')
+        if token and not hmac.compare_digest(
+                request.headers.get('Authorization', ''), f'Bearer {token}'):
+            return HttpResponse('invalid metrics token', status=403, content_type='text/plain')
+        return HttpResponse(gateway_metrics.render(), content_type='text/plain; version=0.0.4')
+
+
 class LipilaDisbursementView(viewsets.ModelViewSet):
     """
     API endpoint that allows Disbursments to be viewed and created.
     """
     serializer_class = LipilaDisbursementSerializer
     queryset = LipilaDisbursement.objects.all()
+    permission_classes = [IsApiUser]
+
+    def get_queryset(self):
+        if self.request.user.is_authenticated:
+            # merchants only see their own disbursements
+            return self.queryset.filter(api_user=self.request.user)
+        return super().get_queryset()
     
+    @idempotent('disburse')
     def create(self, request):
         """
         Handles POST requests, deserializing data and updating default fields.
@@ -71,35 +159,42 @@ class LipilaDisbursementView(viewsets.ModelViewSet):
             payee = str(data['payee_account_number'])
             amount = str(data['amount'])
             serializer = LipilaDisbursementSerializer(data=data)
-            provisioned_mtn_api_user = Disbursement()
-            provisioned_mtn_api_user.provision_sandbox(
-                provisioned_mtn_api_user.subscription_dis_key, reference_id)
-            provisioned_mtn_api_user.create_api_token(
-                provisioned_mtn_api_user.subscription_dis_key, 'disbursement', reference_id)
             
             if serializer.is_valid():
-                request_pay = provisioned_mtn_api_user.deposit(
-                    amount=amount, payee=payee, reference_id=str(reference_id))
+                try:
+                    is_deposit_details_valid(amount, payee, str(reference_id))
+                except (ValueError, TypeError):
+                    return Response({'message': 'Data not valid'}, status=400)
+                payment_method = serializer.validated_data.get('payment_method')
+                if getattr(settings, 'MOMO_QUEUE_PAYMENTS', False):
+                    # a run_workers process sends the payment
+                    submit(LipilaDisbursement(
+                        **serializer.validated_data, api_user=get_api_owner(request),
+                        reference_id=reference_id, updated_at=timezone.now()), 'disbursement')
+                    return Response({'message': 'request queued', 'reference_id': reference_id}, status=202)
+                with deadline(getattr(settings, 'MOMO_REQUEST_DEADLINE', 20)):
+                    provider, request_pay = router.send(
+                        payment_method, payee, 'disbursement',
+                        lambda gateway: gateway.deposit(
+                            amount=amount, payee=payee, reference_id=str(reference_id)),
+                        get_rate_limit_key(request))
+                if request_pay.status_code == 429:
+                    return Response({'message': 'Too many payment requests, retry later'},
+                                    status=429, headers={'Retry-After': '1'})
+                if provider is None:
+                    return Response({'message': 'Payment gateway unavailable'}, status=503)
                 # save payment object
-                api_user = User.objects.get(pk=1)
+                api_user = get_api_owner(request)
                 payment = serializer.save()
                 payment.api_user = api_user
                 payment.updated_at = timezone.now()
                 payment.reference_id = reference_id
+                payment.payment_method = provider
 
                 if request_pay.status_code == 202:
-                    
-                    payment.status = 'accepted'  # Set status based on mapping
+                    # the final status is set by the status poller
+                    schedule_first_poll(payment)
                     payment.save()
-                    response = provisioned_mtn_api_user.get_transaction_status('deposit',
-                        reference_id)
-                    if response.status_code == 200:
-                        payment.status = 'success'
-                        payment.save()
-                    else:
-                        
-                        payment.status = 'failed'
-                        payment.save()
                     return Response({'message': 'request accepted, wait for client approval'}, status=202)
                 elif request_pay.status_code == 403:
                     payment.status = 'failed'
@@ -111,25 +206,88 @@ class LipilaDisbursementView(viewsets.ModelViewSet):
                     payment.save()
                     status_code = request_pay.status_code
                     return Response({'message': 'Bad request to payment gateway'}, status=400)
+                elif request_pay.status_code >= 500:
+                    # the gateway may have taken the payment, the status poller finds out
+                    schedule_first_poll(payment)
+                    payment.save()
+                    return Response({'message': 'Payment gateway error'}, status=502)
+                else:
+                    # e.g 401 or 409, the gateway refused the payment
+                    payment.status = 'failed'
+                    payment.save()
+                    return Response({'message': 'Payment gateway error'}, status=502)
             else:
                 return Response({'message': 'Data not valid'}, status=400)
         except Exception as e:
             return Response({'message': f'Key Error in submitted data {e}'}, status=400)
         # return Response({'message': 'request accepted, wait for client approval'}, status=202)
 
-    def list(self, request):
-        api_user = request.query_params.get('api_user')
+    @action(detail=False, methods=['post'], url_path='bulk')
+    def bulk(self, request):
+        """
+        Handles POST requests with a batch of disbursements.
+        Every item is validated up-front and the valid ones are sent concurrently.
+        """
+        items = request.data.get('payments') if isinstance(request.data, dict) else request.data
+        if not isinstance(items, list) or not items:
+            return Response({'message': 'payments list is missing'}, status=400)
+        max_items = getattr(settings, 'MOMO_BULK_MAX_ITEMS', 500)
+        if len(items) > max_items:
+            return Response({'message': f'A batch can have at most {max_items} payments'}, status=400)
 
-        if not api_user:
-            return Response({"error": "api user ID is missing"}, status=400)
+        api_user = get_api_owner(request)
+        result = bulk_disburse(api_user, items)
+        if result['invalid'] == len(items):
+            return Response(result, status=400)
+        return Response(result, status=202)
 
-        user = get_api_user(api_user)
+    @action(detail=False, methods=['get'], url_path='export', permission_classes=[IsAuthenticated])
+    def export(self, request):
+        """
+        Handles GET requests for a csv or ndjson download of the disbursements
+        of the authenticated api user, streamed whatever their number.
+        """
+        try:
+            payments = filter_transactions(
+                request.query_params, LipilaDisbursement.objects.filter(api_user=request.user))
+            return export_response(payments, 'disbursement', request.query_params.get('type', 'csv'))
+        except ValueError as e:
+            return Response({"error": str(e)}, status=400)
+
+    def retrieve(self, request, pk=None):
+        """
+        Handles GET requests for one transaction, answering 304 when the
+        client copy is current.
+        """
+        try:
+            payment = self.get_queryset().filter(pk=pk)
+        except (TypeError, ValueError):
+            # not an id, get_object answers 404
+            return super().retrieve(request, pk=pk)
+        not_modified, headers = conditional(request, payment)
+        if not_modified is not None:
+            return not_modified
+        response = super().retrieve(request, pk=pk)
+        for header, value in headers.items():
+            response[header] = value
+        return response
+
+    def list(self, request):
+        user = get_request_api_user(request)
         if isinstance(user, User):
             payments = LipilaDisbursement.objects.filter(api_user=user)
+            not_modified, headers = conditional(request, payments)
+            if not_modified is not None:
+                return not_modified
+            try:
+                payments, page_headers = paginate(request, payments)
+            except ValueError as e:
+                return Response({"error": str(e)}, status=400)
+            headers.update(page_headers)
             serializer = LipilaDisbursementSerializer(payments, many=True)
-            return Response(serializer.data, status=200)
-
-        return Response({"error": "api user not found"}, status=404)
+            return Response(serializer.data, status=200, headers=headers)
+        # the api user is missing or unknown
+        return user
 
 
 class LipilaCollectionView(viewsets.ModelViewSet):
@@ -138,7 +296,15 @@ class LipilaCollectionView(viewsets.ModelViewSet):
     """
     serializer_class = LipilaCollectionSerializer
     queryset = LipilaCollection.objects.all()
+    permission_classes = [IsApiUser]
 
+    def get_queryset(self):
+        if self.request.user.is_authenticated:
+            # merchants only see their own collections
+            return self.queryset.filter(api_user=self.request.user)
+        return super().get_queryset()
+
+    @idempotent('payments')
     def create(self, request):
         """
         Handles POST requests, deserializing date and updating default fields.
@@ -154,33 +320,41 @@ class LipilaCollectionView(viewsets.ModelViewSet):
             payer = str(data['payer_account_number'])
             amount = str(data['amount'])
             serializer = LipilaCollectionSerializer(data=data)
-            provisioned_mtn_api_user = Collections()
-            provisioned_mtn_api_user.provision_sandbox(
-                provisioned_mtn_api_user.subscription_col_key, reference_id)
-            provisioned_mtn_api_user.create_api_token(
-                provisioned_mtn_api_user.subscription_col_key, 'collection', reference_id)
 
             if serializer.is_valid():
-                request_pay = provisioned_mtn_api_user.request_to_pay(
-                    amount=amount, payer=payer, reference_id=str(reference_id))
+                try:
+                    is_payment_details_valid(amount, payer, str(reference_id))
+                except (ValueError, TypeError):
+                    return Response({'message': 'Data not valid'}, status=400)
+                payment_method = serializer.validated_data.get('payment_method')
+                if getattr(settings, 'MOMO_QUEUE_PAYMENTS', False):
+                    # a run_workers process sends the payment
+                    submit(LipilaCollection(
+                        **serializer.validated_data, api_user=get_api_owner(request),
+                        reference_id=reference_id, updated_at=timezone.now()), 'collection')
+                    return Response({'message': 'request queued', 'reference_id': reference_id}, status=202)
+                with deadline(getattr(settings, 'MOMO_REQUEST_DEADLINE', 20)):
+                    provider, request_pay = router.send(
+                        payment_method, payer, 'collection',
+                        lambda gateway: gateway.request_to_pay(
+                            amount=amount, payer=payer, reference_id=str(reference_id)),
+                        get_rate_limit_key(request))
+                if request_pay.status_code == 429:
+                    return Response({'message': 'Too many payment requests, retry later'},
+                                    status=429, headers={'Retry-After': '1'})
+                if provider is None:
+                    return Response({'message': 'Payment gateway unavailable'}, status=503)
                 # save payment request
-                api_user = User.objects.get(pk=1)
+                api_user = get_api_owner(request)
                 payment = serializer.save()
                 payment.api_user = api_user
                 payment.updated_at = timezone.now()
                 payment.reference_id = reference_id
+                payment.payment_method = provider
                 if request_pay.status_code == 202:
-                    payment.status = 'accepted'  # Set status based on mapping
+                    # the final status is set by the status poller
+                    schedule_first_poll(payment)
                     payment.save()
-                    # consider makingan an async function call
-                    response = provisioned_mtn_api_user.get_payment_status(
-                        reference_id)
-                    if response.status_code == 200:
-                        payment.status = 'success'
-                        payment.save()
-                    else:
-                        payment.status = 'failed'
-                        payment.save()
                     return Response({'message': 'request accepted, wait for client approval'}, status=202)
                 elif request_pay.status_code == 403:
                     payment.status = 'failed'
@@ -192,24 +366,85 @@ class LipilaCollectionView(viewsets.ModelViewSet):
                     payment.save()
                     status_code = request_pay.status_code
                     return Response({'message': 'Bad request to payment gateway'}, status=400)
+                elif request_pay.status_code >= 500:
+                    # the gateway may have taken the payment, the status poller finds out
+                    schedule_first_poll(payment)
+                    payment.save()
+                    return Response({'message': 'Payment gateway error'}, status=502)
+                else:
+                    # e.g 401 or 409, the gateway refused the payment
+                    payment.status = 'failed'
+                    payment.save()
+                    return Response({'message': 'Payment gateway error'}, status=502)
             else:
                 return Response({'message': 'Data not valid'}, status=400)
         except Exception as e:
             return Response({'message': f'Key Error in submitted data {e}'}, status=400)
         # return Response({'message': 'request accepted, wait for client approval'}, status=202)
 
-    def list(self, request):
+    @action(detail=False, methods=['post'], url_path='bulk')
+    def bulk(self, request):
+        """
+        Handles POST requests with a batch of requests to pay.
+        Every item is validated up-front and the valid ones are sent concurrently.
+        """
+        items = request.data.get('payments') if isinstance(request.data, dict) else request.data
+        if not isinstance(items, list) or not items:
+            return Response({'message': 'payments list is missing'}, status=400)
+        max_items = getattr(settings, 'MOMO_BULK_MAX_ITEMS', 500)
+        if len(items) > max_items:
+            return Response({'message': f'A batch can have at most {max_items} payments'}, status=400)
 
-        api_user = request.query_params.get('api_user')
+        api_user = get_api_owner(request)
+        result = bulk_collect(api_user, items)
+        if result['invalid'] == len(items):
+            return Response(result, status=400)
+        return Response(result, status=202)
 
-        if not api_user:
-            return Response({"error": "api user ID is missing"}, status=400)
+    @action(detail=False, methods=['get'], url_path='export', permission_classes=[IsAuthenticated])
+    def export(self, request):
+        """
+        Handles GET requests for a csv or ndjson download of the collections
+        of the authenticated api user, streamed whatever their number.
+        """
+        try:
+            payments = filter_transactions(
+                request.query_params, LipilaCollection.objects.filter(api_user=request.user))
+            return export_response(payments, 'collection', request.query_params.get('type', 'csv'))
+        except ValueError as e:
+            return Response({"error": str(e)}, status=400)
 
-        user = get_api_user(api_user)
+    def retrieve(self, request, pk=None):
+        """
+        Handles GET requests for one transaction, answering 304 when the
+        client copy is current.
+        """
+        try:
+            payment = self.get_queryset().filter(pk=pk)
+        except (TypeError, ValueError):
+            # not an id, get_object answers 404
+            return super().retrieve(request, pk=pk)
+        not_modified, headers = conditional(request, payment)
+        if not_modified is not None:
+            return not_modified
+        response = super().retrieve(request, pk=pk)
+        for header, value in headers.items():
+            response[header] = value
+        return response
+
+    def list(self, request):
+        user = get_request_api_user(request)
         if isinstance(user, User):
-            payments = LipilaCollection.objects.filter(
-                api_user=get_api_user(api_user))
+            payments = LipilaCollection.objects.filter(api_user=user)
+            not_modified, headers = conditional(request, payments)
+            if not_modified is not None:
+                return not_modified
+            try:
+                payments, page_headers = paginate(request, payments)
+            except ValueError as e:
+                return Response({"error": str(e)}, status=400)
+            headers.update(page_headers)
             serializer = LipilaCollectionSerializer(payments, many=True)
-            return Response(serializer.data, status=200)
-
-        return Response({"error": "api user not found"}, status=404)
+            return Response(serializer.data, status=200, headers=headers)
+        # the api user is missing or unknown
+        return user
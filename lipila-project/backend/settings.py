@@ -173,7 +173,7 @@ CRISPY_TEMPLATE_PACK = "bootstrap4"
 # Rest Framework config. Add all of this.
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework.authentication.TokenAuthentication',
+        'api.authentication.CachedTokenAuthentication',
         # 'rest_framework.authentication.SessionAuthentication',
     ),
 }
@@ -201,3 +201,132 @@ else:
     EMAIL_HOST_PASSWORD = env('EMAIL_PW')
 
     DEFAULT_FROM_EMAIL = 'noreply<no_reply@domain.com>'
+
+# Mobile money gateways
+# Name of a cache in CACHES used to share access tokens between worker
+# processes. Leave empty to keep tokens in process memory only.
+MOMO_TOKEN_CACHE = env('MOMO_TOKEN_CACHE', default='')
+# Seconds before expiry at which a cached access token is refreshed.
+MOMO_TOKEN_REFRESH_MARGIN = env.int('MOMO_TOKEN_REFRESH_MARGIN', default=60)
+# Seconds a worker process may hold the shared lock while it mints a token,
+# the other processes wait that long at most for the new token.
+MOMO_TOKEN_LOCK_TIMEOUT = env.int('MOMO_TOKEN_LOCK_TIMEOUT', default=10)
+# Keep-alive connections kept per gateway host by each worker process.
+MOMO_POOL_SIZE = env.int('MOMO_POOL_SIZE', default=10)
+# Seconds to wait for a gateway connection and for its response.
+MOMO_CONNECT_TIMEOUT = env.float('MOMO_CONNECT_TIMEOUT', default=5)
+MOMO_READ_TIMEOUT = env.float('MOMO_READ_TIMEOUT', default=30)
+# Retries for failed connections and, on idempotent calls, 502/503/504.
+MOMO_MAX_RETRIES = env.int('MOMO_MAX_RETRIES', default=2)
+# Deposits sent at the same time by a bulk payout, and the largest batch.
+MOMO_BULK_CONCURRENCY = env.int('MOMO_BULK_CONCURRENCY', default=8)
+MOMO_BULK_MAX_ITEMS = env.int('MOMO_BULK_MAX_ITEMS', default=500)
+# Status polling of accepted transactions (manage.py poll_transactions).
+# Polls back off from MOMO_POLL_BASE_DELAY to MOMO_POLL_MAX_DELAY seconds and
+# a transaction is failed after MOMO_POLL_MAX_ATTEMPTS pending polls.
+MOMO_POLL_BATCH_SIZE = env.int('MOMO_POLL_BATCH_SIZE', default=100)
+MOMO_POLL_CONCURRENCY = env.int('MOMO_POLL_CONCURRENCY', default=8)
+MOMO_POLL_BASE_DELAY = env.float('MOMO_POLL_BASE_DELAY', default=5)
+MOMO_POLL_MAX_DELAY = env.float('MOMO_POLL_MAX_DELAY', default=300)
+MOMO_POLL_MAX_ATTEMPTS = env.int('MOMO_POLL_MAX_ATTEMPTS', default=12)
+# Gateway callbacks (api/v1/callbacks/mtn/...). MOMO_CALLBACK_URL is the public
+# base url of the api, e.g https://lipila.example.com/api/v1, leave it empty to
+# rely on polling. When set the first status poll waits MOMO_CALLBACK_GRACE
+# seconds so callbacks can settle most transactions first.
+MOMO_CALLBACK_URL = env('MOMO_CALLBACK_URL', default='')
+MOMO_CALLBACK_TOKEN = env('MOMO_CALLBACK_TOKEN', default='')
+MOMO_CALLBACK_GRACE = env.float('MOMO_CALLBACK_GRACE', default=300)
+# Circuit breakers per gateway endpoint family: open after MOMO_BREAKER_FAILURES
+# consecutive failures and probe again after MOMO_BREAKER_RESET seconds.
+MOMO_BREAKER_FAILURES = env.int('MOMO_BREAKER_FAILURES', default=5)
+MOMO_BREAKER_RESET = env.float('MOMO_BREAKER_RESET', default=30)
+# Seconds a payment request may spend on all of its gateway calls.
+MOMO_REQUEST_DEADLINE = env.float('MOMO_REQUEST_DEADLINE', default=20)
+# Account holder validation before payments. Active and inactive numbers are
+# cached for MOMO_ACCOUNT_TTL and MOMO_ACCOUNT_NEGATIVE_TTL seconds in process
+# memory, and in the MOMO_ACCOUNT_CACHE django cache when it is set.
+MOMO_VALIDATE_ACCOUNTS = env.bool('MOMO_VALIDATE_ACCOUNTS', default=True)
+MOMO_ACCOUNT_CACHE = env('MOMO_ACCOUNT_CACHE', default='')
+MOMO_ACCOUNT_CACHE_SIZE = env.int('MOMO_ACCOUNT_CACHE_SIZE', default=10000)
+MOMO_ACCOUNT_TTL = env.int('MOMO_ACCOUNT_TTL', default=3600)
+MOMO_ACCOUNT_NEGATIVE_TTL = env.int('MOMO_ACCOUNT_NEGATIVE_TTL', default=300)
+# Gateway base urls, point them at `manage.py run_momo_simulator` to work offline.
+MTN_BASE_URL = env('MTN_BASE_URL', default='') or 'https://sandbox.momodeveloper.mtn.com'
+AIRTEL_BASE_URL = env('AIRTEL_BASE_URL', default='') or 'https://openapiuat.airtel.africa'
+# Token bucket limits on payment calls per product, shared by all workers
+# through the MOMO_RATE_LIMIT_CACHE django cache (default cache when empty).
+# Rates are calls per second, 0 turns a limit off. A call waits up to
+# MOMO_RATE_LIMIT_WAIT seconds for room and is then refused with a 429.
+MOMO_RATE_LIMIT_CACHE = env('MOMO_RATE_LIMIT_CACHE', default='')
+MOMO_RATE_LIMIT_WAIT = env.float('MOMO_RATE_LIMIT_WAIT', default=2)
+MOMO_RATE_LIMITS = {
+    'collection': (env.float('MOMO_COLLECTION_RATE', default=0), env.float('MOMO_COLLECTION_BURST', default=0)),
+    'disbursement': (env.float('MOMO_DISBURSEMENT_RATE', default=0), env.float('MOMO_DISBURSEMENT_BURST', default=0)),
+    'airtel_collection': (env.float('AIRTEL_COLLECTION_RATE', default=0), env.float('AIRTEL_COLLECTION_BURST', default=0)),
+    'airtel_disbursement': (env.float('AIRTEL_DISBURSEMENT_RATE', default=0), env.float('AIRTEL_DISBURSEMENT_BURST', default=0)),
+}
+# The same limits for each api user.
+MOMO_USER_RATE_LIMITS = {
+    product: (env.float('MOMO_USER_RATE', default=0), env.float('MOMO_USER_BURST', default=0))
+    for product in ('collection', 'disbursement', 'airtel_collection', 'airtel_disbursement')
+}
+# Bulk payouts queue for the rate limits up to this many seconds per payment.
+MOMO_BULK_RATE_LIMIT_WAIT = env.float('MOMO_BULK_RATE_LIMIT_WAIT', default=60)
+# Airtel money requests are made in this country and currency.
+AIRTEL_COUNTRY = env('AIRTEL_COUNTRY', default='ZM')
+AIRTEL_CURRENCY = env('AIRTEL_CURRENCY', default='ZMW')
+# Payments whose payment_method is not a gateway name are routed by the
+# network prefix of the mobile number, or to mtn when the prefix is unknown.
+# Gateway health is the latency and error rate of the last MOMO_ROUTER_WINDOW calls.
+MOMO_COUNTRY_CODE = env('MOMO_COUNTRY_CODE', default='260')
+MOMO_NETWORK_PREFIXES = {
+    'mtn': env.list('MOMO_MTN_PREFIXES', default=['096', '076']),
+    'airtel': env.list('MOMO_AIRTEL_PREFIXES', default=['097', '077']),
+}
+MOMO_ROUTER_WINDOW = env.int('MOMO_ROUTER_WINDOW', default=50)
+MOMO_ROUTER_MAX_ERROR_RATE = env.float('MOMO_ROUTER_MAX_ERROR_RATE', default=0.5)
+# Concurrent status lookups of a transaction share one call and its result
+# is reused for this many seconds.
+MOMO_STATUS_CACHE_TTL = env.float('MOMO_STATUS_CACHE_TTL', default=2)
+# reconcile_transactions settles transactions that are not final after
+# MOMO_RECONCILE_AFTER minutes, saving MOMO_RECONCILE_CHUNK_SIZE rows at a time.
+MOMO_RECONCILE_AFTER = env.float('MOMO_RECONCILE_AFTER', default=30)
+MOMO_RECONCILE_CHUNK_SIZE = env.int('MOMO_RECONCILE_CHUNK_SIZE', default=500)
+# Gateway call metrics served at /api/v1/metrics/. With several worker
+# processes set MOMO_METRICS_DIR to a directory they share, every process
+# writes its totals there at most every MOMO_METRICS_FLUSH seconds.
+MOMO_METRICS_DIR = env('MOMO_METRICS_DIR', default='')
+MOMO_METRICS_FLUSH = env.float('MOMO_METRICS_FLUSH', default=5)
+MOMO_METRICS_TOKEN = env('MOMO_METRICS_TOKEN', default='')
+# Responses of payment requests sent with an Idempotency-Key header are
+# replayed to retries for IDEMPOTENCY_KEY_TTL seconds. A key held longer than
+# IDEMPOTENCY_LOCK_TIMEOUT seconds by a request that never finished is freed.
+IDEMPOTENCY_KEY_TTL = env.int('IDEMPOTENCY_KEY_TTL', default=86400)
+IDEMPOTENCY_LOCK_TIMEOUT = env.int('IDEMPOTENCY_LOCK_TIMEOUT', default=60)
+# With MOMO_QUEUE_PAYMENTS the payment endpoints save the transaction, queue
+# it and answer at once, `manage.py run_workers` processes send the queued
+# payments. Payments that reach no gateway are retried MOMO_JOB_MAX_ATTEMPTS
+# times, jobs held longer than MOMO_JOB_LOCK_TIMEOUT seconds are handed to
+# the status poller.
+MOMO_QUEUE_PAYMENTS = env.bool('MOMO_QUEUE_PAYMENTS', default=False)
+MOMO_JOB_CONCURRENCY = env.int('MOMO_JOB_CONCURRENCY', default=8)
+MOMO_JOB_MAX_ATTEMPTS = env.int('MOMO_JOB_MAX_ATTEMPTS', default=5)
+MOMO_JOB_LOCK_TIMEOUT = env.int('MOMO_JOB_LOCK_TIMEOUT', default=300)
+# The payments and disburse lists are read in pages of MOMO_PAGE_SIZE rows,
+# clients may ask for up to MOMO_MAX_PAGE_SIZE.
+MOMO_PAGE_SIZE = env.int('MOMO_PAGE_SIZE', default=100)
+MOMO_MAX_PAGE_SIZE = env.int('MOMO_MAX_PAGE_SIZE', default=1000)
+# Exports read MOMO_EXPORT_CHUNK_SIZE rows per database round-trip.
+MOMO_EXPORT_CHUNK_SIZE = env.int('MOMO_EXPORT_CHUNK_SIZE', default=2000)
+# API tokens are resolved to their user once per API_TOKEN_CACHE_TTL seconds
+# and kept in the API_TOKEN_CACHE django cache (default cache when empty).
+API_TOKEN_CACHE = env('API_TOKEN_CACHE', default='')
+API_TOKEN_CACHE_TTL = env.int('API_TOKEN_CACHE_TTL', default=300)
+# Users looked up by the API are kept in process memory for
+# API_USER_CACHE_TTL seconds, at most API_USER_CACHE_SIZE of them.
+API_USER_CACHE_TTL = env.int('API_USER_CACHE_TTL', default=300)
+API_USER_CACHE_SIZE = env.int('API_USER_CACHE_SIZE', default=1000)
+# Lets payment requests without an api key through, their payments belong to
+# the user with id 1 and listings are read for the api_user query parameter.
+# Only meant for sandbox setups that predate api keys.
+API_ALLOW_ANONYMOUS = env.bool('API_ALLOW_ANONYMOUS', default=False)
@@ -0,0 +1,138 @@
+# Generated by Django 5.0.1 on 2026-10-17 21:25
+
+import django.contrib.auth.models
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BusinessUser',
+            fields=[
+                ('user_ptr', models.OneToOneField(auto_created=True, on_delete=django.db.models.deletion.CASCADE, parent_link=True, primary_key=True, serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('account_number', models.CharField(blank=True, max_length=20, null=True)),
+                ('about', models.TextField(blank=True, null=True)),
+                ('country', models.CharField(default='Zambia', max_length=10)),
+                ('address', models.CharField(blank=True, default='', max_length=255, null=True)),
+                ('company', models.CharField(blank=True, default='', max_length=255, null=True)),
+                ('city', models.CharField(choices=[('kitwe', 'Kitwe'), ('lusaka', 'Lusaka'), ('ndola', 'Ndola')], default='Kitwe', max_length=9)),
+                ('profile_image', models.ImageField(blank=True, null=True, upload_to='img/profiles/')),
+                ('category', models.CharField(default='Business', max_length=9)),
+                ('bank_account_number', models.CharField(blank=True, max_length=100, null=True)),
+                ('business_category', models.CharField(choices=[('school', 'School'), ('grocery', 'Grocery'), ('independent_online_retailers', 'Independent Online Retailers'), ('other', 'Other')], default='other', max_length=30)),
+                ('facebook_url', models.CharField(blank=True, default='', max_length=250, null=True)),
+                ('linkedin_url', models.CharField(blank=True, default='', max_length=250, null=True)),
+                ('twitter_url', models.CharField(blank=True, default='', max_length=250, null=True)),
+                ('instagram_url', models.CharField(blank=True, default='', max_length=250, null=True)),
+            ],
+            options={
+                'verbose_name': 'user',
+                'verbose_name_plural': 'users',
+                'abstract': False,
+            },
+            bases=('auth.user',),
+            managers=[
+                ('objects', django.contrib.auth.models.UserManager()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Invoice',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('customer_name', models.CharField(max_length=255)),
+                ('customer_account_number', models.CharField(max_length=20)),
+                ('customer_email', models.EmailField(blank=True, max_length=254)),
+                ('reference_number', models.CharField(blank=True, max_length=50)),
+                ('due_date', models.DateField(blank=True, null=True)),
+                ('description', models.TextField(blank=True)),
+                ('total_amount', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('status', models.CharField(choices=[('pending', 'pending'), ('paid', 'paid'), ('rejected', 'rejected')], default='pending', max_length=20)),
+                ('creator', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='invoice', to='business.businessuser')),
+            ],
+            options={
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='InvoiceBusinessUser',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('reference_number', models.CharField(blank=True, max_length=50)),
+                ('due_date', models.DateField(blank=True, null=True)),
+                ('description', models.TextField(blank=True)),
+                ('total_amount', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('status', models.CharField(choices=[('pending', 'pending'), ('paid', 'paid'), ('rejected', 'rejected')], default='pending', max_length=20)),
+                ('creator', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='bill_from', to='business.businessuser')),
+                ('receiver', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='bill_to', to='business.businessuser')),
+            ],
+            options={
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='LoanCollection',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('timestamp', models.DateTimeField(auto_now_add=True)),
+                ('reference_id', models.CharField(max_length=100)),
+                ('description', models.TextField(blank=True, null=True)),
+                ('payer_account', models.CharField(max_length=10)),
+                ('status', models.CharField(choices=[('pending', 'pending'), ('success', 'success'), ('failed', 'failed')], default='pending', max_length=20)),
+                ('debtor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='loan', to='business.businessuser')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Product',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=150)),
+                ('description', models.CharField(max_length=300)),
+                ('price', models.FloatField()),
+                ('date_created', models.DateTimeField(auto_now_add=True)),
+                ('quantity', models.IntegerField()),
+                ('owner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='product', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='BNPL',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('initial_deposit', models.DecimalField(decimal_places=2, default=0, max_digits=10)),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('status', models.CharField(choices=[('pending', 'pending'), ('success', 'success'), ('failed', 'failed')], default='pending', max_length=20)),
+                ('approved_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='approvals', to=settings.AUTH_USER_MODEL)),
+                ('requested_by', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='credit', to='business.businessuser')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='bnpl', to='business.product')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Student',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('first_name', models.CharField(max_length=55)),
+                ('last_name', models.CharField(max_length=55)),
+                ('other_name', models.CharField(blank=True, max_length=100, null=True)),
+                ('address', models.CharField(blank=True, max_length=55, null=True)),
+                ('grade', models.CharField(max_length=55)),
+                ('tuition', models.FloatField(default=0)),
+                ('active', models.BooleanField(default=True)),
+                ('school', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='business.businessuser')),
+            ],
+        ),
+    ]
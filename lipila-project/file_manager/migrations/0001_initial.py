@@ -0,0 +1,26 @@
+# Generated by Django 5.0.1 on 2026-10-17 21:25
+
+import django.core.files.storage
+import django.core.files.storage.filesystem
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UploadedFile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('filename', models.CharField(max_length=255)),
+                ('upload_date', models.DateTimeField(auto_now_add=True)),
+                ('content_type', models.CharField(max_length=255)),
+                ('file', models.FileField(storage=django.core.files.storage.FileSystemStorage(), upload_to=django.core.files.storage.filesystem.FileSystemStorage.path)),
+            ],
+        ),
+    ]
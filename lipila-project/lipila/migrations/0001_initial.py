@@ -0,0 +1,87 @@
+# Generated by Django 5.0.1 on 2026-10-17 21:25
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AboutInfo',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('title', models.CharField(max_length=200)),
+                ('body', models.TextField()),
+                ('timestamp', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'get_latest_by': 'timestamp',
+            },
+        ),
+        migrations.CreateModel(
+            name='ContactInfo',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('street', models.CharField(max_length=200)),
+                ('location', models.CharField(max_length=200)),
+                ('days', models.CharField(max_length=200)),
+                ('phone1', models.CharField(max_length=200)),
+                ('phone2', models.CharField(max_length=200)),
+                ('email1', models.CharField(max_length=200)),
+                ('email2', models.CharField(max_length=200)),
+                ('hours', models.CharField(max_length=200)),
+                ('timestamp', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'get_latest_by': 'timestamp',
+            },
+        ),
+        migrations.CreateModel(
+            name='CustomerMessage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255)),
+                ('email', models.EmailField(max_length=254)),
+                ('phone', models.CharField(blank=True, default='', max_length=20, null=True)),
+                ('subject', models.CharField(max_length=255)),
+                ('message', models.TextField()),
+                ('timestamp', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'get_latest_by': 'timestamp',
+            },
+        ),
+        migrations.CreateModel(
+            name='HeroInfo',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hero_image', models.ImageField(blank=True, null=True, upload_to='img/profiles/')),
+                ('message', models.TextField()),
+                ('slogan', models.CharField(max_length=200)),
+                ('timestamp', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'get_latest_by': 'timestamp',
+            },
+        ),
+        migrations.CreateModel(
+            name='UserTestimonial',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('message', models.TextField()),
+                ('timestamp', models.DateTimeField(auto_now_add=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'get_latest_by': 'timestamp',
+            },
+        ),
+    ]
@@ -10,6 +10,32 @@ from rest_framework.response import Response
 import requests
 from django.urls import reverse
 from api.models import LipilaCollection, LipilaDisbursement
+from api.momo.singleflight import status_lookups
+from api.transactions import get_status_key
+from api.users import user_cache
+from rest_framework.authtoken.models import Token
+
+
+def get_api_headers(user, reference_id):
+    """
+    Builds the headers of a payment request made on behalf of an api user.
+
+    Args:
+        user (str): The username of the api user.
+        reference_id(str): The unique uuid id that identifies the transaction.
+
+    Returns:
+        dict: The headers or None when there is no such api user.
+    """
+    api_user = user_cache.get(username=str(user))
+    if api_user is None:
+        return None
+    token, created = Token.objects.get_or_create(user=api_user)
+    return {
+        'Authorization': f'Token {token.key}',
+        # a retry of the same payment is answered without paying twice
+        'Idempotency-Key': str(reference_id),
+    }
 
 
 def query_collection(user, method, reference_id, data={}):
@@ -38,7 +64,10 @@ def query_collection(user, method, reference_id, data={}):
         response = requests.get(url, params=params)
         return response
     elif method == 'POST':
-        response = requests.post(url, data=data, params=params)
+        headers = get_api_headers(user, reference_id)
+        if headers is None:
+            return Response({'data': 'Api user not found'}, status=401)
+        response = requests.post(url, data=data, params=params, headers=headers)
         if response.status_code == 202:
             return Response({'data': 'request accepted, wait for client approval'}, status=202)
         elif response.status_code == 403:
@@ -47,6 +76,16 @@ def query_collection(user, method, reference_id, data={}):
         elif response.status_code == 400:
             status_code = response.status_code
             return Response({'data': 'Bad request to payment gateway'}, status=status_code)
+        elif response.status_code == 429:
+            return Response({'data': 'Too many payment requests, retry later'}, status=429)
+        elif response.status_code == 503:
+            return Response({'data': 'Payment gateway unavailable'}, status=503)
+        elif response.status_code in (502, 504):
+            # the gateway may have taken the payment, the status poller finds out
+            return Response({'data': 'Payment status unknown, it is checked later'},
+                            status=response.status_code)
+        else:
+            return Response({'data': 'Payment gateway error'}, status=response.status_code)
     else:
         return Response({'data': 'Invalid method passed'}, status=400)
 
@@ -77,7 +116,10 @@ def query_disbursement(user, method, reference_id, data={}):
         response = requests.get(url, params=params)
         return response
     elif method == 'POST':
-        response = requests.post(url, data=data, params=params)
+        headers = get_api_headers(user, reference_id)
+        if headers is None:
+            return Response({'data': 'Api user not found'}, status=401)
+        response = requests.post(url, data=data, params=params, headers=headers)
         if response.status_code == 202:
             return Response({'data': 'request accepted, wait for client approval'}, status=202)
         elif response.status_code == 403:
@@ -86,6 +128,16 @@ def query_disbursement(user, method, reference_id, data={}):
         elif response.status_code == 400:
             status_code = response.status_code
             return Response({'data': 'Bad request to payment gateway'}, status=status_code)
+        elif response.status_code == 429:
+            return Response({'data': 'Too many payment requests, retry later'}, status=429)
+        elif response.status_code == 503:
+            return Response({'data': 'Payment gateway unavailable'}, status=503)
+        elif response.status_code in (502, 504):
+            # the gateway may have taken the payment, the status poller finds out
+            return Response({'data': 'Payment status unknown, it is checked later'},
+                            status=response.status_code)
+        else:
+            return Response({'data': 'Payment gateway error'}, status=response.status_code)
     else:
         return Response({'data': 'Invalid method passed'}, status=400)
 
@@ -100,6 +152,37 @@ def check_payment_status(reference_id:str, transaction:str)->str:
 
     Returns: status (str) options [success, failed, pending]
     """
+    if transaction not in ('col', 'dis'):
+        return None
+    # concurrent checks of a transaction share one query
+    return status_lookups.do(
+        get_status_key(transaction, reference_id),
+        lambda: _get_payment_status(reference_id, transaction),
+        keep=lambda status: status != 'transaction id not found')
+
+
+def is_payment_pending(response, reference_id: str, transaction: str) -> bool:
+    """
+    Checks whether a payment sent with query_collection or query_disbursement
+    is waiting for its final status, set later by the status poller.
+
+    Args:
+        response: The Response returned by query_collection or query_disbursement.
+        reference_id(str): The uuid that identifies the transaction.
+        transaction(str): The type of transaction. options are (col, dis)
+
+    Returns:
+        bool: True when the payment was accepted or its outcome is unknown.
+    """
+    if response.status_code == 202:
+        return True
+    if response.status_code in (502, 504):
+        # the api fails the payments the gateway refused and polls the others
+        return check_payment_status(reference_id, transaction) != 'failed'
+    return False
+
+
+def _get_payment_status(reference_id: str, transaction: str) -> str:
     status = ''
     if transaction == 'col':
         try:
@@ -193,12 +276,7 @@ def get_user_object(user: str):
         A user_object instance(BusinessUser or CreatorProfile or LipilauSE or)
          otherwise returns 404.
     """
-    data = {}
-    try:
-        user_object = User.objects.get(username=user)
-        return user_object
-    except User.DoesNotExist:
-        return None
+    return user_cache.get(username=str(user))
 
 
 def apology(request, data=None, user=None):
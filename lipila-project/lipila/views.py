@@ -11,7 +11,7 @@ from api.utils import generate_reference_id
 from lipila.utils import (
     apology, get_lipila_contact_info,
     get_lipila_index_page_info, get_testimonials, get_lipila_about_info,
-    query_disbursement, check_payment_status)
+    query_disbursement, is_payment_pending)
 from lipila.forms.forms import ContactForm
 from accounts.models import CreatorProfile
 from patron.models import WithdrawalRequest, Payments, ProcessedWithdrawals
@@ -118,8 +118,10 @@ def approve_withdrawals(request):
                     response = query_disbursement(
                         request.user, 'POST', reference_id, data=payload)
 
-                    if response.status_code == 202:
+                    if is_payment_pending(response, reference_id, 'dis'):
+                        # the final status is set by the status poller
                         withdrawal_request.status = 'accepted'
+                        withdrawal_request.reference_id = reference_id
                         withdrawal_request.processed_date = timezone.now()
                         withdrawal_request.save()
 
@@ -127,12 +129,6 @@ def approve_withdrawals(request):
                         processed_withdrawals.approved_by = request.user
                         processed_withdrawals.status = 'accepted'
                         processed_withdrawals.save()
-                        # consider making an async function
-                        if check_payment_status(reference_id, 'dis') == 'success':
-                            withdrawal_request.status = 'success'
-                            processed_withdrawals.status = 'success'
-                            withdrawal_request.save()
-                            processed_withdrawals.save()
                         messages.success(
                             request, f"Withdrawal request for {withdrawal_request.creator.user.username} approved successfully.")
                         return JsonResponse({'message': 'Payment initiated successfully'})
@@ -5,6 +5,7 @@ from api.utils import generate_reference_id
 # Options
 STATUS_CHOICES = (
     ('pending', 'pending'),
+    ('accepted', 'accepted'),
     ('success', 'success'),
     ('failed', 'failed'),
     ('rejected', 'rejected'),
@@ -98,6 +99,10 @@ class Payments(models.Model):
     description = models.CharField(max_length=200, null=True, blank=True)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
 
+    class Meta:
+        # a creator's payments by status, amount makes the totals index only
+        indexes = [models.Index(fields=['subscription', 'status', 'amount'])]
+
     def __str__(self):
         return f"{self.subscription}"
 
@@ -115,6 +120,10 @@ class Contributions(models.Model):
     timestamp = models.DateTimeField(auto_now_add=True)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
 
+    class Meta:
+        # a creator's contributions by status, amount makes the totals index only
+        indexes = [models.Index(fields=['creator', 'status', 'amount'])]
+
     def __str__(self):
         return f"{self.amount}"
 
@@ -125,12 +134,16 @@ class WithdrawalRequest(models.Model):
         CreatorProfile, on_delete=models.CASCADE, related_name='withdrawal_requests')
     amount = models.DecimalField(max_digits=10, decimal_places=2)
     account_number = models.CharField(max_length=30)
-    # reference_id = models.CharField(max_length=120, unique=True, blank=False, null=False)
+    reference_id = models.CharField(max_length=120, unique=True, blank=True, null=True)
     request_date = models.DateTimeField(auto_now_add=True)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES , default='pending')
     payment_method = models.CharField(max_length=20, choices=PAYMENT_CHOICES , default='')
     reason = models.CharField(max_length=100, null=True, blank=True)
 
+    class Meta:
+        # a creator's withdrawals by status, amount makes the totals index only
+        indexes = [models.Index(fields=['creator', 'status', 'amount'])]
+
     def __str__(self):
         processed = True if self.processed_date else False
         return f"By - {self.creator.user.username} - Amount: {self.amount} - Processed - {self.processed_date}"
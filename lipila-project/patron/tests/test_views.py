@@ -1,12 +1,15 @@
 from django.contrib.auth.models import User
-from django.test import TestCase, Client
+from django.test import TestCase, Client, override_settings
 from django.urls import reverse
 from django.contrib.messages import get_messages
 from unittest.mock import Mock, patch
+from urllib.parse import urlencode, urlparse
 import json
+from rest_framework.test import APIClient
 # Custom models
 from accounts.models import PatronProfile, CreatorProfile
 from patron.models import Tier, TierSubscriptions, Payments, Contributions
+from api.models import LipilaCollection
 
 
 class TestPatronViewsMore(TestCase):
@@ -167,7 +170,7 @@ class TestSubscription(TestCase):
         response = self.client.post(url, data=data)
         self.assertEqual(response.status_code, 302)
         messages = list(get_messages(response.wsgi_request))
-        self.assertEqual(str(messages[0]), 'Paid ZMW 100 successfully!')
+        self.assertEqual(str(messages[0]), 'Payment of ZMW 100 initiated, approve it on your phone.')
         self.assertEqual(Payments.objects.count(), 1)
 
     @patch('patron.views.query_collection')
@@ -207,7 +210,7 @@ class TestSubscription(TestCase):
         response = self.client.post(url, data=data)
         self.assertEqual(response.status_code, 302)
         messages = list(get_messages(response.wsgi_request))
-        self.assertEqual(str(messages[0]), 'Payment of K100 successfull!')
+        self.assertEqual(str(messages[0]), 'Payment of K100 initiated, approve it on your phone.')
         self.assertEqual(Contributions.objects.count(), 1)
         conts = Contributions.objects.filter(patron=user1)
 
@@ -449,3 +452,70 @@ class TestCreateDefaultTiers(TestCase):
         messages = list(get_messages(response.wsgi_request))
         self.assertEqual(
             str(messages[1]), "Default tiers created. Please edit them.")
+
+
+@override_settings(API_ALLOW_ANONYMOUS=False, MOMO_QUEUE_PAYMENTS=False)
+class TestMakePaymentFlow(TestCase):
+    """Runs a payment through the patron view and the lipila api"""
+
+    def setUp(self):
+        self.api_user = User.objects.create(pk=1, username='lipila')
+        creator_user = User.objects.create(username='flowcreator')
+        creator = CreatorProfile.objects.create(
+            user=creator_user, patron_title='flowpatron', about='test', creator_category='musician')
+        Tier().create_default_tiers(creator)
+        self.tier = Tier.objects.filter(creator=creator).first()
+        self.patron = User.objects.create(username='flowpatron')
+        TierSubscriptions.objects.create(patron=self.patron, tier=self.tier)
+        self.api = APIClient()
+
+    def forward(self, url, data, params, headers):
+        """Sends the request of query_collection to the api in process"""
+        path = f"{urlparse(url).path}?{urlencode(params)}"
+        return self.api.post(path, data, headers=headers)
+
+    def make_payment(self):
+        self.client.force_login(self.patron)
+        url = reverse('patron:make_payment', kwargs={'tier_id': self.tier.id})
+        data = {'amount': '100', 'payer_account_number': '0966443322',
+                'payment_method': 'mtn', 'description': 'testdescription'}
+        with patch('lipila.utils.requests.post', side_effect=self.forward):
+            return self.client.post(url, json.dumps(data), content_type='application/json')
+
+    @patch('api.views.router.send')
+    def test_make_payment_with_anonymous_access_off(self, mock_send):
+        mock_send.return_value = ('mtn', Mock(status_code=202))
+        response = self.make_payment()
+
+        self.assertEqual(response.json()['message'], 'Payment initiated successfully')
+        self.assertEqual(Payments.objects.get().status, 'accepted')
+        collection = LipilaCollection.objects.get()
+        self.assertEqual(collection.api_user, self.api_user)
+        self.assertEqual(collection.status, 'accepted')
+
+    @patch('api.views.router.send')
+    def test_unknown_outcome_is_polled(self, mock_send):
+        mock_send.return_value = ('mtn', Mock(status_code=504))
+        response = self.make_payment()
+
+        self.assertEqual(response.json()['message'], 'Payment initiated successfully')
+        self.assertEqual(Payments.objects.get().status, 'accepted')
+        self.assertEqual(LipilaCollection.objects.get().status, 'accepted')
+
+    @patch('api.views.router.send')
+    def test_refused_payment_fails(self, mock_send):
+        mock_send.return_value = ('mtn', Mock(status_code=409))
+        response = self.make_payment()
+
+        self.assertEqual(response.json()['message'], 'Payment failed')
+        self.assertEqual(Payments.objects.get().status, 'failed')
+        self.assertEqual(LipilaCollection.objects.get().status, 'failed')
+
+    @patch('api.views.router.send')
+    def test_rate_limited_payment_fails(self, mock_send):
+        mock_send.return_value = (None, Mock(status_code=429))
+        response = self.make_payment()
+
+        self.assertEqual(response.json()['message'], 'Payment failed')
+        self.assertEqual(Payments.objects.get().status, 'failed')
+        self.assertFalse(LipilaCollection.objects.exists())
@@ -14,7 +14,7 @@ import json
 from api.utils import generate_reference_id
 from accounts.models import CreatorProfile, PatronProfile
 from business.models import Product
-from lipila.utils import get_user_object, apology, query_collection, check_payment_status
+from lipila.utils import get_user_object, apology, query_collection, is_payment_pending
 from patron.forms.forms import (
     CreatePatronProfileForm, CreateCreatorProfileForm, EditTiersForm, WithdrawalRequestForm)
 from patron.forms.forms import DefaultUserChangeForm, EditCreatorProfileForm
@@ -475,14 +475,11 @@ def make_payment(request, tier_id):
             response = query_collection(
                 api_user.username, 'POST', reference_id, data=payload)
 
-            if response.status_code == 202:
+            if is_payment_pending(response, reference_id, 'col'):
+                # the final status is set by the status poller
                 payment.status = 'accepted'
                 payment.save()
-                # consider making an async function
-                if check_payment_status(reference_id, 'col') == 'success':
-                    payment.status = 'success'
-                    payment.save()
-                messages.success(request, f"Paid ZMW {amount} successfully!")
+                messages.success(request, f"Payment of ZMW {amount} initiated, approve it on your phone.")
                 return JsonResponse({'message': 'Payment initiated successfully', 'reference_id': reference_id})
             else:
                 payment.status = 'failed'
@@ -532,15 +529,12 @@ def contribute(request, tier_id):
             api_user = User.objects.get(pk=1)
             response = query_collection(
                 api_user.username, 'POST', reference_id, data=payload)
-            if response.status_code == 202:
+            if is_payment_pending(response, reference_id, 'col'):
+                # the final status is set by the status poller
                 contribution.status = 'accepted'
                 contribution.save()
-                # consider making an async function
-                if check_payment_status(reference_id, 'col') == 'success':
-                    contribution.status = 'success'
-                    contribution.save()
                 messages.success(
-                    request, f"Payment of K{contribution.amount} successfull!")
+                    request, f"Payment of K{contribution.amount} initiated, approve it on your phone.")
                 return JsonResponse({'message': 'Payment initiated successfully', 'reference_id': reference_id})
             else:
                 contribution.status = 'failed'